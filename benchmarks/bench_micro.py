@@ -0,0 +1,393 @@
+"""Micro-benchmarks for cloudknot's serialization, templating and config paths
+
+This script times the client-side hot paths that every map call or resource
+touches:
+    - cloudpickle.dumps of typical `iterdata` shapes: a list of tuples, a
+      NumPy array and a pandas DataFrame (skipped if NumPy or pandas are
+      not installed)
+    - pickle.loads of typical function outputs, as done when collecting
+      results
+    - `cloudknot.config.add_resource` and a config file read, for config
+      files holding 10 to 100k entries
+    - `get_region` and `get_profile`
+    - `DockerImage._write_script` and `DockerImage._write_dockerfile`
+    - pipreqs import resolution of a generated script. PyPI lookups with
+      `pipreqs.get_imports_info` are only timed with --network.
+
+Each benchmark is calibrated so that one batch of calls takes at least
+--min-time seconds and the best of --repeat batches is reported per call.
+
+Every run is appended as one JSON line to a history file, recording the git
+revision, python version and platform. The history file sits next to the
+cloudknot config file, ~/.aws/cloudknot.micro_history.jsonl by default, so
+that runs leave the source tree clean. With --compare, each result is
+compared against the most recent history entry from the same python version
+and platform, and with --check the script exits with a nonzero status if
+any benchmark is slower than that baseline by more than --tolerance.
+
+Usage
+-----
+    python benchmarks/bench_micro.py
+    python benchmarks/bench_micro.py --filter config --compare
+    python benchmarks/bench_micro.py --compare --check --tolerance 0.25
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import datetime
+import json
+import os
+import pickle
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+
+def default_history_file():
+    """Return the history file next to the cloudknot config file"""
+    config_file = os.environ.get(
+        'CLOUDKNOT_CONFIG_FILE',
+        os.path.join(os.path.expanduser('~'), '.aws', 'cloudknot')
+    )
+    return os.path.abspath(config_file) + '.micro_history.jsonl'
+
+
+BENCH_CONFIG = """[aws]
+configured = True
+region = us-east-1
+s3-bucket = cloudknot-benchmark
+s3-bucket-policy = cloudknot-benchmark-policy
+s3-sse = None
+"""
+
+
+def measure(func, min_time=0.2, repeat=3):
+    """Time func and return the best and mean seconds per call
+
+    Parameters
+    ----------
+    func : callable
+        Function to time, called with no arguments
+
+    min_time : float
+        Minimum duration in seconds of one batch of calls.
+        Default: 0.2
+
+    repeat : int
+        Number of batches to run.
+        Default: 3
+
+    Returns
+    -------
+    timing : dict
+        best_s and mean_s seconds per call and the number of calls per batch
+    """
+    number = 1
+    while True:
+        start = time.time()
+        for _ in range(number):
+            func()
+        elapsed = time.time() - start
+        if elapsed >= min_time:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+
+    batches = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.time()
+        for _ in range(number):
+            func()
+        batches.append((time.time() - start) / number)
+
+    return {'best_s': min(batches), 'mean_s': sum(batches) / len(batches),
+            'number': number}
+
+
+def write_config(path, num_entries):
+    """Write a config file with num_entries job entries in one section"""
+    with open(path, 'w') as f:
+        f.write(BENCH_CONFIG)
+        f.write('\n[knot bench]\n')
+        for i in range(num_entries):
+            f.write('job-{0:d} = {1:032x}\n'.format(i, i))
+
+
+def bench_func(x):
+    import boto3
+    import cloudpickle
+    return boto3, cloudpickle, x
+
+
+def serialization_benchmarks():
+    """Yield (name, callable) pairs for the serialization benchmarks"""
+    import cloudpickle
+
+    tuples = [(i, float(i), 'element-{0:d}'.format(i))
+              for i in range(10000)]
+    yield ('cloudpickle.dumps[list_of_tuples-10000]',
+           lambda: cloudpickle.dumps(tuples))
+
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
+
+    if np is not None:
+        array = np.random.random((1000, 1000))
+        yield ('cloudpickle.dumps[ndarray-1000x1000]',
+               lambda: cloudpickle.dumps(array))
+
+        arrays = [np.random.random(1000) for _ in range(1000)]
+        yield ('cloudpickle.dumps[list_of_ndarray-1000x1000]',
+               lambda: cloudpickle.dumps(arrays))
+
+    try:
+        import pandas as pd
+    except ImportError:
+        pd = None
+
+    if pd is not None and np is not None:
+        frame = pd.DataFrame(np.random.random((100000, 10)),
+                             columns=['c{0:d}'.format(i) for i in range(10)])
+        yield ('cloudpickle.dumps[dataframe-100000x10]',
+               lambda: cloudpickle.dumps(frame))
+
+    scalar_output = cloudpickle.dumps(3.14159)
+    yield 'pickle.loads[float]', lambda: pickle.loads(scalar_output)
+
+    dict_output = cloudpickle.dumps(
+        {'result-{0:d}'.format(i): float(i) for i in range(1000)}
+    )
+    yield 'pickle.loads[dict-1000]', lambda: pickle.loads(dict_output)
+
+    if np is not None:
+        array_output = cloudpickle.dumps(np.random.random((1000, 1000)))
+        yield ('pickle.loads[ndarray-1000x1000]',
+               lambda: pickle.loads(array_output))
+
+
+def config_benchmarks(work_dir, sizes):
+    """Yield (name, callable) pairs for the config benchmarks"""
+    from six.moves import configparser
+    import cloudknot as ck
+
+    for size in sizes:
+        config_file = os.path.join(work_dir, 'cloudknot-{0:d}'.format(size))
+        write_config(config_file, size)
+
+        def use_config(config_file=config_file):
+            os.environ['CLOUDKNOT_CONFIG_FILE'] = config_file
+
+        def read(config_file=config_file):
+            use_config(config_file)
+            config = configparser.ConfigParser()
+            with ck.config.rlock:
+                config.read(ck.config.get_config_file())
+            return config
+
+        def add(config_file=config_file):
+            use_config(config_file)
+            ck.config.add_resource('knot bench', 'job-new', 'value')
+
+        yield 'config.read[{0:d}]'.format(size), read
+        yield 'config.add_resource[{0:d}]'.format(size), add
+
+    config_file = os.path.join(work_dir, 'cloudknot-small')
+    write_config(config_file, 10)
+
+    def region():
+        os.environ['CLOUDKNOT_CONFIG_FILE'] = config_file
+        return ck.get_region()
+
+    def profile():
+        os.environ['CLOUDKNOT_CONFIG_FILE'] = config_file
+        return ck.get_profile()
+
+    yield 'get_region', region
+    yield 'get_profile', profile
+
+
+def dockerimage_benchmarks(work_dir, network):
+    """Yield (name, callable) pairs for the DockerImage and pipreqs paths"""
+    from pipreqs import pipreqs
+    import cloudknot as ck
+
+    build_path = os.path.join(work_dir, 'bench-image')
+    os.makedirs(build_path)
+
+    # Assemble a DockerImage without DockerImage.__init__, which would also
+    # resolve imports and write to the config file
+    image = ck.DockerImage.__new__(ck.DockerImage)
+    image._name = 'bench-image'
+    image._func = bench_func
+    image._build_path = build_path
+    image._script_path = os.path.join(build_path, 'bench-image.py')
+    image._docker_path = os.path.join(build_path, 'Dockerfile')
+    image._req_path = os.path.join(build_path, 'requirements.txt')
+    image._base_image = 'python:3' if sys.version_info[0] == 3 else 'python:2'
+    image._username = 'cloudknot-user'
+    image._github_installs = []
+
+    yield 'DockerImage._write_script', image._write_script
+    yield 'DockerImage._write_dockerfile', image._write_dockerfile
+
+    image._write_script()
+    yield ('pipreqs.get_all_imports',
+           lambda: pipreqs.get_all_imports(build_path))
+
+    if network:
+        import_names = pipreqs.get_all_imports(build_path)
+        yield ('pipreqs.get_imports_info',
+               lambda: pipreqs.get_imports_info(import_names))
+
+
+def git_revision():
+    """Return the git revision of this checkout, or None"""
+    try:
+        output = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=open(os.devnull, 'w')
+        )
+        return output.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def read_history(path):
+    """Return the list of runs recorded in the history file"""
+    if not os.path.isfile(path):
+        return []
+
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def find_baseline(history, python, system):
+    """Return the most recent run from the same python and platform"""
+    for run in reversed(history):
+        if run['python'] == python and run['platform'] == system:
+            return run
+    return None
+
+
+def print_results(results, baseline, tolerance):
+    """Print the results table and return the names of regressions"""
+    regressions = []
+    print('{:<48s} {:>12s} {:>10s} {:>10s}'.format(
+        'benchmark', 'best us', 'calls', 'vs base'
+    ))
+    for name, timing in results.items():
+        ratio = ''
+        base = baseline['results'].get(name) if baseline else None
+        if base:
+            r = timing['best_s'] / base['best_s']
+            ratio = '{:.2f}x'.format(r)
+            if r > 1 + tolerance:
+                ratio += ' !'
+                regressions.append(name)
+
+        print('{:<48s} {:>12.1f} {:>10d} {:>10s}'.format(
+            name, timing['best_s'] * 1e6, timing['number'], ratio
+        ))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--config-sizes', type=int, nargs='+',
+                        default=[10, 100, 1000, 10000, 100000],
+                        help='Numbers of entries in the benchmarked config '
+                             'files')
+    parser.add_argument('--filter', default=None,
+                        help='Only run benchmarks whose name contains this '
+                             'string')
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='Minimum seconds per batch of calls')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of batches per benchmark')
+    parser.add_argument('--network', action='store_true',
+                        help='Also time PyPI lookups in '
+                             'pipreqs.get_imports_info')
+    parser.add_argument('--history', default=default_history_file(),
+                        help='JSON lines file to which results are appended. '
+                             'Default: next to the cloudknot config file')
+    parser.add_argument('--no-save', action='store_true',
+                        help='Do not append this run to the history file')
+    parser.add_argument('--compare', action='store_true',
+                        help='Compare against the most recent run in the '
+                             'history file from the same python and '
+                             'platform')
+    parser.add_argument('--check', action='store_true',
+                        help='With --compare, exit with status 1 if any '
+                             'benchmark regressed by more than --tolerance')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed fractional slowdown relative to the '
+                             'baseline')
+    args = parser.parse_args()
+
+    python = platform.python_version()
+    system = platform.platform()
+    history = read_history(args.history)
+    baseline = find_baseline(history, python, system) if args.compare \
+        else None
+
+    work_dir = tempfile.mkdtemp(prefix='cloudknot-micro-')
+    old_config = os.environ.get('CLOUDKNOT_CONFIG_FILE')
+    os.environ['CLOUDKNOT_CONFIG_FILE'] = os.path.join(work_dir, 'cloudknot')
+    write_config(os.environ['CLOUDKNOT_CONFIG_FILE'], 0)
+
+    results = OrderedDict()
+    try:
+        benchmarks = [
+            serialization_benchmarks(),
+            config_benchmarks(work_dir, args.config_sizes),
+            dockerimage_benchmarks(work_dir, args.network),
+        ]
+        for group in benchmarks:
+            for name, func in group:
+                if args.filter and args.filter not in name:
+                    continue
+                results[name] = measure(func, min_time=args.min_time,
+                                        repeat=args.repeat)
+    finally:
+        if old_config is None:
+            del os.environ['CLOUDKNOT_CONFIG_FILE']
+        else:
+            os.environ['CLOUDKNOT_CONFIG_FILE'] = old_config
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    regressions = print_results(results, baseline, args.tolerance)
+
+    if not args.no_save:
+        run = {
+            'timestamp': datetime.datetime.utcnow().isoformat(),
+            'revision': git_revision(),
+            'python': python,
+            'platform': system,
+            'results': results,
+        }
+        history_dir = os.path.dirname(os.path.abspath(args.history))
+        if not os.path.isdir(history_dir):
+            os.makedirs(history_dir)
+        with open(args.history, 'a') as f:
+            f.write(json.dumps(run, sort_keys=True) + '\n')
+
+    if args.compare and baseline is None:
+        print('No baseline found for python {0:s} on {1:s}'.format(python,
+                                                                   system))
+
+    if args.check and regressions:
+        print('Regressions beyond {0:.0%}: {1:s}'.format(
+            args.tolerance, ', '.join(regressions)
+        ))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
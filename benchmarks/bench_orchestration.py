@@ -0,0 +1,326 @@
+"""End-to-end orchestration benchmarks against emulated AWS clients
+
+This script drives `Knot.map`, `BatchJob.result`, job adoption (as done by
+`Knot` when it is re-instantiated from the config file) and `Knot.clobber`
+against the emulated Batch, S3 and IAM clients in `cloudknot.emulator`,
+with configurable per-call latency and throttling. Job attempts are
+executed in-process by a trivial runner, so the measurements reflect the
+cloudknot client, not the containers.
+
+For each number of jobs, it reports
+    - submits/s : input elements submitted per second by `Knot.map`
+    - describe calls per job : describe_jobs calls per input element
+    - S3 bytes moved : bytes put to and read from the emulated bucket by
+      the client and the runner. The input bytes that real containers
+      would download, once per child, are reported separately as
+      container_input_bytes.
+    - client CPU time : CPU seconds of the benchmark process per phase.
+      This includes the emulator's bookkeeping, which is small.
+    - peak RSS : maximum resident set size of the benchmark process
+
+Each size runs in a fresh subprocess with its own cloudknot config file so
+that peak RSS and the config file contents are not shared between sizes.
+
+Usage
+-----
+    python benchmarks/bench_orchestration.py --sizes 10 1000 10000 100000
+    python benchmarks/bench_orchestration.py --latency 0.02 \
+        --max-call-rate 20 --output results.json
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import json
+import os
+import pickle
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_CONFIG = """[aws]
+configured = True
+region = us-east-1
+s3-bucket = cloudknot-benchmark
+s3-bucket-policy = cloudknot-benchmark-policy
+s3-sse = None
+
+[knot bench]
+job_ids =
+map_ids =
+"""
+
+
+class InputCachingRunner(object):
+    """Emulator runner that mimics the container script in-process
+
+    Each job's input is read from the emulated bucket only once. The number
+    of input bytes that real containers would have downloaded, once per
+    child, is tallied in `container_input_bytes`.
+    """
+    def __init__(self, s3):
+        self._s3 = s3
+        self._inputs = {}
+        self.container_input_bytes = 0
+
+    def __call__(self, image, command, environment):
+        bucket = command[-1]
+        array_job = '--arrayjob' in command
+        job_id = environment['AWS_BATCH_JOB_ID'].split(':')[0]
+        prefix = '/'.join(['cloudknot.jobs',
+                           environment['CLOUDKNOT_S3_JOBDEF_KEY'], job_id])
+
+        if job_id not in self._inputs:
+            response = self._s3.get_object(Bucket=bucket,
+                                           Key=prefix + '/input.pickle')
+            body = response['Body'].read()
+            self._inputs[job_id] = (pickle.loads(body), len(body))
+
+        input_, input_size = self._inputs[job_id]
+        self.container_input_bytes += input_size
+
+        if array_job:
+            index = environment['AWS_BATCH_JOB_ARRAY_INDEX']
+            input_ = input_[int(index)]
+        else:
+            index = '0'
+
+        key = '/'.join([prefix, index,
+                        '{0:03d}'.format(
+                            int(environment['AWS_BATCH_JOB_ATTEMPT'])
+                        ),
+                        'output.pickle'])
+        self._s3.put_object(Bucket=bucket, Key=key,
+                            Body=pickle.dumps(input_, protocol=2))
+        return 0
+
+
+class NullResource(object):
+    """Stand-in for resources that the emulator does not cover"""
+    def clobber(self):
+        pass
+
+
+def cpu_time():
+    """Return the user plus system CPU seconds used by this process"""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def peak_rss_mb():
+    """Return the peak resident set size of this process in MB"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return rss / 2 ** 20 if sys.platform == 'darwin' else rss / 2 ** 10
+
+
+def run_single(args):
+    """Benchmark one number of jobs in this process and return the metrics"""
+    import cloudknot as ck
+
+    ck.aws.BatchJob._poll_interval = args.poll_interval
+
+    metrics = {'num_jobs': args.single, 'job_type': args.job_type,
+               'latency': args.latency, 'max_call_rate': args.max_call_rate,
+               'concurrency': args.concurrency}
+    phases = {}
+
+    runner = {}
+    with ck.emulator.AwsEmulator(
+        concurrency=args.concurrency, latency=args.latency,
+        max_call_rate=args.max_call_rate, max_array_size=None,
+        runner=lambda *a: runner['runner'](*a)
+    ) as emu:
+        runner['runner'] = InputCachingRunner(emu.s3)
+
+        bucket = ck.get_s3_params().bucket
+        response = emu.batch.register_job_definition(
+            jobDefinitionName='bench-jd', type='container',
+            containerProperties={
+                'image': 'bench-image', 'vcpus': 1, 'memory': 100,
+                'user': 'cloudknot-user', 'jobRoleArn': 'bench-role',
+                'environment': [
+                    {'name': 'CLOUDKNOT_JOBS_S3_BUCKET', 'value': bucket},
+                    {'name': 'CLOUDKNOT_S3_JOBDEF_KEY', 'value': 'bench-jd'},
+                ]
+            },
+            retryStrategy={'attempts': 1}
+        )
+        emu.batch.create_job_queue(jobQueueName='bench-jq', priority=1)
+
+        # Assemble a Knot from emulated resources. Knot.__init__ would also
+        # create roles, networking, a compute environment and a Docker image
+        knot = ck.Knot.__new__(ck.Knot)
+        knot._name = 'bench'
+        knot._knot_name = 'knot bench'
+        knot._clobbered = False
+        knot._region = ck.get_region()
+        knot._profile = ck.get_profile()
+        knot._pars = None
+        knot._docker_image = None
+        knot._docker_repo = None
+        knot._job_definition = ck.aws.JobDefinition(
+            arn=response['jobDefinitionArn']
+        )
+        knot._job_queue = ck.aws.JobQueue(name='bench-jq')
+        knot._compute_environment = NullResource()
+        knot._jobs = []
+        knot._job_ids = []
+        knot._map_ids = []
+
+        def phase(name, func):
+            for client in [emu.batch, emu.s3, emu.iam]:
+                client.reset_stats()
+            wall, cpu = time.time(), cpu_time()
+            result = func()
+            phases[name] = {
+                'wall_s': time.time() - wall,
+                'cpu_s': cpu_time() - cpu,
+                'batch_calls': dict(emu.batch.call_counts),
+                's3_calls': dict(emu.s3.call_counts),
+                'iam_calls': dict(emu.iam.call_counts),
+                'throttled_calls': sum(
+                    sum(c.throttled_calls.values())
+                    for c in [emu.batch, emu.s3, emu.iam]
+                ),
+                's3_bytes_uploaded': emu.s3.bytes_uploaded,
+                's3_bytes_downloaded': emu.s3.bytes_downloaded,
+            }
+            return result
+
+        n = args.single
+        futures = phase('submit', lambda: knot.map(range(n),
+                                                   job_type=args.job_type))
+
+        if args.job_type == 'array':
+            results = phase('result', futures.result)
+        else:
+            results = phase('result', lambda: [f.result() for f in futures])
+
+        assert results == list(range(n))
+
+        # This mirrors the job adoption in Knot.__init__
+        phase('adopt', lambda: [ck.aws.BatchJob(job_id=jid)
+                                for jid in knot.job_ids])
+
+        phase('clobber', knot.clobber)
+
+        metrics['container_input_bytes'] = \
+            runner['runner'].container_input_bytes
+
+    submit = phases['submit']
+    result = phases['result']
+    metrics['submits_per_s'] = n / submit['wall_s']
+    metrics['describe_calls_per_job'] = (
+        sum(p['batch_calls'].get('describe_jobs', 0)
+            for p in phases.values()) / n
+    )
+    metrics['s3_bytes_moved'] = sum(
+        p['s3_bytes_uploaded'] + p['s3_bytes_downloaded']
+        for p in phases.values()
+    )
+    metrics['client_cpu_s'] = sum(p['cpu_s'] for p in phases.values())
+    metrics['peak_rss_mb'] = peak_rss_mb()
+    metrics['result_wall_s'] = result['wall_s']
+    metrics['phases'] = phases
+    return metrics
+
+
+def run_all(args):
+    """Benchmark each size in a fresh subprocess and collect the metrics"""
+    all_metrics = []
+    for size in args.sizes:
+        work_dir = tempfile.mkdtemp(prefix='cloudknot-bench-')
+        config_file = os.path.join(work_dir, 'cloudknot')
+        with open(config_file, 'w') as f:
+            f.write(BENCH_CONFIG)
+
+        env = dict(os.environ)
+        env['CLOUDKNOT_CONFIG_FILE'] = config_file
+        env['HOME'] = work_dir
+
+        command = [
+            sys.executable, os.path.abspath(__file__),
+            '--single', str(size), '--job-type', args.job_type,
+            '--latency', str(args.latency),
+            '--concurrency', str(args.concurrency),
+            '--poll-interval', str(args.poll_interval),
+        ]
+        if args.max_call_rate:
+            command += ['--max-call-rate', str(args.max_call_rate)]
+
+        try:
+            output = subprocess.check_output(command, env=env,
+                                             cwd=work_dir)
+            metrics = json.loads(output.decode().strip().splitlines()[-1])
+        except subprocess.CalledProcessError as e:
+            metrics = {'num_jobs': size, 'error': e.returncode}
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        all_metrics.append(metrics)
+        print_row(metrics)
+
+    return all_metrics
+
+
+HEADER = ('{:>8s} {:>12s} {:>14s} {:>14s} {:>12s} {:>10s} {:>10s}'.format(
+    'jobs', 'submits/s', 'describe/job', 'S3 MB moved', 'client CPU s',
+    'result s', 'RSS MB'
+))
+
+
+def print_row(m):
+    """Print one row of the results table"""
+    if 'error' in m:
+        print('{:>8d} failed with exit code {:d}'.format(m['num_jobs'],
+                                                         m['error']))
+        return
+
+    print('{:>8d} {:>12.1f} {:>14.3f} {:>14.3f} {:>12.2f} {:>10.2f} '
+          '{:>10.1f}'.format(m['num_jobs'], m['submits_per_s'],
+                             m['describe_calls_per_job'],
+                             m['s3_bytes_moved'] / 2 ** 20,
+                             m['client_cpu_s'], m['result_wall_s'],
+                             m['peak_rss_mb']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10, 1000, 10000, 100000],
+                        help='Numbers of jobs (input elements) to benchmark')
+    parser.add_argument('--job-type', choices=['array', 'independent'],
+                        default='array', help='Knot.map job_type')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds of latency added to each AWS call')
+    parser.add_argument('--max-call-rate', type=float, default=None,
+                        help='Calls per second per operation before calls '
+                             'are throttled')
+    parser.add_argument('--concurrency', type=int, default=16,
+                        help='Number of job attempts run at once')
+    parser.add_argument('--poll-interval', type=float, default=0.1,
+                        help='Seconds between job status checks in '
+                             'BatchJob.result')
+    parser.add_argument('--output', default=None,
+                        help='Write all metrics to this JSON file')
+    parser.add_argument('--single', type=int, default=None,
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single is not None:
+        print(json.dumps(run_single(args)))
+        return
+
+    print(HEADER)
+    all_metrics = run_all(args)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(all_metrics, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,15 @@
 from __future__ import absolute_import, division, print_function
 
-import errno
 import logging
 import os
 import subprocess
 
+from . import analytics  # noqa
 from . import aws  # noqa
 from . import config  # noqa
+from . import emulator  # noqa
+from . import log  # noqa
+from . import requirements  # noqa
 from .aws.base_classes import get_profile, set_profile, list_profiles  # noqa
 from .aws.base_classes import get_region, set_region  # noqa
 from .aws.base_classes import get_ecr_repo, set_ecr_repo  # noqa
@@ -14,6 +17,7 @@ from .aws.base_classes import get_s3_params, set_s3_params  # noqa
 from .aws.base_classes import refresh_clients  # noqa
 from .cloudknot import *  # noqa
 from .dockerimage import *  # noqa
+from .local import *  # noqa
 from .version import __version__  # noqa
 
 try:
@@ -37,31 +41,12 @@ if "CLOUDKNOT_LOGLEVEL" in os.environ:
 else:
     module_logger.setLevel(logging.WARNING)
 
-# create a file handler
-logpath = os.path.join(os.path.expanduser('~'), '.cloudknot', 'cloudknot.log')
-
-# Create the config directory if it doesn't exist
-logdir = os.path.dirname(logpath)
-try:
-    os.makedirs(logdir)
-except OSError as e:
-    pre_existing = (e.errno == errno.EEXIST and os.path.isdir(logdir))
-    if pre_existing:
-        pass
-    else:
-        raise e
-
-handler = logging.FileHandler(logpath, mode='w')
-handler.setLevel(logging.DEBUG)
-
-# create a logging format
-formatter = logging.Formatter(
-    '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+# Write records to a rotating, per-process log file from a background thread.
+# Set CLOUDKNOT_LOG_FORMAT=text for plain text instead of JSON lines.
+log.configure_logging(
+    module_logger,
+    json_format=os.environ.get('CLOUDKNOT_LOG_FORMAT', 'json') != 'text'
 )
-handler.setFormatter(formatter)
-
-# add the handlers to the logger
-module_logger.addHandler(handler)
 module_logger.info('Started new cloudknot session')
 
 logging.getLogger('boto').setLevel(logging.WARNING)
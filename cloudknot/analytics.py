@@ -0,0 +1,489 @@
+"""Queue wait, runtime and utilization analytics from AWS Batch timestamps
+
+AWS Batch job descriptions (see `aws.describe_jobs`) carry createdAt,
+startedAt and stoppedAt timestamps for each job and for each of its
+attempts. The functions in this module turn the descriptions of a map's
+jobs, or of an array job's children, into distributions of
+    - queue wait : from job creation until its first attempt started
+    - runtime : duration of the job's final attempt
+    - retries : number of attempts beyond the first
+and into the number of attempts running at once over time, from which the
+utilization of the compute environment is inferred. These are the numbers
+to look at when tuning `min_vcpus`, `desired_vcpus` and the number of
+inputs per job.
+
+The same timestamps, together with the client-side spans recorded in each
+job's `JobTimings`, can be exported as a Chrome trace-event timeline with
+`chrome_trace`, to be opened in chrome://tracing or https://ui.perfetto.dev.
+"""
+from __future__ import absolute_import, division, print_function
+
+import heapq
+import json
+import logging
+import math
+from collections import namedtuple, OrderedDict
+
+__all__ = ["JobLifecycle", "MapAnalytics", "job_lifecycles", "percentiles",
+           "text_histogram", "concurrency_timeline", "map_analytics",
+           "format_report", "chrome_trace", "write_chrome_trace"]
+
+mod_logger = logging.getLogger(__name__)
+
+#: Timestamps (in seconds since the epoch) and derived durations of one job
+JobLifecycle = namedtuple(
+    'JobLifecycle',
+    ['job_id', 'status', 'created', 'started', 'stopped', 'queue_s',
+     'run_s', 'retries', 'attempts']
+)
+
+#: Distributions of queue wait, runtime and retries, and utilization
+MapAnalytics = namedtuple(
+    'MapAnalytics',
+    ['num_jobs', 'queue_s', 'run_s', 'retries', 'makespan_s',
+     'mean_concurrency', 'peak_concurrency', 'utilization', 'lifecycles']
+)
+
+
+def _seconds(timestamp_ms):
+    """Convert an AWS Batch timestamp in milliseconds to seconds"""
+    return timestamp_ms / 1000.0 if timestamp_ms is not None else None
+
+
+def job_lifecycles(jobs):
+    """Extract the lifecycle timestamps of AWS Batch jobs
+
+    Array parents, whose timestamps only summarize their children, are
+    skipped. Include the children's descriptions instead.
+
+    Parameters
+    ----------
+    jobs : iterable of dicts
+        AWS job descriptions, as returned by `aws.describe_jobs`
+
+    Returns
+    -------
+    lifecycles : list of JobLifecycle
+        One namedtuple per job with fields
+        job_id, status : from the job description
+        created, started, stopped : timestamps in seconds since the epoch,
+            where started and stopped are those of the final attempt
+        queue_s : seconds from creation until the first attempt started
+        run_s : seconds from the start until the end of the final attempt
+        retries : number of attempts beyond the first
+        attempts : list of (started, stopped) pairs for each attempt
+    Durations are None if the job has not reached the relevant stage.
+    """
+    lifecycles = []
+    for job in jobs:
+        if 'size' in job.get('arrayProperties', {}):
+            continue
+
+        attempts = [(_seconds(a.get('startedAt')),
+                     _seconds(a.get('stoppedAt')))
+                    for a in job.get('attempts', [])]
+        attempts = [a for a in attempts if a[0] is not None]
+
+        created = _seconds(job.get('createdAt'))
+        started = _seconds(job.get('startedAt'))
+        stopped = _seconds(job.get('stoppedAt'))
+
+        first_start = attempts[0][0] if attempts else started
+        queue_s = (first_start - created
+                   if created is not None and first_start is not None
+                   else None)
+        run_s = (stopped - started
+                 if started is not None and stopped is not None else None)
+
+        lifecycles.append(JobLifecycle(
+            job_id=job['jobId'], status=job.get('status'), created=created,
+            started=started, stopped=stopped, queue_s=queue_s, run_s=run_s,
+            retries=max(len(attempts) - 1, 0), attempts=attempts
+        ))
+
+    return lifecycles
+
+
+def percentiles(values, q=(50, 90, 95, 99)):
+    """Return percentiles of a sequence of numbers
+
+    Percentiles are linearly interpolated between the closest ranks.
+
+    Parameters
+    ----------
+    values : iterable of numbers
+        The sample. None values are ignored.
+
+    q : sequence of numbers
+        The percentiles to compute, between 0 and 100
+        Default: (50, 90, 95, 99)
+
+    Returns
+    -------
+    percentiles : OrderedDict
+        Mapping of 'min', 'p<q>' for each percentile, 'max' and 'mean' to
+        their values, or an empty OrderedDict if `values` is empty
+    """
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return OrderedDict()
+
+    result = OrderedDict([('min', values[0])])
+    for p in q:
+        rank = (len(values) - 1) * p / 100.0
+        lower = int(math.floor(rank))
+        upper = min(lower + 1, len(values) - 1)
+        result['p{p:g}'.format(p=p)] = (
+            values[lower] + (values[upper] - values[lower]) * (rank - lower)
+        )
+
+    result['max'] = values[-1]
+    result['mean'] = sum(values) / len(values)
+    return result
+
+
+def text_histogram(values, bins=10, width=40, unit='s'):
+    """Return a text histogram of a sequence of numbers
+
+    Parameters
+    ----------
+    values : iterable of numbers
+        The sample. None values are ignored.
+
+    bins : int
+        Number of equal-width bins
+        Default: 10
+
+    width : int
+        Number of characters of the longest bar
+        Default: 40
+
+    unit : string
+        Unit appended to the bin edges
+        Default: 's'
+
+    Returns
+    -------
+    histogram : string
+        One line per bin with the bin edges, a bar and the count
+    """
+    values = [v for v in values if v is not None]
+    if not values:
+        return '(no data)'
+
+    low, high = min(values), max(values)
+    if high == low:
+        bins = 1
+    bin_width = (high - low) / bins if high > low else 1.0
+
+    counts = [0] * bins
+    for v in values:
+        counts[min(int((v - low) / bin_width), bins - 1)] += 1
+
+    max_count = max(counts)
+    lines = []
+    for i, count in enumerate(counts):
+        bar = '#' * int(round(width * count / max_count))
+        lo = '{v:.3g}{u:s}'.format(v=low + i * bin_width, u=unit)
+        hi = '{v:.3g}{u:s}'.format(v=low + (i + 1) * bin_width, u=unit)
+        lines.append('{lo:>10s} - {hi:<10s} |{bar:<{w}s}| {c:d}'.format(
+            lo=lo, hi=hi, bar=bar, w=width, c=count
+        ))
+
+    return '\n'.join(lines)
+
+
+def concurrency_timeline(lifecycles):
+    """Return the number of attempts running at once over time
+
+    Parameters
+    ----------
+    lifecycles : sequence of JobLifecycle
+
+    Returns
+    -------
+    timeline : list of (time, running) tuples
+        The number of running attempts from each time, in seconds since
+        the epoch, until the next time in the list. The last entry marks
+        the end of the last attempt. Attempts that have not stopped are
+        ignored.
+    """
+    events = []
+    for lc in lifecycles:
+        for started, stopped in lc.attempts:
+            if stopped is not None:
+                events.append((started, 1))
+                events.append((stopped, -1))
+
+    # Process stops before starts at the same time
+    events.sort(key=lambda e: (e[0], e[1]))
+
+    timeline = []
+    running = 0
+    for t, change in events:
+        running += change
+        if timeline and timeline[-1][0] == t:
+            timeline[-1] = (t, running)
+        else:
+            timeline.append((t, running))
+
+    # Drop steps that do not change the number of running attempts
+    return [step for i, step in enumerate(timeline)
+            if i == 0 or i == len(timeline) - 1
+            or step[1] != timeline[i - 1][1]]
+
+
+def map_analytics(jobs, capacity=None):
+    """Compute queue wait, runtime, retry and utilization statistics
+
+    Parameters
+    ----------
+    jobs : iterable of dicts
+        AWS job descriptions of independent jobs and array children, as
+        returned by `aws.describe_jobs`
+
+    capacity : int
+        The number of attempts that the compute environment can run at
+        once, e.g. its max_vcpus divided by the vcpus of each job. If
+        provided, utilization is the mean concurrency divided by
+        `capacity`. Otherwise, it is relative to the peak concurrency.
+        Default: None
+
+    Returns
+    -------
+    MapAnalytics
+        namedtuple with fields
+        num_jobs : the number of jobs analyzed
+        queue_s, run_s : percentiles (see `percentiles`) of queue wait and
+            runtime in seconds
+        retries : OrderedDict mapping the number of retries to the number
+            of jobs with that many retries
+        makespan_s : seconds from the first attempt start to the last
+            attempt stop
+        mean_concurrency, peak_concurrency : mean and maximum number of
+            attempts running at once during the makespan
+        utilization : fraction of capacity used during the makespan
+        lifecycles : the JobLifecycle of each job
+    """
+    lifecycles = job_lifecycles(jobs)
+
+    retries = OrderedDict()
+    for n in sorted(set(lc.retries for lc in lifecycles)):
+        retries[n] = sum(1 for lc in lifecycles if lc.retries == n)
+
+    timeline = concurrency_timeline(lifecycles)
+    if len(timeline) > 1:
+        makespan_s = timeline[-1][0] - timeline[0][0]
+        busy_s = sum((t1 - t0) * running for (t0, running), (t1, _)
+                     in zip(timeline[:-1], timeline[1:]))
+        peak = max(running for _, running in timeline)
+        mean = busy_s / makespan_s if makespan_s > 0 else float(peak)
+    else:
+        makespan_s, mean, peak = 0.0, 0.0, 0
+
+    if capacity:
+        utilization = mean / capacity
+    else:
+        utilization = mean / peak if peak else 0.0
+
+    return MapAnalytics(
+        num_jobs=len(lifecycles),
+        queue_s=percentiles(lc.queue_s for lc in lifecycles),
+        run_s=percentiles(lc.run_s for lc in lifecycles),
+        retries=retries,
+        makespan_s=makespan_s,
+        mean_concurrency=mean,
+        peak_concurrency=peak,
+        utilization=utilization,
+        lifecycles=lifecycles
+    )
+
+
+def format_report(analytics, bins=10, width=40):
+    """Format MapAnalytics as a text report with histograms
+
+    Parameters
+    ----------
+    analytics : MapAnalytics
+        The output of `map_analytics`
+
+    bins : int
+        Number of histogram bins
+        Default: 10
+
+    width : int
+        Number of characters of the longest histogram bar
+        Default: 40
+
+    Returns
+    -------
+    report : string
+    """
+    def fmt_percentiles(p):
+        return '  '.join('{k:s}={v:.3g}s'.format(k=k, v=v)
+                         for k, v in p.items()) or '(no data)'
+
+    lcs = analytics.lifecycles
+    lines = [
+        'jobs: {n:d}'.format(n=analytics.num_jobs),
+        'makespan: {m:.3g}s  concurrency: mean={mean:.3g} peak={peak:d}  '
+        'utilization: {u:.1%}'.format(m=analytics.makespan_s,
+                                      mean=analytics.mean_concurrency,
+                                      peak=analytics.peak_concurrency,
+                                      u=analytics.utilization),
+        'retries: ' + ', '.join('{n:d}: {c:d}'.format(n=n, c=c)
+                                for n, c in analytics.retries.items()),
+        '',
+        'queue wait: ' + fmt_percentiles(analytics.queue_s),
+        text_histogram([lc.queue_s for lc in lcs], bins=bins, width=width),
+        '',
+        'runtime: ' + fmt_percentiles(analytics.run_s),
+        text_histogram([lc.run_s for lc in lcs], bins=bins, width=width),
+    ]
+    return '\n'.join(lines)
+
+
+def _assign_lanes(intervals):
+    """Assign intervals to the fewest lanes in which none of them overlap
+
+    Parameters
+    ----------
+    intervals : list of (start, stop) tuples
+
+    Returns
+    -------
+    lanes : list of ints
+        The lane of each interval, in the order of `intervals`
+    """
+    lanes = [0] * len(intervals)
+    free = []  # heap of (stop, lane) for lanes in use
+    num_lanes = 0
+
+    order = sorted(range(len(intervals)), key=lambda i: intervals[i])
+    for i in order:
+        start, stop = intervals[i]
+        if free and free[0][0] <= start:
+            _, lane = heapq.heappop(free)
+        else:
+            lane = num_lanes
+            num_lanes += 1
+        lanes[i] = lane
+        heapq.heappush(free, (stop, lane))
+
+    return lanes
+
+
+def chrome_trace(jobs, timings=None):
+    """Build a Chrome trace-event timeline of jobs
+
+    The timeline has three processes:
+        - client : the client-side spans of each job, e.g. serialize,
+          submit, upload, wait and download, one row per job
+        - queue : the time from the creation of each job or array child
+          until its first attempt started
+        - run : each attempt of each job or array child
+    Queue and run spans are packed into as few rows as possible without
+    overlapping, so the number of rows in use at any time is the number of
+    jobs waiting or running at that time.
+
+    Parameters
+    ----------
+    jobs : iterable of dicts
+        AWS job descriptions, as returned by `aws.describe_jobs`, of
+        independent jobs and array children. Array parents are skipped.
+
+    timings : dict
+        Mapping of job ID to the JobTimings of that job, e.g.
+        {job.job_id: job.timings for job in knot.jobs}
+        Default: None
+
+    Returns
+    -------
+    trace : dict
+        Trace in the Chrome trace-event JSON object format
+    """
+    lifecycles = job_lifecycles(jobs)
+    timings = timings or {}
+
+    client_spans = [(job_id, span) for job_id, t in timings.items()
+                    for span in t.spans]
+
+    times = ([start for _, (_, start, _) in client_spans]
+             + [lc.created for lc in lifecycles if lc.created is not None]
+             + [a[0] for lc in lifecycles for a in lc.attempts])
+    origin = min(times) if times else 0.0
+
+    def us(t):
+        return int(round((t - origin) * 1e6))
+
+    events = []
+
+    def name_process(pid, name):
+        events.append({'name': 'process_name', 'ph': 'M', 'pid': pid,
+                       'tid': 0, 'args': {'name': name}})
+
+    name_process(0, 'client')
+    name_process(1, 'queue')
+    name_process(2, 'run')
+
+    tids = {}
+    for job_id, (phase, start, seconds) in client_spans:
+        if job_id not in tids:
+            tids[job_id] = len(tids)
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': 0,
+                           'tid': tids[job_id], 'args': {'name': job_id}})
+
+        events.append({'name': phase, 'cat': 'client', 'ph': 'X',
+                       'pid': 0, 'tid': tids[job_id], 'ts': us(start),
+                       'dur': us(start + seconds) - us(start),
+                       'args': {'job_id': job_id}})
+
+    queued = [lc for lc in lifecycles
+              if lc.created is not None and lc.queue_s is not None]
+    lanes = _assign_lanes([(lc.created, lc.created + lc.queue_s)
+                           for lc in queued])
+    for lc, lane in zip(queued, lanes):
+        events.append({'name': lc.job_id, 'cat': 'queue', 'ph': 'X',
+                       'pid': 1, 'tid': lane, 'ts': us(lc.created),
+                       'dur': us(lc.created + lc.queue_s) - us(lc.created),
+                       'args': {'status': lc.status}})
+
+    attempts = [(lc, n, a) for lc in lifecycles
+                for n, a in enumerate(lc.attempts)
+                if a[1] is not None]
+    lanes = _assign_lanes([a for _, _, a in attempts])
+    for (lc, n, (started, stopped)), lane in zip(attempts, lanes):
+        events.append({'name': lc.job_id, 'cat': 'run', 'ph': 'X',
+                       'pid': 2, 'tid': lane, 'ts': us(started),
+                       'dur': us(stopped) - us(started),
+                       'args': {'attempt': n + 1, 'status': lc.status}})
+
+    return {'traceEvents': events, 'displayTimeUnit': 'ms',
+            'otherData': {'origin': origin}}
+
+
+def write_chrome_trace(path, jobs, timings=None):
+    """Write a Chrome trace-event timeline of jobs to a JSON file
+
+    Parameters
+    ----------
+    path : string
+        Path of the JSON file to write
+
+    jobs : iterable of dicts
+        AWS job descriptions, see `chrome_trace`
+
+    timings : dict
+        Mapping of job ID to JobTimings, see `chrome_trace`
+        Default: None
+
+    Returns
+    -------
+    path : string
+        The path that was written
+    """
+    with open(path, 'w') as f:
+        json.dump(chrome_trace(jobs, timings=timings), f)
+
+    mod_logger.info('Wrote Chrome trace to {path:s}'.format(path=path))
+    return path
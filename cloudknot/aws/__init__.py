@@ -17,6 +17,7 @@ or specify parameters to create a new resource on AWS. Higher level resources
 from __future__ import absolute_import, division, print_function
 
 from .base_classes import *  # noqa: F401,F403
+from .api_metrics import *  # noqa: F401,F403
 from .batch import *  # noqa: F401,F403
 from .ec2 import *  # noqa: F401,F403
 from .ecr import *  # noqa: F401,F403
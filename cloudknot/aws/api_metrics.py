@@ -0,0 +1,368 @@
+"""Call counts, latency histograms and throttles of cloudknot's AWS calls
+
+Metrics are collected by botocore event handlers registered on each client
+in `clients`. They are registered again whenever the clients are refreshed,
+e.g. by `refresh_clients`, `set_region` or `set_profile`. Clients that are
+not botocore clients, such as the emulated clients in cloudknot.emulator,
+are not instrumented.
+"""
+from __future__ import absolute_import, division, print_function
+
+import bisect
+import logging
+import threading
+import time
+from collections import namedtuple, OrderedDict
+
+import botocore
+
+from .base_classes import clients, client_instrumentations, rlock
+
+__all__ = ["ApiCallStats", "ApiMetrics", "THROTTLING_ERROR_CODES",
+           "enable_api_metrics", "disable_api_metrics", "get_api_metrics"]
+
+mod_logger = logging.getLogger(__name__)
+
+#: Statistics of the calls to one operation of one AWS service
+ApiCallStats = namedtuple(
+    'ApiCallStats',
+    ['count', 'errors', 'throttles', 'retries', 'total_s', 'buckets']
+)
+
+#: Error codes with which AWS services signal throttling
+THROTTLING_ERROR_CODES = frozenset([
+    'Throttling', 'ThrottlingException', 'ThrottledException',
+    'RequestThrottledException', 'TooManyRequestsException',
+    'ProvisionedThroughputExceededException', 'RequestLimitExceeded',
+    'BandwidthLimitExceeded', 'LimitExceededException', 'RequestThrottled',
+    'SlowDown', 'PriorRequestNotComplete', 'EC2ThrottledException',
+])
+
+# Keys under which per-call state is kept in the botocore request context
+_START_KEY = 'cloudknot_api_metrics_start'
+_THROTTLES_KEY = 'cloudknot_api_metrics_throttles'
+
+
+def _error_code(parsed):
+    """Return the error code of a parsed botocore response, or None"""
+    if not isinstance(parsed, dict):
+        return None
+    return parsed.get('Error', {}).get('Code')
+
+
+# noinspection PyPropertyAccess,PyAttributeOutsideInit
+class ApiMetrics(object):
+    """Per-operation AWS API call metrics collected from botocore events
+
+    For each (service, operation) pair, this records
+        - count : number of calls
+        - errors : number of calls that failed
+        - throttles : number of attempts that were throttled, including
+          attempts that were retried
+        - retries : number of retried attempts
+        - total_s : total latency in seconds, including retries
+        - buckets : cumulative latency histogram, a list with the number of
+          calls taking at most each bound in `bucket_bounds`
+    """
+    #: Upper bounds in seconds of the latency histogram buckets
+    DEFAULT_BUCKET_BOUNDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                             2.5, 5.0, 10.0)
+
+    def __init__(self, bucket_bounds=DEFAULT_BUCKET_BOUNDS):
+        """Initialize an ApiMetrics instance
+
+        Parameters
+        ----------
+        bucket_bounds : sequence of floats
+            Increasing upper bounds, in seconds, of the latency histogram
+            buckets. A final bucket without upper bound is always added.
+            Default: ApiMetrics.DEFAULT_BUCKET_BOUNDS
+        """
+        self._bucket_bounds = tuple(sorted(bucket_bounds))
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._unique_id = 'cloudknot-api-metrics-{id:d}'.format(id=id(self))
+
+    @property
+    def bucket_bounds(self):
+        """Upper bounds in seconds of the latency histogram buckets"""
+        return self._bucket_bounds
+
+    def _entry(self, service, operation):
+        """Return the mutable stats of an operation. Hold self._lock."""
+        key = (service, operation)
+        if key not in self._stats:
+            self._stats[key] = {
+                'count': 0, 'errors': 0, 'throttles': 0, 'retries': 0,
+                'total_s': 0.0,
+                'buckets': [0] * (len(self._bucket_bounds) + 1),
+            }
+        return self._stats[key]
+
+    @staticmethod
+    def _names(model):
+        """Return the service and snake_case operation name of a model"""
+        return (model.service_model.service_name,
+                botocore.xform_name(model.name))
+
+    def _before_call(self, model=None, context=None, **kwargs):
+        if context is not None:
+            context[_START_KEY] = time.time()
+
+    def _after_call(self, model=None, parsed=None, context=None,
+                    http_response=None, **kwargs):
+        context = context if context is not None else {}
+        start = context.pop(_START_KEY, None)
+        elapsed = time.time() - start if start is not None else 0.0
+        service, operation = self._names(model)
+
+        status_code = getattr(http_response, 'status_code', None)
+        error = (status_code is not None and status_code >= 300) \
+            or _error_code(parsed) is not None
+
+        retries = 0
+        if isinstance(parsed, dict):
+            retries = parsed.get('ResponseMetadata', {}).get(
+                'RetryAttempts', 0
+            )
+
+        # Throttled attempts are counted in _needs_retry. If that was never
+        # called, e.g. for stubbed responses, only the final attempt is seen.
+        throttles = context.pop(_THROTTLES_KEY, None)
+        if throttles is None:
+            throttles = int(_error_code(parsed) in THROTTLING_ERROR_CODES)
+
+        with self._lock:
+            entry = self._entry(service, operation)
+            entry['count'] += 1
+            entry['errors'] += int(error)
+            entry['throttles'] += throttles
+            entry['retries'] += retries
+            entry['total_s'] += elapsed
+            entry['buckets'][
+                bisect.bisect_left(self._bucket_bounds, elapsed)
+            ] += 1
+
+    def _after_call_error(self, context=None, **kwargs):
+        # Connection errors and the like, raised before a response was
+        # parsed. The operation model is not passed to this event.
+        start = (context or {}).pop(_START_KEY, None)
+        elapsed = time.time() - start if start is not None else 0.0
+        event_name = kwargs.get('event_name', '')
+        parts = event_name.split('.')
+        service = parts[1] if len(parts) > 1 else 'unknown'
+        operation = (botocore.xform_name(parts[2]) if len(parts) > 2
+                     else 'unknown')
+
+        with self._lock:
+            entry = self._entry(service, operation)
+            entry['count'] += 1
+            entry['errors'] += 1
+            entry['total_s'] += elapsed
+            entry['buckets'][
+                bisect.bisect_left(self._bucket_bounds, elapsed)
+            ] += 1
+
+    def _needs_retry(self, response=None, request_dict=None, **kwargs):
+        # Called after every attempt, including the last one. Tally the
+        # throttled attempts in the request context for _after_call.
+        context = (request_dict or {}).get('context')
+        if context is not None:
+            throttled = (response is not None
+                         and _error_code(response[1])
+                         in THROTTLING_ERROR_CODES)
+            context[_THROTTLES_KEY] = (context.get(_THROTTLES_KEY, 0)
+                                       + int(throttled))
+
+        # Never influence the retry decision
+        return None
+
+    def register(self, client):
+        """Register this instance's event handlers on a botocore client
+
+        Registering the same client more than once has no further effect.
+
+        Parameters
+        ----------
+        client : botocore client
+            The client to instrument. Objects without a botocore event
+            system are ignored.
+        """
+        events = getattr(getattr(client, 'meta', None), 'events', None)
+        if events is None:
+            return
+
+        handlers = [
+            ('before-parameter-build', self._before_call),
+            ('after-call', self._after_call),
+            ('after-call-error', self._after_call_error),
+            ('needs-retry', self._needs_retry),
+        ]
+        for event, handler in handlers:
+            events.register(event, handler,
+                            unique_id=self._unique_id + '-' + event)
+
+    def unregister(self, client):
+        """Remove this instance's event handlers from a botocore client"""
+        events = getattr(getattr(client, 'meta', None), 'events', None)
+        if events is None:
+            return
+
+        for event in ['before-parameter-build', 'after-call',
+                      'after-call-error', 'needs-retry']:
+            events.unregister(event, unique_id=self._unique_id + '-' + event)
+
+    def reset(self):
+        """Discard all recorded metrics"""
+        with self._lock:
+            self._stats = {}
+
+    @property
+    def stats(self):
+        """OrderedDict mapping (service, operation) to ApiCallStats"""
+        with self._lock:
+            return OrderedDict(
+                (key, ApiCallStats(
+                    count=e['count'], errors=e['errors'],
+                    throttles=e['throttles'], retries=e['retries'],
+                    total_s=e['total_s'], buckets=list(e['buckets'])
+                ))
+                for key, e in sorted(self._stats.items())
+            )
+
+    def to_openmetrics(self, prefix='cloudknot_aws_api'):
+        """Return the metrics in the OpenMetrics text exposition format
+
+        Parameters
+        ----------
+        prefix : string
+            Prefix of the metric family names
+            Default: 'cloudknot_aws_api'
+
+        Returns
+        -------
+        text : string
+        """
+        stats = self.stats
+
+        def labels(service, operation, **extra):
+            pairs = [('service', service), ('operation', operation)]
+            pairs += sorted(extra.items())
+            return '{' + ','.join('{k:s}="{v:s}"'.format(k=k, v=v)
+                                  for k, v in pairs) + '}'
+
+        lines = []
+        counters = [
+            ('calls', 'count', 'AWS API calls'),
+            ('errors', 'errors', 'AWS API calls that failed'),
+            ('throttles', 'throttles', 'AWS API attempts that were '
+                                       'throttled'),
+            ('retries', 'retries', 'AWS API attempts that were retried'),
+        ]
+        for name, field, description in counters:
+            family = '{p:s}_{n:s}'.format(p=prefix, n=name)
+            lines.append('# TYPE {f:s} counter'.format(f=family))
+            lines.append('# HELP {f:s} {d:s}'.format(f=family, d=description))
+            for (service, operation), s in stats.items():
+                lines.append('{f:s}_total{l:s} {v:d}'.format(
+                    f=family, l=labels(service, operation),
+                    v=getattr(s, field)
+                ))
+
+        family = '{p:s}_call_duration_seconds'.format(p=prefix)
+        lines.append('# TYPE {f:s} histogram'.format(f=family))
+        lines.append('# HELP {f:s} Latency of AWS API calls, including '
+                     'retries'.format(f=family))
+        lines.append('# UNIT {f:s} seconds'.format(f=family))
+        for (service, operation), s in stats.items():
+            cumulative = 0
+            bounds = ['{b:g}'.format(b=b) for b in self._bucket_bounds]
+            for bound, count in zip(bounds + ['+Inf'], s.buckets):
+                cumulative += count
+                lines.append('{f:s}_bucket{l:s} {v:d}'.format(
+                    f=family, l=labels(service, operation, le=bound),
+                    v=cumulative
+                ))
+            lines.append('{f:s}_count{l:s} {v:d}'.format(
+                f=family, l=labels(service, operation), v=s.count
+            ))
+            lines.append('{f:s}_sum{l:s} {v!r}'.format(
+                f=family, l=labels(service, operation), v=s.total_s
+            ))
+
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+
+_api_metrics = None
+
+
+def _instrument(name, client):
+    """Register the active ApiMetrics on a client in `clients`"""
+    if _api_metrics is not None:
+        _api_metrics.register(client)
+
+
+def enable_api_metrics(metrics=None):
+    """Start collecting metrics of the AWS calls made through `clients`
+
+    Parameters
+    ----------
+    metrics : ApiMetrics
+        The instance in which to collect metrics. If None, keep the active
+        instance or create a new one.
+        Default: None
+
+    Returns
+    -------
+    ApiMetrics
+        The active instance
+    """
+    global _api_metrics
+
+    with rlock:
+        if metrics is not None and _api_metrics is not None \
+                and metrics is not _api_metrics:
+            for client in clients.values():
+                _api_metrics.unregister(client)
+
+        if metrics is not None:
+            _api_metrics = metrics
+        elif _api_metrics is None:
+            _api_metrics = ApiMetrics()
+
+        if _instrument not in client_instrumentations:
+            client_instrumentations.append(_instrument)
+
+        for name, client in clients.items():
+            _instrument(name, client)
+
+        return _api_metrics
+
+
+def disable_api_metrics():
+    """Stop collecting AWS call metrics
+
+    Returns
+    -------
+    ApiMetrics or None
+        The previously active instance, which keeps its metrics
+    """
+    global _api_metrics
+
+    with rlock:
+        metrics = _api_metrics
+        if metrics is not None:
+            for client in clients.values():
+                metrics.unregister(client)
+
+        if _instrument in client_instrumentations:
+            client_instrumentations.remove(_instrument)
+
+        _api_metrics = None
+        return metrics
+
+
+def get_api_metrics():
+    """Return the active ApiMetrics instance, or None if disabled"""
+    return _api_metrics
@@ -18,10 +18,11 @@ __all__ = [
     "ResourceDoesNotExistException", "ResourceClobberedException",
     "ResourceExistsException", "CannotDeleteResourceException",
     "CannotCreateResourceException", "RegionException", "ProfileException",
-    "BatchJobFailedError", "CKTimeoutError",
+    "BatchJobFailedError", "PreflightError", "CKTimeoutError",
     "CloudknotInputError", "CloudknotConfigurationError",
     "NamedObject", "ObjectWithArn", "ObjectWithUsernameAndMemory",
-    "clients", "refresh_clients",
+    "clients", "client_overrides", "client_instrumentations",
+    "refresh_clients",
     "wait_for_compute_environment", "wait_for_job_queue",
     "get_region", "set_region",
     "get_ecr_repo", "set_ecr_repo",
@@ -479,6 +480,7 @@ def set_region(region='us-east-1'):
                                         config=boto_config)
         clients['s3'] = session.client('s3', region_name=region,
                                        config=boto_config)
+        _apply_client_overrides()
 
 
 def list_profiles():
@@ -638,6 +640,7 @@ def set_profile(profile_name):
                                         config=boto_config)
         clients['s3'] = session.client('s3', region_name=get_region(),
                                        config=boto_config)
+        _apply_client_overrides()
 
 
 #: module-level dictionary of boto3 clients for IAM, EC2, Batch, ECR, ECS, S3.
@@ -672,6 +675,27 @@ and region.
 """
 
 
+#: module-level dictionary of objects that replace the boto3 client of the
+#: same name, e.g. the emulated clients in cloudknot.emulator. Overrides are
+#: reapplied whenever the clients are refreshed.
+client_overrides = {}
+
+#: module-level list of functions that instrument the clients, e.g. by
+#: registering botocore event handlers. Each is called with the name and the
+#: client of every entry in `clients`, and again whenever the clients are
+#: refreshed.
+client_instrumentations = []
+
+
+def _apply_client_overrides():
+    """Replace clients with any overrides, then instrument all clients"""
+    with rlock:
+        clients.update(client_overrides)
+        for instrument in client_instrumentations:
+            for name, client in clients.items():
+                instrument(name, client)
+
+
 def refresh_clients(max_pool=10):
     """Refresh the boto3 clients dictionary"""
     with rlock:
@@ -690,6 +714,8 @@ def refresh_clients(max_pool=10):
         clients['s3'] = session.client('s3', region_name=get_region(),
                                        config=config)
 
+    _apply_client_overrides()
+
 
 # noinspection PyPropertyAccess,PyAttributeOutsideInit
 class ResourceExistsException(Exception):
@@ -852,6 +878,32 @@ class BatchJobFailedError(Exception):
         self.job_id = job_id
 
 
+# noinspection PyPropertyAccess,PyAttributeOutsideInit
+class PreflightError(Exception):
+    """Error indicating the pre-flight run of a knot's image failed"""
+    def __init__(self, image, exit_code, logs):
+        """Initialize the Exception
+
+        Parameters
+        ----------
+        image : string
+            The Docker image that was run
+
+        exit_code : int
+            The exit code of the container
+
+        logs : string
+            The container output, including the traceback of the error
+        """
+        super(PreflightError, self).__init__(
+            "The pre-flight run of {image:s} exited with code {code:d}:\n"
+            "{logs:s}".format(image=image, code=exit_code, logs=logs)
+        )
+        self.image = image
+        self.exit_code = exit_code
+        self.logs = logs
+
+
 # noinspection PyPropertyAccess,PyAttributeOutsideInit
 class CloudknotConfigurationError(Exception):
     """Error indicating an cloudknot has not been properly configured"""
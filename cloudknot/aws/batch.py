@@ -3,12 +3,18 @@ from __future__ import absolute_import, division, print_function
 import cloudknot.config
 import cloudpickle
 from datetime import datetime
+import errno
+import json
 import logging
+import os
 import pickle
 import six
 import tenacity
+import threading
 import time
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 from .base_classes import NamedObject, ObjectWithArn, \
     ObjectWithUsernameAndMemory, clients, \
@@ -20,11 +26,454 @@ from .ec2 import Vpc, SecurityGroup
 from .ecr import DockerRepo
 from .iam import IamRole
 
-__all__ = ["JobDefinition", "JobQueue", "ComputeEnvironment", "BatchJob"]
+__all__ = ["JobDefinition", "JobQueue", "ComputeEnvironment", "BatchJob",
+           "PartialResult", "StragglerPolicy", "JobTimings", "PhaseTiming",
+           "ContainerStats", "JOB_STATUSES", "describe_jobs",
+           "job_status_table", "summarize_container_metrics"]
 
 mod_logger = logging.getLogger(__name__)
 
 
+#: Successful results and per-index errors returned by BatchJob.result
+PartialResult = namedtuple('PartialResult', ['results', 'errors'])
+
+#: Number of spans and total seconds recorded for one phase of a batch job
+PhaseTiming = namedtuple('PhaseTiming', ['count', 'total_s'])
+
+#: Container-side runtime metrics aggregated over job attempts
+ContainerStats = namedtuple(
+    'ContainerStats', ['count', 'phases', 'max_s', 'peak_rss_kb', 'cpu_s']
+)
+
+#: Phases timed inside the container, in the order they occur
+CONTAINER_PHASES = ['startup', 'import', 'download', 'unpickle', 'compute',
+                    'pickle', 'upload']
+
+#: The AWS Batch job statuses, in lifecycle order
+JOB_STATUSES = ['SUBMITTED', 'PENDING', 'RUNNABLE', 'STARTING', 'RUNNING',
+                'SUCCEEDED', 'FAILED']
+
+
+def _list_jobs(job_queue=None, status=None, array_job_id=None,
+               page_size=100):
+    """Generate job summaries from list_jobs, following nextToken
+
+    Parameters
+    ----------
+    job_queue : string
+        Name or ARN of the job queue to list. Ignored if `array_job_id`
+        is provided.
+
+    status : string
+        The job status on which to filter
+        Default: None
+
+    array_job_id : string
+        If provided, list the children of this array job
+        Default: None
+
+    page_size : int
+        Maximum number of results per list_jobs call
+        Default: 100
+
+    Yields
+    ------
+    job_summary : dict
+        AWS job summary for each job
+    """
+    kwargs = {'maxResults': page_size}
+    if array_job_id:
+        kwargs['arrayJobId'] = array_job_id
+    else:
+        kwargs['jobQueue'] = job_queue
+
+    if status:
+        kwargs['jobStatus'] = status
+
+    while True:
+        response = clients['batch'].list_jobs(**kwargs)
+        for summary in response.get('jobSummaryList', []):
+            yield summary
+
+        next_token = response.get('nextToken')
+        if not next_token:
+            break
+
+        kwargs['nextToken'] = next_token
+
+
+def describe_jobs(job_ids, max_threads=8):
+    """Describe any number of batch jobs using chunked, concurrent requests
+
+    AWS Batch describe_jobs accepts at most 100 job IDs per call. This
+    function splits `job_ids` into chunks of 100 and describes the chunks
+    concurrently.
+
+    Parameters
+    ----------
+    job_ids : sequence of strings
+        The job IDs to describe. These may include array child job IDs,
+        e.g. 'job-id:12'
+
+    max_threads : int
+        Maximum number of threads used to describe jobs concurrently
+        Default: 8
+
+    Returns
+    -------
+    jobs : list
+        AWS job descriptions, in the same order as `job_ids`. Job IDs that
+        AWS does not recognize are omitted.
+    """
+    job_ids = list(job_ids)
+    chunks = [job_ids[i:i + 100] for i in range(0, len(job_ids), 100)]
+
+    def describe_chunk(chunk):
+        response = clients['batch'].describe_jobs(jobs=chunk)
+        return response.get('jobs', [])
+
+    if not chunks:
+        return []
+
+    if len(chunks) == 1:
+        responses = [describe_chunk(chunks[0])]
+    else:
+        with ThreadPoolExecutor(max(min(len(chunks), max_threads), 1)) as e:
+            responses = list(e.map(describe_chunk, chunks))
+
+    jobs = {j['jobId']: j for response in responses for j in response}
+    return [jobs[jid] for jid in job_ids if jid in jobs]
+
+
+def job_status_table(jobs, as_dataframe=False):
+    """Summarize job descriptions as a compact columnar status table
+
+    Parameters
+    ----------
+    jobs : iterable of dicts
+        AWS job descriptions, as returned by `describe_jobs`
+
+    as_dataframe : bool
+        If True, return a pandas DataFrame. Requires pandas.
+        Default: False
+
+    Returns
+    -------
+    table : OrderedDict or pandas.DataFrame
+        Mapping of column name to list of values, with columns
+        ['job_id', 'array_index', 'status', 'attempts', 'started_at',
+        'stopped_at']. Timestamps are in milliseconds since the epoch.
+    """
+    columns = OrderedDict([
+        ('job_id', lambda j: j['jobId']),
+        ('array_index', lambda j: j.get('arrayProperties', {}).get('index')),
+        ('status', lambda j: j.get('status')),
+        ('attempts', lambda j: len(j.get('attempts', []))),
+        ('started_at', lambda j: j.get('startedAt')),
+        ('stopped_at', lambda j: j.get('stoppedAt')),
+    ])
+
+    return _to_columns(jobs, columns, as_dataframe=as_dataframe)
+
+
+def _to_columns(records, columns, as_dataframe=False):
+    """Convert a sequence of records into a columnar table
+
+    Parameters
+    ----------
+    records : iterable
+        The records (usually AWS response dicts) to tabulate
+
+    columns : OrderedDict
+        Mapping of column name to a function that extracts the column
+        value from a single record
+
+    as_dataframe : bool
+        If True, return a pandas DataFrame. Requires pandas.
+        Default: False
+
+    Returns
+    -------
+    table : OrderedDict or pandas.DataFrame
+        Mapping of column name to list of values
+    """
+    table = OrderedDict((name, []) for name in columns)
+    for record in records:
+        for name, getter in columns.items():
+            table[name].append(getter(record))
+
+    if as_dataframe:
+        try:
+            import pandas as pd
+        except ImportError:
+            raise CloudknotInputError('as_dataframe=True requires pandas. '
+                                      'Please install pandas or use the '
+                                      'default columnar output.')
+        return pd.DataFrame(table)
+
+    return table
+
+
+# noinspection PyPropertyAccess,PyAttributeOutsideInit
+class StragglerPolicy(object):
+    """Policy for speculative execution of straggling array job children
+
+    Once a fraction `quantile` of an array job's children have succeeded,
+    any running child whose runtime exceeds `multiplier` times the median
+    runtime of the succeeded children is resubmitted as a duplicate job.
+    The first of the two to succeed supplies the result and the other is
+    terminated.
+    """
+    def __init__(self, quantile=0.9, multiplier=2.0, max_duplicates=None):
+        """Initialize a StragglerPolicy instance
+
+        Parameters
+        ----------
+        quantile : float
+            Fraction of children that must succeed before looking for
+            stragglers. Must be between 0 and 1.
+            Default: 0.9
+
+        multiplier : float
+            A running child is a straggler if its runtime exceeds
+            `multiplier` times the median runtime. Must be greater than 1.
+            Default: 2.0
+
+        max_duplicates : int
+            Maximum total number of duplicate children to submit.
+            Default: None, meaning no limit
+        """
+        if not 0 < quantile <= 1:
+            raise CloudknotInputError('quantile must be between 0 and 1.')
+
+        if multiplier <= 1:
+            raise CloudknotInputError('multiplier must be greater than 1.')
+
+        if max_duplicates is not None and int(max_duplicates) < 1:
+            raise CloudknotInputError('if provided, max_duplicates must be '
+                                      'a positive integer.')
+
+        self._quantile = float(quantile)
+        self._multiplier = float(multiplier)
+        self._max_duplicates = (int(max_duplicates)
+                                if max_duplicates is not None else None)
+
+    @property
+    def quantile(self):
+        """Fraction of children that must succeed before acting"""
+        return self._quantile
+
+    @property
+    def multiplier(self):
+        """Runtime multiple of the median that defines a straggler"""
+        return self._multiplier
+
+    @property
+    def max_duplicates(self):
+        """Maximum total number of duplicate children to submit"""
+        return self._max_duplicates
+
+
+def _median(values):
+    """Return the median of a non-empty sequence of numbers"""
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2.0
+
+
+def summarize_container_metrics(metrics):
+    """Aggregate the container-side metrics of several job attempts
+
+    Parameters
+    ----------
+    metrics : iterable of dicts
+        Metrics dicts, e.g. the values returned by
+        `BatchJob.container_metrics`
+
+    Returns
+    -------
+    ContainerStats
+        namedtuple with fields
+        count : the number of metrics dicts summarized
+        phases : OrderedDict mapping each container phase to a PhaseTiming
+            with the number of attempts that recorded it and its total
+            seconds
+        max_s : OrderedDict mapping each container phase to its longest
+            duration in seconds
+        peak_rss_kb : the largest peak RSS of any attempt, or None
+        cpu_s : the total CPU seconds of all attempts
+    """
+    count = 0
+    counts, totals, maxima = {}, {}, {}
+    peak_rss_kb = None
+    cpu_s = 0.0
+
+    for m in metrics:
+        count += 1
+        durations = dict(m.get('phases', {}))
+        durations['startup'] = m.get('startup_s')
+        durations['import'] = m.get('import_s')
+
+        for phase, seconds in durations.items():
+            if seconds is None:
+                continue
+            counts[phase] = counts.get(phase, 0) + 1
+            totals[phase] = totals.get(phase, 0.0) + seconds
+            maxima[phase] = max(maxima.get(phase, 0.0), seconds)
+
+        if m.get('peak_rss_kb') is not None:
+            peak_rss_kb = max(peak_rss_kb or 0, m['peak_rss_kb'])
+        cpu_s += m.get('cpu_s') or 0.0
+
+    names = [p for p in CONTAINER_PHASES if p in counts]
+    names += sorted(p for p in counts if p not in CONTAINER_PHASES)
+
+    return ContainerStats(
+        count=count,
+        phases=OrderedDict(
+            (p, PhaseTiming(count=counts[p], total_s=totals[p]))
+            for p in names
+        ),
+        max_s=OrderedDict((p, maxima[p]) for p in names),
+        peak_rss_kb=peak_rss_kb,
+        cpu_s=cpu_s
+    )
+
+
+# noinspection PyPropertyAccess,PyAttributeOutsideInit
+class JobTimings(object):
+    """Wall-clock time spent in each phase of one or more batch jobs
+
+    Client-side phases are timed as they happen:
+        - serialize : pickling the input
+        - submit : the submit_job call
+        - upload : uploading the pickled input to S3
+        - record : adding the job to the cloudknot config file
+        - wait : polling for the job to finish in `BatchJob.result`
+        - download : downloading results from S3
+        - unpickle : unpickling results
+        - cache_read : reading results from the local result cache
+
+    Server-side phases are taken from the AWS Batch timestamps of the job
+    once it has finished:
+        - queue : from job creation until it started running
+        - run : from the start of the job until it stopped
+
+    For array jobs, these are the timestamps of the parent job, i.e. from
+    the creation of the parent until its first child started and from then
+    until its last child stopped.
+
+    Recording a span costs two calls to time.time() and a lock, so timings
+    are always collected. The start time of the first `max_spans` client-side
+    spans is also kept, e.g. for `analytics.chrome_trace`.
+    """
+    #: Phases in the order they occur during the life of a job
+    PHASES = ['serialize', 'submit', 'upload', 'record', 'queue', 'run',
+              'wait', 'download', 'unpickle', 'cache_read']
+
+    #: Maximum number of individual spans kept by each instance
+    max_spans = 10000
+
+    def __init__(self):
+        """Initialize an empty JobTimings instance"""
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._totals = {}
+        self._spans = []
+
+    def add(self, phase, seconds, start=None):
+        """Add a span of `seconds` to `phase`
+
+        Parameters
+        ----------
+        phase : string
+            The phase name, e.g. 'upload'
+
+        seconds : float
+            Duration of the span in seconds
+
+        start : float
+            If provided, the start time of the span in seconds since the
+            epoch, which is kept in `spans`
+            Default: None
+        """
+        with self._lock:
+            self._counts[phase] = self._counts.get(phase, 0) + 1
+            self._totals[phase] = self._totals.get(phase, 0.0) + seconds
+            if start is not None and len(self._spans) < self.max_spans:
+                self._spans.append((phase, start, seconds))
+
+    def set(self, phase, seconds):
+        """Replace all spans of `phase` with a single span of `seconds`"""
+        with self._lock:
+            self._counts[phase] = 1
+            self._totals[phase] = seconds
+
+    @contextmanager
+    def span(self, phase):
+        """Context manager that adds the duration of its block to `phase`"""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(phase, time.time() - start, start=start)
+
+    @property
+    def spans(self):
+        """List of (phase, start, seconds) tuples of the timed spans"""
+        with self._lock:
+            return list(self._spans)
+
+    @property
+    def phases(self):
+        """OrderedDict mapping each recorded phase to its PhaseTiming"""
+        with self._lock:
+            names = [p for p in self.PHASES if p in self._counts]
+            names += sorted(p for p in self._counts if p not in self.PHASES)
+            return OrderedDict(
+                (p, PhaseTiming(count=self._counts[p],
+                                total_s=self._totals[p]))
+                for p in names
+            )
+
+    @property
+    def total_s(self):
+        """Total seconds recorded across the client-side phases"""
+        return sum(t.total_s for p, t in self.phases.items()
+                   if p not in ['queue', 'run'])
+
+    @classmethod
+    def merge(cls, timings):
+        """Return the sum of a sequence of JobTimings instances
+
+        Parameters
+        ----------
+        timings : sequence of JobTimings
+
+        Returns
+        -------
+        JobTimings
+            New instance whose phase counts and totals are the combined
+            counts and totals of `timings`. Individual spans are not kept.
+        """
+        merged = cls()
+        for t in timings:
+            for phase, timing in t.phases.items():
+                merged._counts[phase] = (merged._counts.get(phase, 0)
+                                         + timing.count)
+                merged._totals[phase] = (merged._totals.get(phase, 0.0)
+                                         + timing.total_s)
+        return merged
+
+    def __repr__(self):
+        return 'JobTimings({spans:s})'.format(spans=', '.join(
+            '{p:s}={t:.3f}s/{c:d}'.format(p=p, t=t.total_s, c=t.count)
+            for p, t in self.phases.items()
+        ))
+
+
 # noinspection PyPropertyAccess,PyAttributeOutsideInit
 class JobDefinition(ObjectWithUsernameAndMemory):
     """Class for defining AWS Batch Job Definitions"""
@@ -1362,19 +1811,107 @@ class JobQueue(ObjectWithArn):
 
         return arn
 
-    def get_jobs(self, status='ALL'):
+    def _validate_statuses(self, status):
+        """Expand and validate the `status` input to list_jobs queries
+
+        Parameters
+        ----------
+        status : string or sequence of strings
+            A job status, a sequence of job statuses, or 'ALL'
+
+        Returns
+        -------
+        statuses : list
+            A list of individual job statuses
+        """
+        allowed_statuses = ['ALL'] + JOB_STATUSES
+
+        if isinstance(status, six.string_types):
+            statuses = [status]
+        else:
+            statuses = list(status)
+
+        if not statuses or not all(s in allowed_statuses for s in statuses):
+            raise CloudknotInputError('status must be one of {s!s} or a '
+                                      'sequence of those statuses'
+                                      ''.format(s=allowed_statuses))
+
+        if 'ALL' in statuses:
+            # AWS Batch list_jobs only returns RUNNING jobs if no status is
+            # specified, so 'ALL' must be expanded into each individual status
+            return list(JOB_STATUSES)
+
+        return statuses
+
+    def iter_jobs(self, status='ALL', array_job_id=None, page_size=100):
+        """Iterate over jobs in this job queue, following pagination tokens
+
+        Job summaries are yielded one page at a time, so that queues with
+        many jobs never need to be held in memory all at once.
+
+        Parameters
+        ----------
+        status : string or sequence of strings
+            The status or statuses on which to filter job results
+            Default: 'ALL'
+
+        array_job_id : string
+            If provided, list the child jobs of this array job instead of
+            the jobs in the queue
+            Default: None
+
+        page_size : int
+            Maximum number of results returned by each list_jobs call.
+            May be between 1 and 100.
+            Default: 100
+
+        Yields
+        ------
+        job_summary : dict
+            The AWS job summary for each job in this queue
+        """
+        if self.clobbered:
+            raise ResourceClobberedException(
+                'This job queue has already been clobbered.',
+                self.arn
+            )
+
+        self.check_profile_and_region()
+
+        if not 1 <= int(page_size) <= 100:
+            raise CloudknotInputError('page_size must be between 1 and 100')
+
+        for s in self._validate_statuses(status):
+            for summary in _list_jobs(job_queue=self.arn, status=s,
+                                      array_job_id=array_job_id,
+                                      page_size=int(page_size)):
+                yield summary
+
+    def get_jobs(self, status='ALL', array_job_id=None, max_threads=8):
         """Get jobs in this job queue
 
+        If more than one status is requested, each status is listed
+        concurrently. All result pages are retrieved.
+
         Parameters
         ----------
-        status : string
-            The status on which to filter job results
+        status : string or sequence of strings
+            The status or statuses on which to filter job results
             Default: 'ALL'
 
+        array_job_id : string
+            If provided, list the child jobs of this array job instead of
+            the jobs in the queue
+            Default: None
+
+        max_threads : int
+            Maximum number of threads used to list jobs concurrently
+            Default: 8
+
         Returns
         -------
-        job_ids : list
-            A list of job-IDs for jobs in this queue
+        job_summaries : list
+            A list of job summaries for jobs in this queue
         """
         if self.clobbered:
             raise ResourceClobberedException(
@@ -1384,24 +1921,66 @@ class JobQueue(ObjectWithArn):
 
         self.check_profile_and_region()
 
-        # Validate input
-        allowed_statuses = ['ALL', 'SUBMITTED', 'PENDING', 'RUNNABLE',
-                            'STARTING', 'RUNNING', 'SUCCEEDED', 'FAILED']
-        if status not in allowed_statuses:
-            raise CloudknotInputError('status must be one of {s!s}'
-                                      ''.format(s=allowed_statuses))
+        statuses = self._validate_statuses(status)
 
-        if status == 'ALL':
-            # status == 'ALL' is equivalent to not specifying a status at all
-            response = clients['batch'].list_jobs(jobQueue=self.arn)
-        else:
-            # otherwise, filter on status
-            response = clients['batch'].list_jobs(
-                jobQueue=self.arn, jobStatus=status
-            )
+        def list_status(s):
+            return list(_list_jobs(job_queue=self.arn, status=s,
+                                   array_job_id=array_job_id))
+
+        if len(statuses) == 1:
+            return list_status(statuses[0])
+
+        with ThreadPoolExecutor(max(min(len(statuses), max_threads), 1)) as e:
+            pages = list(e.map(list_status, statuses))
 
-        # Return list of job_ids
-        return response.get('jobSummaryList')
+        return [summary for page in pages for summary in page]
+
+    def get_jobs_table(self, status='ALL', array_job_id=None, max_threads=8,
+                       as_dataframe=False):
+        """Get jobs in this job queue as a columnar table
+
+        Parameters
+        ----------
+        status : string or sequence of strings
+            The status or statuses on which to filter job results
+            Default: 'ALL'
+
+        array_job_id : string
+            If provided, list the child jobs of this array job instead of
+            the jobs in the queue
+            Default: None
+
+        max_threads : int
+            Maximum number of threads used to list jobs concurrently
+            Default: 8
+
+        as_dataframe : bool
+            If True, return a pandas DataFrame. Requires pandas.
+            Default: False
+
+        Returns
+        -------
+        table : OrderedDict or pandas.DataFrame
+            Mapping of column name to list of values, with columns
+            ['job_id', 'job_name', 'status', 'status_reason', 'array_index',
+            'created_at', 'started_at', 'stopped_at']
+        """
+        summaries = self.get_jobs(status=status, array_job_id=array_job_id,
+                                  max_threads=max_threads)
+
+        columns = OrderedDict([
+            ('job_id', lambda j: j['jobId']),
+            ('job_name', lambda j: j.get('jobName')),
+            ('status', lambda j: j.get('status')),
+            ('status_reason', lambda j: j.get('statusReason')),
+            ('array_index',
+             lambda j: j.get('arrayProperties', {}).get('index')),
+            ('created_at', lambda j: j.get('createdAt')),
+            ('started_at', lambda j: j.get('startedAt')),
+            ('stopped_at', lambda j: j.get('stoppedAt')),
+        ])
+
+        return _to_columns(summaries, columns, as_dataframe=as_dataframe)
 
     def clobber(self):
         """Delete this batch job queue"""
@@ -1426,12 +2005,12 @@ class JobQueue(ObjectWithArn):
         )
 
         # Next, terminate all jobs that have not completed
-        for status in [
+        jobs = self.get_jobs(status=[
             'SUBMITTED', 'PENDING', 'RUNNABLE', 'STARTING', 'RUNNING'
-        ]:  # pragma: nocover
+        ])
+        if jobs:  # pragma: nocover
             # No unit test coverage here since it costs money to submit,
             # and then terminate, batch jobs
-            jobs = self.get_jobs(status=status)
             for job in jobs:
                 jid = job['jobId']
                 retry.call(
@@ -1458,9 +2037,15 @@ class JobQueue(ObjectWithArn):
 # noinspection PyPropertyAccess,PyAttributeOutsideInit
 class BatchJob(NamedObject):
     """Class for defining AWS Batch Job"""
+    #: Seconds to wait between status checks in `result`
+    _poll_interval = 5
+
     def __init__(self, job_id=None, name=None, job_queue=None,
                  job_definition=None, input_=None, starmap=False,
-                 environment_variables=None, array_job=True):
+                 environment_variables=None, array_job=True,
+                 input_job_id=None, input_indices=None,
+                 straggler_policy=None, result_cache_dir=None,
+                 substitutes=None, on_substitute=None):
         """Initialize an AWS Batch Job object.
 
         If requesting information on a pre-existing job, `job_id` is required.
@@ -1497,8 +2082,44 @@ class BatchJob(NamedObject):
         array_job : bool
             If True, this batch job will be an array_job.
             Default: True
+
+        input_job_id : string
+            If provided, this job does not upload its own input. Instead,
+            it reads the input already uploaded for the array job with this
+            jobID, selecting the elements given in `input_indices`.
+            Default: None
+
+        input_indices : sequence of ints
+            Indices into the input of `input_job_id` that this job should
+            process. Required if `input_job_id` is provided.
+            Default: None
+
+        straggler_policy : StragglerPolicy
+            If provided, straggling children of this array job are
+            speculatively re-executed while waiting for `result`.
+            Default: None
+
+        result_cache_dir : string
+            If provided, downloaded results are also saved in a subdirectory
+            of this directory, named for this job's jobID, and later
+            requests for the same result are read from there instead of S3.
+            Jobs submitted by `resubmit_failed` or by a straggler policy
+            share this directory.
+            Default: None
+
+        substitutes : dict
+            Record of the jobs that replace children of this job, as
+            returned by the `substitutes` property of an earlier instance.
+            Use this with `job_id` to restore resubmitted children and
+            speculative duplicates when adopting a job.
+            Default: None
+
+        on_substitute : callable
+            If provided, called with this BatchJob whenever the jobs that
+            replace its children change, e.g. to persist `substitutes`.
+            Default: None
         """
-        has_input = input_ is not None
+        has_input = input_ is not None or input_indices is not None
         if not (job_id or all([name, job_queue, has_input, job_definition])):
             raise CloudknotInputError('You must supply either job_id or '
                                       '(name, input_, job_queue, and '
@@ -1509,8 +2130,22 @@ class BatchJob(NamedObject):
                                       'input_, job_queue, and '
                                       'job_definition), not both.')
 
+        if bool(input_job_id) != (input_indices is not None):
+            raise CloudknotInputError('input_job_id and input_indices must be '
+                                      'supplied together.')
+
         self._starmap = starmap
 
+        if straggler_policy is not None and not isinstance(
+                straggler_policy, StragglerPolicy
+        ):
+            raise CloudknotInputError('if provided, straggler_policy must be '
+                                      'a StragglerPolicy instance.')
+
+        self._init_state(straggler_policy=straggler_policy,
+                         result_cache_dir=result_cache_dir,
+                         on_substitute=on_substitute)
+
         if job_id:
             job = self._exists_already(job_id=job_id)
             if not job.exists:
@@ -1528,18 +2163,23 @@ class BatchJob(NamedObject):
             self._environment_variables = job.environment_variables
             self._job_id = job.job_id
             self._array_job = job.array_job
-
-            bucket = self._job_definition.output_bucket
-            key = '/'.join([
-                'cloudknot.jobs',
-                self._job_definition.name,
-                self._job_id,
-                'input.pickle'
-            ])
+            self._input_job_id = job.input_job_id
+            self._input_indices = None
 
             try:
-                response = clients['s3'].get_object(Bucket=bucket, Key=key)
-                self._input = pickle.loads(response.get('Body').read())
+                if self._input_job_id:
+                    self._input_indices = self._get_pickled_object(
+                        self._job_id, 'input-indices.pickle'
+                    )
+                    source_input = self._get_pickled_object(
+                        self._input_job_id, 'input.pickle'
+                    )
+                    self._input = [source_input[i]
+                                   for i in self._input_indices]
+                else:
+                    self._input = self._get_pickled_object(
+                        self._job_id, 'input.pickle'
+                    )
             except (clients['s3'].exceptions.NoSuchBucket,
                     clients['s3'].exceptions.NoSuchKey):
                 self._input = None
@@ -1549,6 +2189,9 @@ class BatchJob(NamedObject):
                 self._section_name, self.job_id, self.name
             )
 
+            if substitutes:
+                self._restore_substitutes(substitutes)
+
             mod_logger.info('Retrieved pre-existing batch job {id:s}'.format(
                 id=self.job_id
             ))
@@ -1581,8 +2224,40 @@ class BatchJob(NamedObject):
 
             self._input = input_
             self._array_job = array_job
+            self._input_job_id = input_job_id
+            self._input_indices = (list(input_indices)
+                                   if input_indices is not None else None)
             self._job_id = self._create()
 
+    def _init_state(self, straggler_policy=None, result_cache_dir=None,
+                    on_substitute=None):
+        """Initialize the state that a job keeps while waiting for results
+
+        Subclasses that do not call the BatchJob constructor, such as
+        cloudknot.local.LocalBatchJob, call this instead. See `__init__`
+        for the parameters.
+        """
+        self._straggler_policy = straggler_policy
+        self._result_cache_dir = result_cache_dir
+
+        # Map from input index to the (BatchJob, index) pair that replaces
+        # the child job at that index, e.g. after resubmit_failed()
+        self._substitutes = {}
+
+        # Speculative duplicates that have not yet been resolved, a subset
+        # of self._substitutes
+        self._speculative = {}
+        self._num_duplicates = 0
+        self._on_substitute = on_substitute
+
+        # Runtimes in milliseconds of succeeded children, by array index,
+        # and start times of running children that list_jobs reported
+        # without one
+        self._succeeded_runtimes = {}
+        self._running_started = {}
+
+        self._timings = JobTimings()
+
     @property
     def job_queue(self):
         """JobQueue instance to which this job will be submitted"""
@@ -1628,6 +2303,150 @@ class BatchJob(NamedObject):
         """This job's AWS jobID"""
         return self._job_id
 
+    @property
+    def input_job_id(self):
+        """The jobID whose uploaded input this job reads, if not its own"""
+        return self._input_job_id
+
+    @property
+    def input_indices(self):
+        """Indices into the input of `input_job_id` processed by this job"""
+        return self._input_indices
+
+    @property
+    def result_cache_dir(self):
+        """Local directory in which downloaded results are cached"""
+        return self._result_cache_dir
+
+    @property
+    def timings(self):
+        """JobTimings recording the time spent in each phase of this job"""
+        return self._timings
+
+    @property
+    def substitutes(self):
+        """JSON serializable record of the jobs replacing this job's children
+
+        A dict with keys 'num_duplicates', the number of speculative
+        duplicates submitted so far, and 'jobs', a list of dicts with keys
+        'index', 'job_id', 'sub_index' and 'speculative'. Pass it as
+        `substitutes` when adopting this job by `job_id`.
+        """
+        return {
+            'num_duplicates': self._num_duplicates,
+            'jobs': [{
+                'index': idx,
+                'job_id': job.job_id,
+                'sub_index': sub_idx,
+                'speculative': idx in self._speculative,
+            } for idx, (job, sub_idx) in sorted(self._substitutes.items())]
+        }
+
+    def _restore_substitutes(self, substitutes):
+        """Adopt the substitute jobs recorded by the `substitutes` property"""
+        jobs = {}
+        for record in substitutes.get('jobs', []):
+            job_id = record['job_id']
+            if job_id not in jobs:
+                jobs[job_id] = BatchJob(
+                    job_id=job_id, result_cache_dir=self.result_cache_dir
+                )
+
+            pair = (jobs[job_id], record['sub_index'])
+            self._substitutes[record['index']] = pair
+            if record['speculative']:
+                self._speculative[record['index']] = pair
+
+        self._num_duplicates = substitutes.get('num_duplicates', 0)
+
+    def _substitutes_changed(self):
+        """Notify the `on_substitute` callback, if any"""
+        if self._on_substitute is not None:
+            self._on_substitute(self)
+
+    def cached_indices(self):
+        """Return the array indices whose results are in the local cache
+
+        Returns
+        -------
+        cached_indices : list
+            Sorted list of indices whose results have already been
+            downloaded. Empty if this job has no `result_cache_dir`.
+        """
+        if self._result_cache_dir is None:
+            return []
+
+        job_dir = os.path.join(self._result_cache_dir, self.job_id)
+        if not os.path.isdir(job_dir):
+            return []
+
+        return sorted(
+            int(f.split('.')[0]) for f in os.listdir(job_dir)
+            if f.endswith('.pickle') and f.split('.')[0].isdigit()
+        )
+
+    def _job_key(self, job_id, *parts):
+        """Return the S3 key of a file stored for a batch job
+
+        Parameters
+        ----------
+        job_id : string
+            The jobID under which the file is stored
+
+        parts : strings or ints
+            Remaining key components, e.g. the array index, the attempt
+            and the file name
+
+        Returns
+        -------
+        key : string
+        """
+        return '/'.join(['cloudknot.jobs', self.job_definition.name, job_id]
+                        + [str(p) for p in parts])
+
+    def _get_object(self, key):
+        """Return the contents of an object in the job definition's bucket
+
+        Parameters
+        ----------
+        key : string
+            The object's S3 key
+
+        Returns
+        -------
+        body : bytes or None
+            The object's contents, or None if there is no such key
+        """
+        try:
+            response = clients['s3'].get_object(
+                Bucket=self.job_definition.output_bucket, Key=key
+            )
+        except clients['s3'].exceptions.NoSuchKey:
+            return None
+
+        return response.get('Body').read()
+
+    def _get_pickled_object(self, job_id, filename):
+        """Download and unpickle an object stored in S3 for a batch job
+
+        Parameters
+        ----------
+        job_id : string
+            The jobID under which the object is stored
+
+        filename : string
+            The object's file name, e.g. 'input.pickle'
+
+        Returns
+        -------
+        The unpickled object
+        """
+        response = clients['s3'].get_object(
+            Bucket=self._job_definition.output_bucket,
+            Key=self._job_key(job_id, filename)
+        )
+        return pickle.loads(response.get('Body').read())
+
     def _exists_already(self, job_id):
         """Check if an AWS batch job exists already
 
@@ -1640,13 +2459,15 @@ class BatchJob(NamedObject):
         namedtuple JobExists
             A namedtuple with fields
             ['exists', 'name', 'job_id', 'job_queue_arn',
-             'job_definition_arn', 'environment_variables', 'array_job']
+             'job_definition_arn', 'environment_variables', 'array_job',
+             'input_job_id']
         """
         # define a namedtuple for return value type
         JobExists = namedtuple(
             'JobExists',
             ['exists', 'name', 'job_id', 'job_queue_arn',
-             'job_definition_arn', 'environment_variables', 'array_job']
+             'job_definition_arn', 'environment_variables', 'array_job',
+             'input_job_id']
         )
         # make all but the first value default to None
         JobExists.__new__.__defaults__ = \
@@ -1663,6 +2484,12 @@ class BatchJob(NamedObject):
 
             array_job = 'arrayProperties' in job
 
+            command = job['container'].get('command', [])
+            if '--input-jobid' in command:
+                input_job_id = command[command.index('--input-jobid') + 1]
+            else:
+                input_job_id = None
+
             mod_logger.info('Job {id:s} exists.'.format(id=job_id))
 
             return JobExists(
@@ -1670,7 +2497,7 @@ class BatchJob(NamedObject):
                 job_queue_arn=job_queue_arn,
                 job_definition_arn=job_definition_arn,
                 environment_variables=environment_variables,
-                array_job=array_job
+                array_job=array_job, input_job_id=input_job_id
             )
         else:
             return JobExists(exists=False)
@@ -1687,9 +2514,22 @@ class BatchJob(NamedObject):
         # unit testing would be expensive
         bucket = self.job_definition.output_bucket
         sse = get_s3_params().sse
-        pickled_input = cloudpickle.dumps(self.input)
+
+        with self._timings.span('serialize'):
+            if self.input_job_id:
+                # Reuse the input that was already uploaded for another job
+                upload_name = 'input-indices.pickle'
+                pickled_input = cloudpickle.dumps(self.input_indices)
+                array_size = len(self.input_indices)
+            else:
+                upload_name = 'input.pickle'
+                pickled_input = cloudpickle.dumps(self.input)
+                array_size = len(self.input) if self.array_job else None
 
         command = [self.job_definition.output_bucket]
+        if self.input_job_id:
+            command = ['--input-jobid', self.input_job_id] + command
+
         if self.starmap:
             command = ['--starmap'] + command
 
@@ -1711,40 +2551,41 @@ class BatchJob(NamedObject):
 
         # We have to submit before uploading the input in order to get the
         # jobID first.
-        if self.array_job:
-            response = clients['batch'].submit_job(
-                jobName=self.name,
-                jobQueue=self.job_queue_arn,
-                arrayProperties={'size': len(self.input)},
-                jobDefinition=self.job_definition_arn,
-                containerOverrides=container_overrides
-            )
-        else:
-            response = clients['batch'].submit_job(
-                jobName=self.name,
-                jobQueue=self.job_queue_arn,
-                jobDefinition=self.job_definition_arn,
-                containerOverrides=container_overrides
-            )
+        with self._timings.span('submit'):
+            if self.array_job:
+                response = clients['batch'].submit_job(
+                    jobName=self.name,
+                    jobQueue=self.job_queue_arn,
+                    arrayProperties={'size': array_size},
+                    jobDefinition=self.job_definition_arn,
+                    containerOverrides=container_overrides
+                )
+            else:
+                response = clients['batch'].submit_job(
+                    jobName=self.name,
+                    jobQueue=self.job_queue_arn,
+                    jobDefinition=self.job_definition_arn,
+                    containerOverrides=container_overrides
+                )
 
         job_id = response['jobId']
-        key = '/'.join([
-            'cloudknot.jobs', self.job_definition.name, job_id, 'input.pickle'
-        ])
+        key = self._job_key(job_id, upload_name)
 
         # Upload the input pickle
-        if sse:
-            clients['s3'].put_object(Bucket=bucket, Body=pickled_input,
-                                     Key=key, ServerSideEncryption=sse)
-        else:
-            clients['s3'].put_object(Bucket=bucket, Body=pickled_input,
-                                     Key=key)
+        with self._timings.span('upload'):
+            if sse:
+                clients['s3'].put_object(Bucket=bucket, Body=pickled_input,
+                                         Key=key, ServerSideEncryption=sse)
+            else:
+                clients['s3'].put_object(Bucket=bucket, Body=pickled_input,
+                                         Key=key)
 
         # Add this job to the list of jobs in the config file
-        self._section_name = self._get_section_name('batch-jobs')
-        cloudknot.config.add_resource(
-            self._section_name, job_id, self.name
-        )
+        with self._timings.span('record'):
+            self._section_name = self._get_section_name('batch-jobs')
+            cloudknot.config.add_resource(
+                self._section_name, job_id, self.name
+            )
 
         mod_logger.info(
             'Submitted batch job {name:s} with jobID '
@@ -1760,8 +2601,10 @@ class BatchJob(NamedObject):
         Returns
         -------
         status : dict
-            dictionary with keys: {status, statusReason, attempts}
-            for this AWS batch job
+            dictionary with keys: {status, statusReason, attempts,
+            createdAt, startedAt, stoppedAt} for this AWS batch job, and
+            arrayProperties for array jobs. The timestamps are None until
+            the job reaches the corresponding stage.
         """
         if self.clobbered:
             raise ResourceClobberedException(
@@ -1776,7 +2619,8 @@ class BatchJob(NamedObject):
         job = response.get('jobs')[0]
 
         # Return only a subset of the job dictionary
-        keys = ['status', 'statusReason', 'attempts']
+        keys = ['status', 'statusReason', 'attempts', 'createdAt',
+                'startedAt', 'stoppedAt']
 
         if self.array_job:
             keys.append('arrayProperties')
@@ -1819,61 +2663,488 @@ class BatchJob(NamedObject):
         FAILED and the job has exceeded the max number of retry attempts
         """
         stat = self.status
+
+        # Array parents have no attempts of their own. They only fail once
+        # their children have exhausted their retries.
         done = (stat['status'] == 'SUCCEEDED'
                 or (stat['status'] == 'FAILED'
-                    and len(stat['attempts']) >= self.job_definition.retries))
+                    and (self.array_job
+                         or len(stat['attempts'])
+                         >= self.job_definition.retries)))
 
         return done
 
-    def _collect_array_job_result(self, idx=0):
-        """Collect the array job results and return as a complete list
+    def _get_latest_attempt_object(self, idx, filename):
+        """Return a file written by the latest attempt of a child job
 
         Parameters
         ----------
         idx : int
-            Index of the array job element to be retrieved.
-            Default: 0
+            Index of the array job element
+
+        filename : string
+            The file name, e.g. 'output.pickle'
 
         Returns
         -------
-        The array job element at index `idx`
+        key : string
+            The S3 key of the file from the earliest attempt checked
+        body : bytes or None
+            The file contents, or None if no attempt wrote the file
         """
-        bucket = self.job_definition.output_bucket
-
         # For array jobs, different child jobs may have had different
         # numbers of attempts. So we start at the highest possible attempt
         # number and retrieve the latest one.
         attempt = self.job_definition.retries
-        result_retrieved = False
+        key = body = None
 
-        while not result_retrieved and attempt >= 0:
-            key = '/'.join([
-                'cloudknot.jobs', self.job_definition.name,
-                self.job_id, str(idx),
-                '{0:03d}'.format(attempt), 'output.pickle'
-            ])
+        while body is None and attempt >= 0:
+            key = self._job_key(self.job_id, idx, '{0:03d}'.format(attempt),
+                                filename)
+            body = self._get_object(key)
+            attempt -= 1
 
-            try:
-                response = clients['s3'].get_object(Bucket=bucket, Key=key)
-                result_retrieved = True
-            except clients['s3'].exceptions.NoSuchKey:
-                attempt -= 1
+        return key, body
+
+    def container_metrics(self, max_threads=8):
+        """Return the runtime metrics recorded inside each child's container
 
-        if not result_retrieved:
+        The container script records the time spent downloading and
+        unpickling the input, in the function itself, and pickling and
+        uploading the output, along with python startup and import time,
+        peak RSS and CPU time. If the environment variable
+        CLOUDKNOT_METRICS is 1 in the container, e.g. with
+        `Knot.map(..., collect_metrics=True)`, these are saved as
+        metrics.json next to each attempt's output.pickle.
+
+        Parameters
+        ----------
+        max_threads : int
+            Maximum number of threads used to download the metrics
+            Default: 8
+
+        Returns
+        -------
+        metrics : dict
+            Mapping of array index to the metrics dict of the latest
+            attempt of that child. Children without metrics, e.g. those
+            that have not finished, are omitted.
+        """
+        def get_metrics(idx):
+            _, body = self._get_latest_attempt_object(idx, 'metrics.json')
+            return idx, json.loads(body.decode()) if body else None
+
+        indices = list(range(self._num_elements()))
+        with ThreadPoolExecutor(max(min(len(indices), max_threads), 1)) as e:
+            return {idx: m for idx, m in e.map(get_metrics, indices) if m}
+
+    def _collect_array_job_result(self, idx=0):
+        """Collect the array job results and return as a complete list
+
+        Parameters
+        ----------
+        idx : int
+            Index of the array job element to be retrieved.
+            Default: 0
+
+        Returns
+        -------
+        The array job element at index `idx`
+        """
+        cache_file = None
+        if self._result_cache_dir is not None:
+            job_dir = os.path.join(self._result_cache_dir, self.job_id)
+            cache_file = os.path.join(job_dir, '{i:d}.pickle'.format(i=idx))
+            if os.path.isfile(cache_file):
+                with self._timings.span('cache_read'):
+                    with open(cache_file, 'rb') as f:
+                        return pickle.load(f)
+
+        with self._timings.span('download'):
+            key, body = self._get_latest_attempt_object(idx, 'output.pickle')
+
+        if body is None:
             raise CKTimeoutError(
                 'Result not available in bucket {bucket:s} with key {key:s}'
-                ''.format(bucket=bucket, key=key)
+                ''.format(bucket=self.job_definition.output_bucket, key=key)
             )
 
-        return pickle.loads(response.get('Body').read())
+        if cache_file is not None:
+            try:
+                os.makedirs(job_dir)
+            except OSError as e:
+                if not (e.errno == errno.EEXIST and os.path.isdir(job_dir)):
+                    raise e
+
+            # Write to a temporary file first so that an interrupted
+            # download never leaves a truncated result in the cache
+            tmp_file = cache_file + '.tmp'
+            with open(tmp_file, 'wb') as f:
+                f.write(body)
+            os.rename(tmp_file, cache_file)
+
+        with self._timings.span('unpickle'):
+            return pickle.loads(body)
+
+    def _num_elements(self):
+        """Return the number of input elements (array children) of this job"""
+        if not self.array_job:
+            return 1
+
+        if self.input is not None:
+            return len(self.input)
+
+        return self.status['arrayProperties']['size']
+
+    def _final_statuses(self):
+        """Return the final status of each finished child of this job
+
+        Returns
+        -------
+        statuses : dict
+            Mapping of array index to 'SUCCEEDED' or 'FAILED' for each child
+            that has finished. For non-array jobs, the only index is 0.
+        """
+        if not self.array_job:
+            return {0: self.status['status']}
+
+        statuses = {}
+        for status in ['SUCCEEDED', 'FAILED']:
+            for summary in _list_jobs(array_job_id=self.job_id,
+                                      status=status):
+                statuses[summary['arrayProperties']['index']] = status
+
+        return statuses
+
+    def failed_indices(self):
+        """Return the input indices whose jobs have failed
+
+        Indices that have been resubmitted (see `resubmit_failed`) are only
+        reported as failed if their resubmitted job has also failed.
 
-    def result(self, timeout=None):
+        Returns
+        -------
+        failed_indices : list
+            Sorted list of the failed input indices
+        """
+        statuses = self._final_statuses()
+        failed = []
+        for idx in range(self._num_elements()):
+            if statuses.get(idx) == 'SUCCEEDED':
+                continue
+            elif idx in self._substitutes:
+                job, sub_idx = self._substitutes[idx]
+                if sub_idx in job.failed_indices():
+                    failed.append(idx)
+            elif statuses.get(idx) == 'FAILED':
+                failed.append(idx)
+
+        return failed
+
+    def resubmit_failed(self, name=None):
+        """Submit a new array job covering only the failed children
+
+        The new job reuses the input that was already uploaded for this job.
+        Once submitted, `result` merges the results of the new job with the
+        successful results of this job.
+
+        Parameters
+        ----------
+        name : string
+            Name of the new batch job
+            Default: this job's name + '-resubmit'
+
+        Returns
+        -------
+        job : BatchJob or None
+            The newly submitted BatchJob or None if no children have failed
+        """
+        if self.clobbered:
+            raise ResourceClobberedException(
+                'This batch job has already been clobbered.',
+                self.job_id
+            )
+
+        self.check_profile_and_region()
+
+        if not self.array_job:
+            raise CloudknotInputError('Only array jobs can resubmit their '
+                                      'failed children.')
+
+        failed = self.failed_indices()
+        if not failed:
+            return None
+
+        # Always point the new job at the job that originally uploaded the
+        # input, even if this job was itself a resubmission
+        if self.input_job_id:
+            input_job_id = self.input_job_id
+            input_indices = [self.input_indices[i] for i in failed]
+        else:
+            input_job_id = self.job_id
+            input_indices = failed
+
+        job_queue = (self.job_queue if self.job_queue
+                     else JobQueue(arn=self.job_queue_arn))
+
+        # AWS Batch array jobs must have at least two children
+        job = BatchJob(
+            name=name if name else self.name + '-resubmit',
+            job_queue=job_queue,
+            job_definition=self.job_definition,
+            input_=([self.input[i] for i in failed]
+                    if self.input is not None else None),
+            starmap=self.starmap,
+            environment_variables=self.environment_variables,
+            array_job=len(failed) > 1,
+            input_job_id=input_job_id,
+            input_indices=input_indices,
+            result_cache_dir=self.result_cache_dir
+        )
+
+        for sub_idx, idx in enumerate(failed):
+            self._substitutes[idx] = (job, sub_idx)
+
+        self._substitutes_changed()
+
+        mod_logger.info(
+            'Resubmitted {n:d} failed children of job {jid:s} as job '
+            '{new_jid:s}'.format(n=len(failed), jid=self.job_id,
+                                 new_jid=job.job_id)
+        )
+
+        return job
+
+    def _terminate_child(self, job, idx, reason):
+        """Terminate the child of `job` that processes element `idx`"""
+        child_id = job.job_id + ':' + str(idx) if job.array_job else job.job_id
+        clients['batch'].terminate_job(jobId=child_id, reason=reason)
+        mod_logger.info('Terminated job {jid:s}: {reason:s}'.format(
+            jid=child_id, reason=reason
+        ))
+
+    def _mitigate_stragglers(self):
+        """Speculatively re-execute straggling children of this array job
+
+        Resolve previously submitted duplicates by terminating whichever of
+        the original child and its duplicate did not finish first. Then, if
+        enough children have succeeded, submit duplicates for running
+        children whose runtime exceeds the policy's multiple of the median
+        succeeded runtime.
+
+        This runs on every poll of `result`, so it avoids per-child calls.
+        Until the parent's status summary shows that the policy's quantile
+        of children have succeeded, it makes no list_jobs calls. Runtimes
+        are taken from the list_jobs summaries and cached, and only
+        children whose summaries lack timestamps are described, once.
+        """
+        policy = self._straggler_policy
+        num_elements = self._num_elements()
+
+        summary = self.status.get('arrayProperties', {}).get(
+            'statusSummary', {}
+        )
+        quantile_reached = (summary.get('SUCCEEDED', 0)
+                            >= policy.quantile * num_elements)
+        if not (quantile_reached or self._speculative):
+            return
+
+        succeeded_idx = set()
+        undescribed = []
+        for child in _list_jobs(array_job_id=self.job_id,
+                                status='SUCCEEDED'):
+            idx = child['arrayProperties']['index']
+            succeeded_idx.add(idx)
+            if idx in self._succeeded_runtimes:
+                continue
+            if child.get('startedAt') and child.get('stoppedAt'):
+                self._succeeded_runtimes[idx] = (child['stoppedAt']
+                                                 - child['startedAt'])
+            else:
+                undescribed.append(child['jobId'])
+
+        # Resolve the race between originals and their duplicates
+        duplicate_statuses = {}
+        resolved = False
+        for idx, (job, sub_idx) in list(self._speculative.items()):
+            if idx in succeeded_idx:
+                self._terminate_child(job, sub_idx,
+                                      'Original job finished first')
+                del self._substitutes[idx]
+                del self._speculative[idx]
+                resolved = True
+                continue
+
+            if job.job_id not in duplicate_statuses:
+                duplicate_statuses[job.job_id] = job._final_statuses()
+
+            sub_status = duplicate_statuses[job.job_id].get(sub_idx)
+            if sub_status == 'SUCCEEDED':
+                self._terminate_child(self, idx,
+                                      'Speculative duplicate finished first')
+                del self._speculative[idx]
+                resolved = True
+            elif sub_status == 'FAILED':
+                # The duplicate lost, fall back on the original child
+                del self._substitutes[idx]
+                del self._speculative[idx]
+                resolved = True
+
+        if resolved:
+            self._substitutes_changed()
+
+        if not quantile_reached:
+            return
+
+        if (policy.max_duplicates is not None
+                and self._num_duplicates >= policy.max_duplicates):
+            return
+
+        started = {}
+        for child in _list_jobs(array_job_id=self.job_id, status='RUNNING'):
+            idx = child['arrayProperties']['index']
+            if child.get('startedAt'):
+                started[idx] = child['startedAt']
+            elif idx in self._running_started:
+                started[idx] = self._running_started[idx]
+            else:
+                undescribed.append(child['jobId'])
+
+        # Only children whose summaries lack timestamps are described
+        for job in describe_jobs(undescribed):
+            idx = job['arrayProperties']['index']
+            if job['status'] == 'SUCCEEDED':
+                attempt = job['attempts'][-1] if job.get('attempts') else job
+                if attempt.get('startedAt') and attempt.get('stoppedAt'):
+                    self._succeeded_runtimes[idx] = (attempt['stoppedAt']
+                                                     - attempt['startedAt'])
+            elif job.get('startedAt'):
+                self._running_started[idx] = job['startedAt']
+                started[idx] = job['startedAt']
+
+        if not self._succeeded_runtimes:
+            return
+
+        now = time.time() * 1000
+        threshold = policy.multiplier * _median(
+            self._succeeded_runtimes.values()
+        )
+        stragglers = sorted(
+            idx for idx, t0 in started.items()
+            if now - t0 > threshold and idx not in self._substitutes
+        )
+
+        if policy.max_duplicates is not None:
+            stragglers = stragglers[:policy.max_duplicates
+                                    - self._num_duplicates]
+
+        if not stragglers:
+            return
+
+        if self.input_job_id:
+            input_job_id = self.input_job_id
+            input_indices = [self.input_indices[i] for i in stragglers]
+        else:
+            input_job_id = self.job_id
+            input_indices = stragglers
+
+        duplicate = BatchJob(
+            name=self.name + '-speculative',
+            job_queue=(self.job_queue if self.job_queue
+                       else JobQueue(arn=self.job_queue_arn)),
+            job_definition=self.job_definition,
+            input_=([self.input[i] for i in stragglers]
+                    if self.input is not None else None),
+            starmap=self.starmap,
+            environment_variables=self.environment_variables,
+            array_job=len(stragglers) > 1,
+            input_job_id=input_job_id,
+            input_indices=input_indices,
+            result_cache_dir=self.result_cache_dir
+        )
+
+        for sub_idx, idx in enumerate(stragglers):
+            self._substitutes[idx] = (duplicate, sub_idx)
+            self._speculative[idx] = (duplicate, sub_idx)
+
+        self._num_duplicates += len(stragglers)
+        self._substitutes_changed()
+
+        mod_logger.info(
+            'Speculatively re-executing {n:d} straggling children of job '
+            '{jid:s} as job {dup:s}'.format(n=len(stragglers),
+                                            jid=self.job_id,
+                                            dup=duplicate.job_id)
+        )
+
+    def _resolve_speculative(self):
+        """Resolve the duplicates that still race once this job is done
+
+        A straggler that finishes while its duplicate is still running
+        ends the polling in `result` before `_mitigate_stragglers` sees it.
+        Duplicates of children that succeeded are terminated. Duplicates of
+        children that failed remain their substitutes.
+        """
+        statuses = self._final_statuses()
+        for idx, (job, sub_idx) in list(self._speculative.items()):
+            if statuses.get(idx) == 'SUCCEEDED':
+                self._terminate_child(job, sub_idx,
+                                      'Original job finished first')
+                del self._substitutes[idx]
+            del self._speculative[idx]
+
+        self._substitutes_changed()
+
+    def _partial_result(self, timeout=None):
+        """Collect successful results and per-index errors for this job
+
+        Parameters
+        ----------
+        timeout: int or float
+            timeout time in seconds passed to substitute jobs
+
+        Returns
+        -------
+        PartialResult
+            namedtuple with fields `results` and `errors`
+        """
+        statuses = self._final_statuses()
+        num_elements = self._num_elements()
+        results = [None] * num_elements
+        errors = {}
+        substitutes = {}
+
+        for idx in range(num_elements):
+            if statuses.get(idx) == 'SUCCEEDED':
+                results[idx] = self._collect_array_job_result(idx)
+            elif idx in self._substitutes:
+                job, sub_idx = self._substitutes[idx]
+                substitutes.setdefault(job.job_id, (job, []))[1].append(
+                    (idx, sub_idx)
+                )
+            else:
+                child_id = (self.job_id + ':' + str(idx) if self.array_job
+                            else self.job_id)
+                errors[idx] = BatchJobFailedError(child_id)
+
+        for job, pairs in substitutes.values():
+            sub_result = job.result(timeout=timeout, partial=True)
+            for idx, sub_idx in pairs:
+                if sub_idx in sub_result.errors:
+                    errors[idx] = sub_result.errors[sub_idx]
+                else:
+                    results[idx] = sub_result.results[sub_idx]
+
+        return PartialResult(results=results, errors=errors)
+
+    def result(self, timeout=None, partial=False):
         """Return the result of the latest attempt
 
         If the call hasn't yet completed then this method will wait up to
         timeout seconds. If the call hasn't completed in timeout seconds,
         then a CKTimeoutError is raised. If the batch job is in FAILED status
-        then a BatchJobFailedError is raised.
+        then a BatchJobFailedError is raised, unless `partial` is True or
+        the failed children have been resubmitted with `resubmit_failed`.
 
         Parameters
         ----------
@@ -1882,6 +3153,13 @@ class BatchJob(NamedObject):
             there is no limit to the wait time.
             Default: None
 
+        partial: bool
+            If True, do not raise BatchJobFailedError for failed children.
+            Instead, return a PartialResult namedtuple with fields `results`,
+            a list of results with None at failed indices, and `errors`, a
+            dict mapping each failed index to its BatchJobFailedError.
+            Default: False
+
         Returns
         -------
         result:
@@ -1893,22 +3171,61 @@ class BatchJob(NamedObject):
         def time_diff():
             return (datetime.now() - start_time).seconds
 
-        while not self.done and (timeout is None or time_diff() < timeout):
-            time.sleep(5)
+        with self._timings.span('wait'):
+            while not self.done and (timeout is None
+                                     or time_diff() < timeout):
+                if self._straggler_policy is not None and self.array_job:
+                    self._mitigate_stragglers()
+                time.sleep(self._poll_interval)
 
         if not self.done:
             raise CKTimeoutError(self.job_id)
 
+        if self._speculative:
+            self._resolve_speculative()
+
         status = self.status
-        if status['status'] == 'FAILED':
+        self._record_server_timings(status)
+        if partial or self._substitutes:
+            partial_result = self._partial_result(timeout=timeout)
+            if partial:
+                return partial_result
+
+            if partial_result.errors:
+                raise BatchJobFailedError(self.job_id)
+
+            if self.array_job:
+                return partial_result.results
+            else:
+                return partial_result.results[0]
+        elif status['status'] == 'FAILED':
             raise BatchJobFailedError(self.job_id)
         else:
             if self.array_job:
                 return [self._collect_array_job_result(idx)
-                        for idx in range(len(self.input))]
+                        for idx in range(self._num_elements())]
             else:
                 return self._collect_array_job_result()
 
+    def _record_server_timings(self, status):
+        """Record the queue and run phases from a finished job's status
+
+        Parameters
+        ----------
+        status : dict
+            The job's status, as returned by `status`. The AWS Batch
+            timestamps createdAt, startedAt and stoppedAt, in milliseconds,
+            are used if present.
+        """
+        created = status.get('createdAt')
+        started = status.get('startedAt')
+        stopped = status.get('stoppedAt')
+
+        if created and started:
+            self._timings.set('queue', (started - created) / 1000.0)
+        if started and stopped:
+            self._timings.set('run', (stopped - started) / 1000.0)
+
     def terminate(self, reason):
         """Kill AWS batch job using instance parameter `self.job_id`
 
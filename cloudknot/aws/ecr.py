@@ -1,15 +1,92 @@
 from __future__ import absolute_import, division, print_function
 
+import base64
+import calendar
 import cloudknot.config
 import logging
+import threading
+import time
 from collections import namedtuple
 
-from .base_classes import NamedObject, clients, get_ecr_repo
+from .base_classes import NamedObject, clients, get_ecr_repo, \
+    get_profile, get_region, CloudknotConfigurationError
 
-__all__ = ["DockerRepo"]
+__all__ = ["DockerRepo", "get_ecr_auth_config", "clear_ecr_auth_cache"]
 
 mod_logger = logging.getLogger(__name__)
 
+#: Seconds before its expiry at which a cached ECR token is renewed
+ECR_TOKEN_REFRESH_MARGIN = 300
+
+# Cached docker credentials keyed by (profile, region, registry ID), each
+# with the unix time at which the token expires
+_ecr_auth_cache = {}
+_ecr_auth_lock = threading.Lock()
+
+
+def get_ecr_auth_config(registry_id=None):
+    """Return docker credentials for an AWS ECR registry
+
+    The credentials come from ecr.get_authorization_token and are cached
+    until shortly before the token expires, so repeated pushes need neither
+    an API call nor a `docker login`. Pass them to docker-py as
+    `auth_config`.
+
+    Parameters
+    ----------
+    registry_id : string
+        AWS account ID of the registry
+        Default: the registry of the current profile's account
+
+    Returns
+    -------
+    auth_config : dict
+        Dictionary with keys username, password and registry
+    """
+    key = (get_profile(), get_region(), registry_id)
+
+    with _ecr_auth_lock:
+        cached = _ecr_auth_cache.get(key)
+        if cached is not None \
+                and cached[1] - ECR_TOKEN_REFRESH_MARGIN > time.time():
+            return dict(cached[0])
+
+        kwargs = {'registryIds': [registry_id]} if registry_id else {}
+        response = clients['ecr'].get_authorization_token(**kwargs)
+
+        try:
+            data = response['authorizationData'][0]
+            username, password = base64.b64decode(
+                data['authorizationToken']
+            ).decode('utf-8').split(':', 1)
+        except (IndexError, KeyError, ValueError):  # pragma: nocover
+            raise CloudknotConfigurationError(
+                'Unable to get an AWS ECR authorization token for registry '
+                '{id!s}'.format(id=registry_id)
+            )
+
+        auth_config = {
+            'username': username,
+            'password': password,
+            'registry': data['proxyEndpoint'],
+        }
+
+        expires_at = data['expiresAt']
+        if hasattr(expires_at, 'utctimetuple'):
+            expires_at = calendar.timegm(expires_at.utctimetuple())
+
+        _ecr_auth_cache[key] = (auth_config, expires_at)
+        mod_logger.info('Got AWS ECR authorization token for '
+                        '{ep:s}'.format(ep=data['proxyEndpoint']))
+
+        return dict(auth_config)
+
+
+def clear_ecr_auth_cache():
+    """Discard all cached AWS ECR credentials"""
+    with _ecr_auth_lock:
+        _ecr_auth_cache.clear()
+
 
 # noinspection PyPropertyAccess,PyAttributeOutsideInit
 class DockerRepo(NamedObject):
@@ -1,21 +1,155 @@
 from __future__ import absolute_import, division, print_function
 
+import cloudpickle
 import configparser
+import docker
+import functools
+import hashlib
+import json
 import logging
 import operator
+import os
+import shutil
 import six
-from collections import Iterable
+import tempfile
+import time
+import uuid
+from collections import Iterable, OrderedDict
 from concurrent.futures import ThreadPoolExecutor
 
+from . import analytics
 from . import aws
-from .config import get_config_file, rlock
+from .config import add_resource, get_config_file, get_maps_dir, rlock
 from . import dockerimage
+from . import emulator
 
 __all__ = ["Pars", "Knot"]
 
 mod_logger = logging.getLogger(__name__)
 
 
+def _manifest_path(map_id):
+    """Return the path to the manifest file for map session `map_id`"""
+    return os.path.join(get_maps_dir(), map_id, 'manifest.json')
+
+
+def _shard_log_path(map_id):
+    """Return the path to the shard update log for map session `map_id`"""
+    return os.path.join(get_maps_dir(), map_id, 'shards.jsonl')
+
+
+def _read_manifest(map_id):
+    """Read the manifest for map session `map_id`
+
+    Updates recorded in the session's shard log are applied to the shards
+    of the manifest, in order, and the session status is 'COMPLETE' once
+    every shard has been downloaded.
+    """
+    with rlock:
+        with open(_manifest_path(map_id)) as f:
+            manifest = json.load(f)
+
+        shards = {sh['job_id']: sh for sh in manifest['shards']}
+        try:
+            with open(_shard_log_path(map_id)) as f:
+                lines = f.readlines()
+        except (IOError, OSError):
+            lines = []
+
+    for line in lines:
+        try:
+            update = json.loads(line)
+        except ValueError:
+            # A crash mid-append can leave a partial last line
+            continue
+
+        shard = shards.get(update.pop('job_id'))
+        if shard is not None:
+            shard.update(update)
+
+    if all(sh['status'] == 'DOWNLOADED' for sh in manifest['shards']):
+        manifest['status'] = 'COMPLETE'
+
+    return manifest
+
+
+def _write_manifest(manifest):
+    """Write a map session manifest, replacing any previous version
+
+    The manifest is written to a temporary file first so that a crash
+    never leaves a truncated manifest behind.
+    """
+    path = _manifest_path(manifest['map_id'])
+    with rlock:
+        map_dir = os.path.dirname(path)
+        if not os.path.isdir(map_dir):
+            os.makedirs(map_dir)
+
+        with open(path + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+        try:
+            os.replace(path + '.tmp', path)
+        except AttributeError:  # pragma: nocover
+            # python 2.7 compatibility
+            os.rename(path + '.tmp', path)
+
+
+def _update_manifest_shard(map_id, job_id, **fields):
+    """Record an update to one shard of a map session
+
+    Updates are appended to the session's shard log rather than rewriting
+    the manifest, so that recording each shard costs the same however
+    many shards the session has. `_read_manifest` applies them.
+
+    Parameters
+    ----------
+    map_id : string
+        The map session ID
+
+    job_id : string
+        The jobID of the shard to update
+
+    fields :
+        Shard fields to set, e.g. `status`, 'DOWNLOADED' or 'FAILED', or
+        `substitutes`, the jobs that replace the shard's children
+    """
+    fields['job_id'] = job_id
+    with rlock:
+        with open(_shard_log_path(map_id), 'a') as f:
+            f.write(json.dumps(fields) + '\n')
+
+
+def _map_shard_result(map_id, job):
+    """Wait for a shard of a map session and record it in the manifest"""
+    try:
+        result = job.result()
+    except aws.BatchJobFailedError:
+        _update_manifest_shard(map_id, job.job_id, status='FAILED')
+        raise
+
+    _update_manifest_shard(map_id, job.job_id, status='DOWNLOADED')
+    return result
+
+
+def _summary_description(summary):
+    """Return a job description built from a list_jobs job summary
+
+    Summaries carry the start and stop times of a job's latest attempt
+    only, so the description has at most one attempt.
+    """
+    job = dict(summary)
+    if summary.get('startedAt'):
+        job['attempts'] = [{k: summary[k] for k in ['startedAt', 'stoppedAt']
+                            if k in summary}]
+    return job
+
+
+def _record_substitutes(map_id, job):
+    """Record the jobs replacing children of a map session's shard"""
+    _update_manifest_shard(map_id, job.job_id, substitutes=job.substitutes)
+
+
 # noinspection PyPropertyAccess,PyAttributeOutsideInit
 class Pars(aws.NamedObject):
     """PARS stands for Persistent AWS Resource Set
@@ -755,7 +889,9 @@ class Knot(aws.NamedObject):
                  instance_types=None, resource_type=None, min_vcpus=None,
                  max_vcpus=None, desired_vcpus=None, image_id=None,
                  ec2_key_pair=None, ce_tags=None, bid_percentage=None,
-                 job_queue_name=None, priority=None):
+                 job_queue_name=None, priority=None, runner=False,
+                 image_shared_deps=False, image_buildkit=False,
+                 image_profile=None):
         """Initialize a Knot instance
 
         Parameters
@@ -810,7 +946,8 @@ class Knot(aws.NamedObject):
 
         username : string
             default username created in Dockerfile and in batch job definition
-            Default: 'cloudknot-user'
+            Default: the username of the Docker image, 'cloudknot-user' or
+            'nonroot' for distroless images
 
         repo_name : str, optional
             Name of the AWS ECR repository to store the created Docker image
@@ -889,6 +1026,31 @@ class Knot(aws.NamedObject):
         priority : int, optional
             Default priority for jobs in this knot's job queue
             Default: 1
+
+        runner : bool, optional
+            If True, run `func` in a generic runner image that is shared by
+            all functions with the same requirements. The function is
+            cloudpickled and uploaded to S3 instead of being built into the
+            image, so changing its code does not require a new Docker build
+            or push. The image uses the current python version.
+            Default: False
+
+        image_shared_deps : bool, optional
+            If True, build the Docker image from a dependency image that is
+            shared by all images with the same requirements, and is built and
+            pushed to ECR once. See DockerImage.
+            Default: False
+
+        image_buildkit : bool, optional
+            If True, build the Docker image with BuildKit, keeping pip's
+            cache between builds. See DockerImage.
+            Default: False
+
+        image_profile : string, optional
+            The kind of Docker image to build, one of 'full', 'slim' or
+            'distroless'. Smaller images are pulled faster by new instances
+            and start faster in each job. See DockerImage.
+            Default: 'full'
         """
         # Validate name input
         if not isinstance(name, six.string_types):
@@ -910,12 +1072,13 @@ class Knot(aws.NamedObject):
 
         if self._knot_name in config.sections():
             if any([
-                pars, pars_policies, docker_image, base_image, func,
+                pars, pars_policies, docker_image, base_image,
                 image_script_path, image_work_dir, username, repo_name,
                 job_definition_name, job_def_vcpus, memory, retries,
                 compute_environment_name, instance_types, resource_type,
                 min_vcpus, max_vcpus, desired_vcpus, image_id, ec2_key_pair,
-                ce_tags, bid_percentage, job_queue_name, priority
+                ce_tags, bid_percentage, job_queue_name, priority, runner,
+                image_shared_deps, image_buildkit, image_profile
             ]):
                 mod_logger.warning(
                     "You specified configuration arguments for a knot that "
@@ -970,6 +1133,23 @@ class Knot(aws.NamedObject):
             mod_logger.info('Knot {name:s} adopted job definition '
                             '{jd:s}'.format(name=self.name, jd=jd_name))
 
+            if func is not None and self.docker_image.runner:
+                # The runner image loads its function from S3, so only
+                # upload the function if it has changed
+                function_hash = self._upload_function(
+                    func, previous_hash=config.get(
+                        self._knot_name, 'function-hash', fallback=None
+                    )
+                )
+                add_resource(self._knot_name, 'function-hash', function_hash)
+            elif func is not None:
+                mod_logger.warning(
+                    'Knot {name:s} embeds its function in its docker image, '
+                    'so `func` is ignored. Create a knot with runner=True to '
+                    'change its function without rebuilding its image.'
+                    ''.format(name=self.name)
+                )
+
             ce_name = config.get(self._knot_name, 'compute-environment')
             self._compute_environment = aws.ComputeEnvironment(name=ce_name)
             mod_logger.info('Knot {name:s} adopted compute environment '
@@ -983,6 +1163,12 @@ class Knot(aws.NamedObject):
 
             self._job_ids = config.get(self._knot_name, 'job_ids').split()
             self._jobs = [aws.BatchJob(job_id=jid) for jid in self.job_ids]
+
+            if config.has_option(self._knot_name, 'map_ids'):
+                self._map_ids = config.get(self._knot_name,
+                                           'map_ids').split()
+            else:
+                self._map_ids = []
         else:
             job_definition_name = job_definition_name if job_definition_name \
                 else name + '-cloudknot-job-definition'
@@ -997,12 +1183,15 @@ class Knot(aws.NamedObject):
                                               'Pars instance.')
 
             if docker_image and any([func, image_script_path, image_work_dir,
-                                     base_image, image_github_installs]):
+                                     base_image, image_github_installs,
+                                     image_shared_deps, image_buildkit,
+                                     image_profile]):
                 raise aws.CloudknotInputError(
                     'you gave redundant, possibly conflicting input: '
                     '`docker_image` and one of [`func`, `base_image`, '
                     '`image_script_path`, `image_work_dir`, '
-                    '`image_github_installs`]'
+                    '`image_github_installs`, `image_shared_deps`, '
+                    '`image_buildkit`, `image_profile`]'
                 )
 
             if docker_image and not isinstance(docker_image,
@@ -1011,6 +1200,12 @@ class Knot(aws.NamedObject):
                     'docker_image must be a cloudknot DockerImage instance.'
                 )
 
+            if runner and (docker_image or image_script_path or not func):
+                raise aws.CloudknotInputError(
+                    'runner mode requires `func` and may not be combined with '
+                    '`docker_image` or `image_script_path`.'
+                )
+
             def set_pars(knot_name, input_pars, pars_policies):
                 # Validate and set the PARS
                 if input_pars:
@@ -1032,7 +1227,9 @@ class Knot(aws.NamedObject):
 
             def set_dockerimage(knot_name, input_docker_image, func,
                                 script_path, work_dir, base_image,
-                                github_installs, username, tags, repo_name):
+                                github_installs, username, tags, repo_name,
+                                runner, shared_deps, buildkit,
+                                image_profile):
                 if input_docker_image:
                     di = input_docker_image
 
@@ -1048,7 +1245,11 @@ class Knot(aws.NamedObject):
                         dir_name=work_dir,
                         base_image=base_image,
                         github_installs=github_installs,
-                        username=username
+                        username=username,
+                        runner=runner,
+                        shared_deps=shared_deps,
+                        buildkit=buildkit,
+                        image_profile=image_profile
                     )
 
                 if not di.images:
@@ -1333,7 +1534,9 @@ class Knot(aws.NamedObject):
                 work_dir=image_work_dir,
                 base_image=base_image,
                 github_installs=image_github_installs, username=username,
-                tags=image_tags, repo_name=repo_name
+                tags=image_tags, repo_name=repo_name, runner=runner,
+                shared_deps=image_shared_deps, buildkit=image_buildkit,
+                image_profile=image_profile
             )
 
             self._pars, pars_cleanup = futures['pars'].result()
@@ -1379,7 +1582,9 @@ class Knot(aws.NamedObject):
                 set_job_def,
                 knot_name=self.name, job_definition_name=job_definition_name,
                 pars=self.pars, docker_image=self.docker_image,
-                job_def_vcpus=job_def_vcpus, memory=memory, username=username,
+                job_def_vcpus=job_def_vcpus, memory=memory,
+                username=(username if username
+                          else self.docker_image.username),
                 retries=retries
             )
 
@@ -1416,8 +1621,11 @@ class Knot(aws.NamedObject):
 
             executor.shutdown()
 
+            function_hash = self._upload_function(func) if runner else None
+
             self._jobs = []
             self._job_ids = []
+            self._map_ids = []
 
             # Save the new Knot resources in config object
             # Use config.set() for python 2.7 compatibility
@@ -1441,6 +1649,10 @@ class Knot(aws.NamedObject):
                            self.compute_environment.name)
                 config.set(self._knot_name, 'job-queue', self.job_queue.name)
                 config.set(self._knot_name, 'job_ids', '')
+                config.set(self._knot_name, 'map_ids', '')
+                if function_hash:
+                    config.set(self._knot_name, 'function-hash',
+                               function_hash)
 
                 # Save config to file
                 with open(get_config_file(), 'w') as f:
@@ -1492,8 +1704,203 @@ class Knot(aws.NamedObject):
         """List of batch job IDs that this knot has launched"""
         return self._job_ids
 
+    @property
+    def map_ids(self):
+        """List of map session IDs that can be passed to `resume_map`"""
+        return self._map_ids
+
+    def _upload_function(self, func, previous_hash=None):
+        """Upload the cloudpickled function run by this knot's runner image
+
+        Parameters
+        ----------
+        func : function
+            The function, stored at
+            cloudknot.jobs/<job definition name>/function.pickle
+
+        previous_hash : string
+            SHA-256 hex digest of the previously uploaded function. If the
+            cloudpickled function has the same digest, it is not uploaded.
+            Default: None
+
+        Returns
+        -------
+        function_hash : string
+            SHA-256 hex digest of the cloudpickled function
+        """
+        body = cloudpickle.dumps(func)
+        function_hash = hashlib.sha256(body).hexdigest()
+        if function_hash == previous_hash:
+            mod_logger.info('Knot {name:s} function {func:s} is unchanged'
+                            ''.format(name=self.name, func=func.__name__))
+            return function_hash
+
+        key = '/'.join(['cloudknot.jobs', self.job_definition.name,
+                        'function.pickle'])
+        sse = aws.get_s3_params().sse
+        put_kwargs = {'ServerSideEncryption': sse} if sse else {}
+
+        aws.clients['s3'].put_object(
+            Bucket=self.job_definition.output_bucket, Key=key,
+            Body=body, **put_kwargs
+        )
+
+        mod_logger.info('Knot {name:s} uploaded function {func:s} to '
+                        '{key:s}'.format(name=self.name, func=func.__name__,
+                                         key=key))
+
+        return function_hash
+
+    def _pull_preflight_image(self, image):
+        """Make `image` available to the local Docker daemon
+
+        If the daemon does not hold the image, pull it, using ECR
+        credentials for images in an ECR repository.
+
+        Parameters
+        ----------
+        image : string
+            The Docker image of this knot's job definition
+        """
+        try:
+            client = dockerimage._docker_client()
+            client.images.get(image)
+            return
+        except docker.errors.ImageNotFound:
+            pass
+        except docker.errors.DockerException as e:
+            raise aws.CloudknotInputError(
+                'The pre-flight check of knot {name:s} needs a local Docker '
+                'daemon: {err!s}'.format(name=self.name, err=e)
+            )
+
+        repository, _, tag = image.rpartition(':')
+        if not repository or '/' in tag:
+            repository, tag = image, 'latest'
+
+        mod_logger.info('Knot {name:s} pulling image {image:s} for the '
+                        'pre-flight check'.format(name=self.name,
+                                                  image=image))
+
+        try:
+            if '.dkr.ecr.' in repository:
+                auth_config = aws.get_ecr_auth_config(
+                    registry_id=repository.split('.')[0]
+                )
+            else:
+                auth_config = None
+
+            client.images.pull(repository, tag=tag, auth_config=auth_config)
+        except (docker.errors.APIError,
+                aws.clients['ecr'].exceptions.ClientError) as e:
+            raise aws.CloudknotInputError(
+                'The image {image:s} of knot {name:s} is not available to the '
+                'local Docker daemon and could not be pulled: {err!s}'.format(
+                    image=image, name=self.name, err=e
+                )
+            )
+
+    def _preflight(self, input_, starmap=False, env_vars=None):
+        """Run one input through this knot's image on the local Docker daemon
+
+        The container runs as the first child of an array job would, but
+        reads its input from and writes its output to a temporary local
+        stand-in for S3, see cloudknot.emulator. If the local Docker daemon
+        does not hold the image, it is pulled first.
+
+        Parameters
+        ----------
+        input_ :
+            A single element of the input data
+
+        starmap : bool
+            If True, `input_` is a tuple of arguments
+            Default: False
+
+        env_vars : sequence of dicts
+            Additional environment variables for the container, as in `map`
+            Default: None
+
+        Returns
+        -------
+        result :
+            The function's output for `input_`
+        """
+        image = self.job_definition.docker_image
+        bucket = self.job_definition.output_bucket
+        jd_name = self.job_definition.name
+        job_id = 'preflight-' + uuid.uuid4().hex
+
+        self._pull_preflight_image(image)
+
+        root_dir = tempfile.mkdtemp(prefix='cloudknot_preflight_')
+        # Containers may not run as the owner of this directory
+        os.chmod(root_dir, 0o777)
+        s3 = emulator.EmulatedS3Client(root_dir=root_dir)
+
+        try:
+            prefix = '/'.join(['cloudknot.jobs', jd_name])
+            s3.put_object(Bucket=bucket, Key=prefix + '/' + job_id
+                          + '/input.pickle',
+                          Body=cloudpickle.dumps([input_]))
+
+            if self.docker_image is not None and self.docker_image.runner:
+                # The runner image loads its function from S3
+                response = aws.clients['s3'].get_object(
+                    Bucket=bucket, Key=prefix + '/function.pickle'
+                )
+                s3.put_object(Bucket=bucket, Key=prefix + '/function.pickle',
+                              Body=response['Body'].read())
+
+            command = ['--arrayjob'] + (['--starmap'] if starmap else []) \
+                + [bucket]
+
+            environment = {d['name']: d['value'] for d in env_vars or []}
+            environment.update({
+                'CLOUDKNOT_JOBS_S3_BUCKET': bucket,
+                'CLOUDKNOT_S3_JOBDEF_KEY': jd_name,
+                'AWS_BATCH_JOB_ID': job_id,
+                'AWS_BATCH_JOB_ATTEMPT': '1',
+                'AWS_BATCH_JOB_ARRAY_INDEX': '0',
+                'CLOUDKNOT_LOCAL_S3_ROOT': root_dir,
+            })
+
+            mod_logger.info('Knot {name:s} running pre-flight check of image '
+                            '{image:s}'.format(name=self.name, image=image))
+
+            start = time.time()
+            try:
+                exit_code, logs = emulator.DockerRunner().run(image, command,
+                                                              environment)
+            except docker.errors.APIError as e:
+                raise aws.CloudknotInputError(
+                    'The pre-flight check of knot {name:s} could not run '
+                    'image {image:s}: {err!s}'.format(name=self.name,
+                                                      image=image, err=e)
+                )
+
+            if exit_code != 0:
+                raise aws.PreflightError(image=image, exit_code=exit_code,
+                                         logs=logs)
+
+            mod_logger.info('Knot {name:s} passed pre-flight check in '
+                            '{t:.1f} s'.format(name=self.name,
+                                               t=time.time() - start))
+
+            key = '/'.join([prefix, job_id, '0', '001', 'output.pickle'])
+            try:
+                response = s3.get_object(Bucket=bucket, Key=key)
+            except s3.exceptions.NoSuchKey:
+                # The function returned None
+                return None
+
+            return cloudpickle.loads(response['Body'].read())
+        finally:
+            shutil.rmtree(root_dir, ignore_errors=True)
+
     def map(self, iterdata, env_vars=None, max_threads=64,
-            starmap=False, job_type='array'):
+            starmap=False, job_type='array', straggler_policy=None,
+            preflight=False, cache_results=False, collect_metrics=False):
         """Submit batch jobs for a range of commands and environment vars
 
         Each item of `iterdata` is assumed to be a single input for the
@@ -1504,6 +1911,10 @@ class Knot(aws.NamedObject):
         map returns a list of futures, which can return their result when
         the jobs are complete.
 
+        Each call to map also starts a map session, whose ID is appended to
+        `map_ids`. The session's manifest is saved locally so that its
+        futures can be rebuilt with `resume_map` if this process dies.
+
         Parameters
         ----------
         iterdata :
@@ -1537,6 +1948,37 @@ class Knot(aws.NamedObject):
             the results.
             Default: 'array'
 
+        straggler_policy : StragglerPolicy, optional
+            Opt-in policy for speculative execution of straggling children
+            of an array job. Once the policy's quantile of children have
+            succeeded, children whose runtime exceeds the policy's multiple
+            of the median runtime are resubmitted as duplicate jobs. The
+            first copy to finish supplies the result and the other is
+            terminated. Only valid if `job_type` is 'array'.
+            Default: None
+
+        preflight : bool
+            If True, first run the first element of `iterdata` through this
+            knot's image on the local Docker daemon, with a local stand-in
+            for S3, and raise PreflightError with the container's output if
+            it fails. This catches broken images, e.g. missing imports,
+            before any jobs are submitted. Requires a local Docker daemon,
+            which pulls the image if it does not hold it.
+            Default: False
+
+        cache_results : bool
+            If True, keep each downloaded result in a local result cache in
+            the map session's directory, so that `resume_map` does not
+            download it again. The cache is not bounded, use `prune_map` to
+            delete it once the results are no longer needed.
+            Default: False
+
+        collect_metrics : bool
+            If True, each container saves its runtime metrics to S3, at the
+            cost of one more S3 request per child job. See
+            `container_stats`.
+            Default: False
+
         Returns
         -------
         map : future or list of futures
@@ -1546,6 +1988,10 @@ class Knot(aws.NamedObject):
         if job_type not in ['array', 'independent']:
             raise ValueError("`job_type` must be 'array' or 'independent'.")
 
+        if straggler_policy is not None and job_type != 'array':
+            raise aws.CloudknotInputError('straggler_policy may only be used '
+                                          'with array jobs.')
+
         if self.clobbered:
             raise aws.ResourceClobberedException(
                 'This Knot has already been clobbered.',
@@ -1568,10 +2014,28 @@ class Knot(aws.NamedObject):
             raise aws.CloudknotInputError('each dict in env_vars must have '
                                           'keys "name" and "value"')
 
+        if collect_metrics:
+            env_vars = list(env_vars or []) + [
+                {'name': 'CLOUDKNOT_METRICS', 'value': '1'}
+            ]
+
+        if preflight:
+            iterdata = list(iterdata)
+            if iterdata:
+                self._preflight(iterdata[0], starmap=starmap,
+                                env_vars=env_vars)
+
+        map_id = '{n:s}-{u:s}'.format(n=self.name, u=uuid.uuid4().hex[:12])
+        if cache_results:
+            result_cache_dir = os.path.join(get_maps_dir(), map_id, 'results')
+        else:
+            result_cache_dir = None
+
         these_jobs = []
+        shards = []
 
         if job_type == 'independent':
-            for input_ in iterdata:
+            for idx, input_ in enumerate(iterdata):
                 job = aws.BatchJob(
                     input_=input_,
                     starmap=starmap,
@@ -1581,10 +2045,13 @@ class Knot(aws.NamedObject):
                     job_queue=self.job_queue,
                     job_definition=self.job_definition,
                     environment_variables=env_vars,
-                    array_job=False
+                    array_job=False,
+                    result_cache_dir=result_cache_dir
                 )
 
                 these_jobs.append(job)
+                shards.append({'job_id': job.job_id, 'start': idx,
+                               'stop': idx + 1, 'status': 'SUBMITTED'})
                 self._jobs.append(job)
                 self._job_ids.append(job.job_id)
         else:
@@ -1595,35 +2062,93 @@ class Knot(aws.NamedObject):
                 job_queue=self.job_queue,
                 job_definition=self.job_definition,
                 environment_variables=env_vars,
-                array_job=True
+                array_job=True,
+                straggler_policy=straggler_policy,
+                result_cache_dir=result_cache_dir,
+                on_substitute=functools.partial(_record_substitutes, map_id)
             )
 
             these_jobs.append(job)
+            shards.append({
+                'job_id': job.job_id, 'start': 0, 'stop': len(job.input),
+                'status': 'SUBMITTED',
+                'straggler_policy': ({
+                    'quantile': straggler_policy.quantile,
+                    'multiplier': straggler_policy.multiplier,
+                    'max_duplicates': straggler_policy.max_duplicates,
+                } if straggler_policy else None),
+            })
             self._jobs.append(job)
             self._job_ids.append(job.job_id)
 
         if not these_jobs:
             return []
 
+        _write_manifest({
+            'map_id': map_id,
+            'knot': self.name,
+            'job_type': job_type,
+            'starmap': starmap,
+            'result_cache_dir': result_cache_dir,
+            'status': 'SUBMITTED',
+            'shards': shards,
+        })
+        self._map_ids.append(map_id)
+
         config = configparser.ConfigParser()
 
         with rlock:
             config.read(get_config_file())
             config.set(self._knot_name, 'job_ids', ' '.join(self.job_ids))
+            config.set(self._knot_name, 'map_ids', ' '.join(self.map_ids))
             # Save config to file
             with open(get_config_file(), 'w') as f:
                 config.write(f)
 
+        mod_logger.info('Knot {name:s} started map session {m:s}'.format(
+            name=self.name, m=map_id
+        ))
+
+        return self._map_futures(map_id, these_jobs, job_type, max_threads)
+
+    def _map_futures(self, map_id, jobs, job_type, max_threads):
+        """Return futures for the shards of a map session
+
+        Parameters
+        ----------
+        map_id : string
+            The map session ID
+
+        jobs : list of BatchJob
+            The shard jobs, in input order
+
+        job_type : string, 'array' or 'independent'
+            The job type of the map session
+
+        max_threads : int
+            Maximum number of threads used to wait for results
+
+        Returns
+        -------
+        future or list of futures
+            If `job_type` is 'array', a future for the list of results.
+            If `job_type` is 'independent', list of futures for each job.
+            Each future has a `timings` attribute holding the JobTimings
+            of its job.
+        """
         # Increase the max_pool_connections in the boto3 clients to prevent
         # https://github.com/boto/botocore/issues/766
         aws.refresh_clients(max_pool=max_threads)
 
         executor = ThreadPoolExecutor(
-            max(min(len(these_jobs), max_threads), 2)
+            max(min(len(jobs), max_threads), 2)
         )
 
-        futures = [executor.submit(lambda j: j.result(), jb)
-                   for jb in these_jobs]
+        futures = [executor.submit(_map_shard_result, map_id, jb)
+                   for jb in jobs]
+
+        for future, jb in zip(futures, jobs):
+            future.timings = jb.timings
 
         # Shutdown the executor but do not wait to return the futures
         executor.shutdown(wait=False)
@@ -1633,6 +2158,225 @@ class Knot(aws.NamedObject):
         else:
             return futures[0]
 
+    def resume_map(self, map_id, max_threads=64):
+        """Rebuild the futures of a map session, e.g. after a client crash
+
+        The session's manifest records the jobIDs of each shard of the
+        input, in order. Each job is re-adopted and, if the session was
+        started with `cache_results=True`, only results that are not
+        already in the session's local result cache are downloaded.
+
+        Parameters
+        ----------
+        map_id : string
+            A map session ID from `map_ids`
+
+        max_threads : int
+            Maximum number of threads used to wait for results
+            Default: 64
+
+        Returns
+        -------
+        future or list of futures
+            The same futures that `map` returned when the session started
+        """
+        if self.clobbered:
+            raise aws.ResourceClobberedException(
+                'This Knot has already been clobbered.',
+                self.name
+            )
+
+        if map_id not in self.map_ids:
+            raise aws.CloudknotInputError(
+                'map_id {m:s} is not a map session of Knot {n:s}'.format(
+                    m=map_id, n=self.name
+                )
+            )
+
+        self.check_profile_and_region()
+
+        manifest = _read_manifest(map_id)
+        shards = sorted(manifest['shards'], key=operator.itemgetter('start'))
+
+        jobs = []
+        for shard in shards:
+            policy = shard.get('straggler_policy')
+            job = aws.BatchJob(
+                job_id=shard['job_id'],
+                straggler_policy=(aws.StragglerPolicy(**policy)
+                                  if policy else None),
+                result_cache_dir=manifest['result_cache_dir'],
+                substitutes=shard.get('substitutes'),
+                on_substitute=functools.partial(_record_substitutes, map_id)
+            )
+
+            # Replace any previously adopted instance of this job
+            self._jobs = [jb for jb in self._jobs
+                          if jb.job_id != job.job_id] + [job]
+            jobs.append(job)
+
+        mod_logger.info('Knot {name:s} resumed map session {m:s}'.format(
+            name=self.name, m=map_id
+        ))
+
+        return self._map_futures(map_id, jobs, manifest['job_type'],
+                                 max_threads)
+
+    def _map_jobs(self, map_id=None):
+        """Return the jobs of map session `map_id`, or all jobs if None"""
+        if map_id is None:
+            return self.jobs
+
+        if map_id not in self.map_ids:
+            raise aws.CloudknotInputError(
+                'map_id {m:s} is not a map session of Knot {n:s}'.format(
+                    m=map_id, n=self.name
+                )
+            )
+
+        job_ids = set(sh['job_id'] for sh in _read_manifest(map_id)['shards'])
+        return [jb for jb in self.jobs if jb.job_id in job_ids]
+
+    def prune_map(self, map_id, force=False):
+        """Delete the local result cache of a finished map session
+
+        The session's manifest is kept, so `resume_map` still works, but
+        it downloads the results from S3 again.
+
+        Parameters
+        ----------
+        map_id : string
+            A map session ID from `map_ids`
+
+        force : bool
+            If True, prune the cache even if some shards of the session
+            have not been downloaded yet.
+            Default: False
+        """
+        if map_id not in self.map_ids:
+            raise aws.CloudknotInputError(
+                'map_id {m:s} is not a map session of Knot {n:s}'.format(
+                    m=map_id, n=self.name
+                )
+            )
+
+        manifest = _read_manifest(map_id)
+        if manifest['status'] != 'COMPLETE' and not force:
+            raise aws.CloudknotInputError(
+                'Map session {m:s} has not finished. Use force=True to prune '
+                'its result cache anyway.'.format(m=map_id)
+            )
+
+        if manifest['result_cache_dir'] is None:
+            return
+
+        shutil.rmtree(manifest['result_cache_dir'], ignore_errors=True)
+
+        mod_logger.info('Pruned the result cache of map session {m:s}'.format(
+            m=map_id
+        ))
+
+    def stats(self, map_id=None):
+        """Return the time spent in each phase of this knot's jobs
+
+        Parameters
+        ----------
+        map_id : string
+            If provided, only include the jobs of this map session from
+            `map_ids`. Otherwise, include all jobs in `jobs`.
+            Default: None
+
+        Returns
+        -------
+        JobTimings
+            The combined timings of the jobs. Timings are only recorded in
+            this process, so jobs that were adopted rather than submitted
+            here have no serialize, submit or upload spans.
+        """
+        return aws.JobTimings.merge(jb.timings
+                                    for jb in self._map_jobs(map_id))
+
+    def container_stats(self, map_id=None, max_threads=8):
+        """Return container-side runtime metrics aggregated over jobs
+
+        Parameters
+        ----------
+        map_id : string
+            If provided, only include the jobs of this map session from
+            `map_ids`. Otherwise, include all jobs in `jobs`.
+            Default: None
+
+        max_threads : int
+            Maximum number of threads used to download the metrics of
+            each job
+            Default: 8
+
+        Returns
+        -------
+        ContainerStats
+            The metrics recorded by the latest attempt of each finished
+            child job of map sessions started with `collect_metrics=True`.
+            See `aws.summarize_container_metrics`.
+        """
+        if self.clobbered:
+            raise aws.ResourceClobberedException(
+                'This Knot has already been clobbered.',
+                self.name
+            )
+
+        self.check_profile_and_region()
+
+        metrics = []
+        for job in self._map_jobs(map_id):
+            metrics += list(job.container_metrics(
+                max_threads=max_threads
+            ).values())
+
+        return aws.summarize_container_metrics(metrics)
+
+    def export_trace(self, path, map_id=None, max_threads=8):
+        """Write a Chrome trace-event timeline of this knot's jobs
+
+        The timeline shows the client-side spans of each job (see
+        `stats`) and the queue wait and attempts of each job and array
+        child. Open it in chrome://tracing or https://ui.perfetto.dev.
+
+        Parameters
+        ----------
+        path : string
+            Path of the JSON file to write
+
+        map_id : string
+            If provided, only include the jobs of this map session from
+            `map_ids`. Otherwise, include all jobs in `jobs`.
+            Default: None
+
+        max_threads : int
+            Maximum number of threads used to describe jobs concurrently
+            Default: 8
+
+        Returns
+        -------
+        path : string
+            The path that was written
+        """
+        if self.clobbered:
+            raise aws.ResourceClobberedException(
+                'This Knot has already been clobbered.',
+                self.name
+            )
+
+        self.check_profile_and_region()
+
+        jobs = self._map_jobs(map_id)
+        descriptions = self._describe_jobs([jb.job_id for jb in jobs],
+                                           include_children=True,
+                                           max_threads=max_threads)
+
+        return analytics.write_chrome_trace(
+            path, descriptions, timings={jb.job_id: jb.timings for jb in jobs}
+        )
+
     def view_jobs(self):
         """Print the job_id, name, and status of all jobs in self.jobs"""
         if self.clobbered:
@@ -1646,9 +2390,8 @@ class Knot(aws.NamedObject):
         order = {'SUBMITTED': 0, 'PENDING': 1, 'RUNNABLE': 2, 'STARTING': 3,
                  'RUNNING': 4, 'FAILED': 5, 'SUCCEEDED': 6}
 
-        response = aws.clients['batch'].describe_jobs(jobs=self.job_ids)
-        sorted_jobs = sorted(response.get('jobs'),
-                             key=lambda j: order[j['status']])
+        jobs = aws.describe_jobs(self.job_ids)
+        sorted_jobs = sorted(jobs, key=lambda j: order[j['status']])
 
         fmt = '{jobId:12s}        {jobName:20s}        {status:9s}'
         header = fmt.format(jobId='Job ID', jobName='Name', status='Status')
@@ -1658,6 +2401,191 @@ class Knot(aws.NamedObject):
         for job in sorted_jobs:
             print(fmt.format(**job))
 
+    def job_status_snapshot(self, include_children=False, max_threads=8,
+                            as_dataframe=False):
+        """Return a columnar snapshot of the status of this knot's jobs
+
+        Parameters
+        ----------
+        include_children : bool
+            If True, include one row for each child of each array job, in
+            addition to the rows for the array jobs themselves. Children are
+            listed with list_jobs calls for the statuses in each parent's
+            status summary, and show only their latest attempt.
+            Default: False
+
+        max_threads : int
+            Maximum number of threads used to describe jobs concurrently
+            Default: 8
+
+        as_dataframe : bool
+            If True, return a pandas DataFrame. Requires pandas.
+            Default: False
+
+        Returns
+        -------
+        table : OrderedDict or pandas.DataFrame
+            Mapping of column name to list of values, with columns
+            ['job_id', 'array_index', 'status', 'attempts', 'started_at',
+            'stopped_at']
+        """
+        if self.clobbered:
+            raise aws.ResourceClobberedException(
+                'This Knot has already been clobbered.',
+                self.name
+            )
+
+        self.check_profile_and_region()
+
+        jobs = self._describe_jobs(self.job_ids,
+                                   include_children=include_children,
+                                   max_threads=max_threads)
+
+        return aws.job_status_table(jobs, as_dataframe=as_dataframe)
+
+    def _describe_jobs(self, job_ids, include_children=False, max_threads=8):
+        """Describe jobs and, optionally, the children of array jobs
+
+        Parameters
+        ----------
+        job_ids : sequence of strings
+            The job IDs to describe
+
+        include_children : bool
+            If True, also return each child of each array job. Children
+            are listed with one paginated list_jobs call for each status
+            that the parent's status summary reports, and are not
+            described individually.
+            Default: False
+
+        max_threads : int
+            Maximum number of threads used to describe jobs concurrently
+            Default: 8
+
+        Returns
+        -------
+        jobs : list
+            AWS job descriptions of the jobs, followed by those of the
+            children. Child descriptions are built from their list_jobs
+            summaries, so each child has at most one attempt, its latest.
+        """
+        jobs = aws.describe_jobs(job_ids, max_threads=max_threads)
+
+        if include_children:
+            # Only list the statuses in which each parent has children
+            requests = []
+            for job in jobs:
+                summary = job.get('arrayProperties', {}).get(
+                    'statusSummary', {}
+                )
+                requests += [(job['jobId'], status)
+                             for status in aws.JOB_STATUSES
+                             if summary.get(status)]
+
+            def list_children(request):
+                job_id, status = request
+                return self.job_queue.get_jobs(status=status,
+                                               array_job_id=job_id)
+
+            if requests:
+                with ThreadPoolExecutor(
+                        max(min(len(requests), max_threads), 1)
+                ) as e:
+                    pages = list(e.map(list_children, requests))
+
+                parent_order = {jid: n for n, jid in enumerate(job_ids)}
+                children = sorted(
+                    (s for page in pages for s in page),
+                    key=lambda s: (
+                        parent_order.get(s['jobId'].rsplit(':', 1)[0], 0),
+                        s['arrayProperties']['index']
+                    )
+                )
+                jobs += [_summary_description(s) for s in children]
+
+        return jobs
+
+    def map_analytics(self, map_id=None, capacity=None, max_threads=8):
+        """Return queue wait, runtime, retry and utilization statistics
+
+        Parameters
+        ----------
+        map_id : string
+            If provided, only include the jobs of this map session from
+            `map_ids`. Otherwise, include all jobs in `jobs`.
+            Default: None
+
+        capacity : int
+            The number of jobs that the compute environment can run at
+            once. If None, it is inferred from the compute environment's
+            max_vcpus and the job definition's vcpus.
+            Default: None
+
+        max_threads : int
+            Maximum number of threads used to describe jobs concurrently
+            Default: 8
+
+        Returns
+        -------
+        analytics.MapAnalytics
+            See `analytics.map_analytics`. Use `analytics.format_report`
+            for a text report with histograms.
+        """
+        if self.clobbered:
+            raise aws.ResourceClobberedException(
+                'This Knot has already been clobbered.',
+                self.name
+            )
+
+        self.check_profile_and_region()
+
+        if capacity is None:
+            max_vcpus = getattr(self.compute_environment, 'max_vcpus', None)
+            vcpus = getattr(self.job_definition, 'vcpus', None)
+            if max_vcpus and vcpus:
+                capacity = max_vcpus // vcpus
+
+        job_ids = [jb.job_id for jb in self._map_jobs(map_id)]
+        jobs = self._describe_jobs(job_ids, include_children=True,
+                                   max_threads=max_threads)
+
+        return analytics.map_analytics(jobs, capacity=capacity)
+
+    def job_status_summary(self):
+        """Return aggregate job status counts for this knot's jobs
+
+        Array jobs are summarized using their `arrayProperties.statusSummary`
+        so that the status of every array child is counted without
+        describing each child individually.
+
+        Returns
+        -------
+        summary : OrderedDict
+            Mapping of job status to the number of jobs (independent jobs
+            and array children) in that status
+        """
+        if self.clobbered:
+            raise aws.ResourceClobberedException(
+                'This Knot has already been clobbered.',
+                self.name
+            )
+
+        self.check_profile_and_region()
+
+        summary = OrderedDict((s, 0) for s in aws.JOB_STATUSES)
+
+        for job in aws.describe_jobs(self.job_ids):
+            status_summary = job.get('arrayProperties', {}).get(
+                'statusSummary'
+            )
+            if status_summary:
+                for status, count in status_summary.items():
+                    summary[status] = summary.get(status, 0) + count
+            else:
+                summary[job['status']] += 1
+
+        return summary
+
     def clobber(self, clobber_pars=False, clobber_repo=False,
                 clobber_image=False):
         """Delete associated AWS resources and remove section from config
@@ -1706,7 +2634,12 @@ class Knot(aws.NamedObject):
                     # the default cloudknot ECR repo.
                     uri = self.docker_image.repo_uri
                     repo_name = uri.split('amazonaws.com/')[-1].split(':')[0]
-                    if repo_name == aws.get_ecr_repo():
+                    if self.docker_image.references > 1:
+                        mod_logger.info(
+                            'Kept image {uri:s}, which other knots still '
+                            'run'.format(uri=uri)
+                        )
+                    elif repo_name == aws.get_ecr_repo():
                         # This is in the default ECR repo. So just delete the
                         # image from the remote repo, leaving other images
                         # untouched.
@@ -1727,6 +2660,11 @@ class Knot(aws.NamedObject):
             if clobber_pars:
                 e.submit(self.pars.clobber)
 
+        # Remove this knot's map sessions and cached results
+        for map_id in self.map_ids:
+            shutil.rmtree(os.path.join(get_maps_dir(), map_id),
+                          ignore_errors=True)
+
         # Remove this section from the config file
         config = configparser.ConfigParser()
 
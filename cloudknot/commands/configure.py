@@ -2,20 +2,29 @@ from __future__ import absolute_import, division, print_function
 
 import docker
 import logging
-import os
 import six
 import subprocess
 from awscli.customizations.configure.configure import InteractivePrompter
 
 from .base import Base
 from ..aws import DockerRepo, get_profile, get_region, get_ecr_repo, \
-    set_profile, set_region, set_ecr_repo
+    set_profile, set_region, set_ecr_repo, get_ecr_auth_config
 from ..config import add_resource
 
 module_logger = logging.getLogger(__name__)
 
 
-def pull_and_push_base_images(region, profile, ecr_repo):
+def pull_and_push_base_images(ecr_repo):
+    """Pull the python base image and push it to an ECR repository
+
+    The repository and its credentials are looked up with the current
+    profile and region, so set those first.
+
+    Parameters
+    ----------
+    ecr_repo : string
+        Name of the AWS ECR repository to push to
+    """
     # Use docker low-level APIClient for tagging
     c = docker.from_env().api
     # And the image client for pulling and pushing
@@ -28,26 +37,6 @@ def pull_and_push_base_images(region, profile, ecr_repo):
     module_logger.info('Pulling base image {b:s}'.format(b=py_base))
     cli.pull(py_base)
 
-    if profile != 'from-env':
-        cmd = [
-            'aws', 'ecr', 'get-login', '--no-include-email',
-            '--region', region,
-            '--profile', profile,
-        ]
-    else:
-        cmd = [
-            'aws', 'ecr', 'get-login', '--no-include-email',
-            '--region', region,
-        ]
-
-    # Refresh the aws ecr login credentials
-    login_cmd = subprocess.check_output(cmd)
-
-    # Login
-    login_cmd = login_cmd.decode('ASCII').rstrip('\n').split(' ')
-    fnull = open(os.devnull, 'w')
-    subprocess.call(login_cmd, stdout=fnull, stderr=subprocess.STDOUT)
-
     repo = DockerRepo(name=ecr_repo)
 
     # Log tagging info
@@ -62,7 +51,11 @@ def pull_and_push_base_images(region, profile, ecr_repo):
         ''.format(name=py_base, repo=repo.repo_uri)
     )
 
-    for l in cli.push(repository=repo.repo_uri, tag=ecr_tag, stream=True):
+    # Credentials for the registry, from the current profile and region
+    auth_config = get_ecr_auth_config(registry_id=repo.repo_registry_id)
+
+    for l in cli.push(repository=repo.repo_uri, tag=ecr_tag, stream=True,
+                      auth_config=auth_config):
         module_logger.debug(l)
 
 
@@ -113,8 +106,6 @@ class Configure(Base):
               'local machine and push the same docker image to your cloudknot '
               'repository on AWS ECR.')
 
-        pull_and_push_base_images(region=values['region'],
-                                  profile=values['profile'],
-                                  ecr_repo=values['ecr_repo'])
+        pull_and_push_base_images(ecr_repo=values['ecr_repo'])
 
         print('All done.\n')
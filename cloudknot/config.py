@@ -16,8 +16,8 @@ import logging
 import os
 from threading import RLock
 
-__all__ = ["get_config_file", "add_resource", "remove_resource",
-           "verify_sections"]
+__all__ = ["get_config_file", "get_maps_dir", "add_resource",
+           "remove_resource", "verify_sections"]
 
 mod_logger = logging.getLogger(__name__)
 rlock = RLock()
@@ -75,6 +75,31 @@ def get_config_file():
     return config_file
 
 
+def get_maps_dir():
+    """Get the path to the directory holding persisted map sessions
+
+    The directory sits next to the cloudknot config file, e.g.
+    ~/.aws/cloudknot.maps. If it doesn't exist, create it.
+
+    Returns
+    -------
+    maps_dir : string
+        Path to the map session directory
+    """
+    maps_dir = get_config_file() + '.maps'
+
+    with rlock:
+        try:
+            os.makedirs(maps_dir)
+        except OSError as e:
+            pre_existing = (e.errno == errno.EEXIST
+                            and os.path.isdir(maps_dir))
+            if not pre_existing:
+                raise e
+
+    return maps_dir
+
+
 def add_resource(section, option, value):
     """Add a resource to the cloudknot config file
 
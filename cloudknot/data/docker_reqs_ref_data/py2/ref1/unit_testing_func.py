@@ -1,9 +1,84 @@
-import boto3
-import cloudpickle
-import os
-import pickle
-from argparse import ArgumentParser
-from functools import wraps
+import time
+
+# Recorded before the remaining imports so that import time can be measured
+SCRIPT_START_TIME = time.time()
+
+import boto3  # noqa: E402
+import cloudpickle  # noqa: E402
+import json  # noqa: E402
+import os  # noqa: E402
+import pickle  # noqa: E402
+import sys  # noqa: E402
+from argparse import ArgumentParser  # noqa: E402
+from contextlib import contextmanager  # noqa: E402
+from functools import wraps  # noqa: E402
+
+
+def read_proc(path):
+    """Return the contents of a /proc file, or None if it is unavailable"""
+    try:
+        with open(path) as f:
+            return f.read()
+    except (IOError, OSError):
+        return None
+
+
+def process_age():
+    """Return the seconds since this process started, or None"""
+    stat = read_proc('/proc/self/stat')
+    uptime = read_proc('/proc/uptime')
+    if stat is None or uptime is None:
+        return None
+
+    # The process start time is field 22, counted in clock ticks after boot
+    start_ticks = int(stat.rsplit(')', 1)[1].split()[19])
+    return float(uptime.split()[0]) - start_ticks / float(
+        os.sysconf('SC_CLK_TCK')
+    )
+
+
+def process_usage():
+    """Return the peak RSS in kB and CPU seconds of this process from /proc"""
+    peak_rss_kb = None
+    status = read_proc('/proc/self/status')
+    if status is not None:
+        for line in status.splitlines():
+            if line.startswith('VmHWM:'):
+                peak_rss_kb = int(line.split()[1])
+
+    cpu_s = None
+    stat = read_proc('/proc/self/stat')
+    if stat is not None:
+        # utime and stime are fields 14 and 15, counted in clock ticks
+        fields = stat.rsplit(')', 1)[1].split()
+        cpu_s = (int(fields[11]) + int(fields[12])) / float(
+            os.sysconf('SC_CLK_TCK')
+        )
+
+    return peak_rss_kb, cpu_s
+
+
+# Container-side runtime metrics, written next to output.pickle if the
+# CLOUDKNOT_METRICS environment variable is 1
+startup_s = process_age()
+metrics = {
+    'python': sys.version.split()[0],
+    'startup_s': (startup_s - (time.time() - SCRIPT_START_TIME)
+                  if startup_s is not None else None),
+    'import_s': time.time() - SCRIPT_START_TIME,
+    'phases': {},
+}
+
+
+@contextmanager
+def timed(phase):
+    """Add the duration of the block to the metrics of `phase`"""
+    start = time.time()
+    try:
+        yield
+    finally:
+        metrics['phases'][phase] = (metrics['phases'].get(phase, 0.0)
+                                    + time.time() - start)
 
 
 def pickle_to_s3(server_side_encryption=None, array_job=True):
@@ -23,25 +98,36 @@ def pickle_to_s3(server_side_encryption=None, array_job=True):
             if array_job:
                 jobid = jobid.split(':')[0]
 
-            key = '/'.join([
+            prefix = '/'.join([
                 'cloudknot.jobs',
                 os.environ.get("CLOUDKNOT_S3_JOBDEF_KEY"),
                 jobid,
                 array_index,
-                '{0:03d}'.format(int(os.environ.get("AWS_BATCH_JOB_ATTEMPT"))),
-                'output.pickle'
+                '{0:03d}'.format(int(os.environ.get("AWS_BATCH_JOB_ATTEMPT")))
             ])
 
-            result = f(*args, **kwargs)
+            if server_side_encryption is None:
+                put_kwargs = {}
+            else:
+                put_kwargs = {'ServerSideEncryption': server_side_encryption}
+
+            with timed('compute'):
+                result = f(*args, **kwargs)
 
             # Only pickle output and write to S3 if it is not None
             if result is not None:
-                pickled_result = cloudpickle.dumps(result)
-                if server_side_encryption is None:
-                    s3.put_object(Bucket=bucket, Body=pickled_result, Key=key)
-                else:
-                    s3.put_object(Bucket=bucket, Body=pickled_result, Key=key,
-                                  ServerSideEncryption=server_side_encryption)
+                with timed('pickle'):
+                    pickled_result = cloudpickle.dumps(result)
+                with timed('upload'):
+                    s3.put_object(Bucket=bucket, Body=pickled_result,
+                                  Key=prefix + '/output.pickle', **put_kwargs)
+
+            # Metrics cost one more S3 request, so they are opt-in
+            if os.environ.get("CLOUDKNOT_METRICS") == "1":
+                metrics['peak_rss_kb'], metrics['cpu_s'] = process_usage()
+                s3.put_object(Bucket=bucket, Key=prefix + '/metrics.json',
+                              Body=json.dumps(metrics).encode(),
+                              **put_kwargs)
 
         return wrapper
     return real_decorator
@@ -104,9 +190,16 @@ if __name__ == "__main__":
              'in S3.'
     )
 
+    parser.add_argument(
+        '--input-jobid', dest='input_jobid', action='store', default=None,
+        help='If provided, read input from the input of this previously '
+             'submitted job, selecting elements using the input indices '
+             'stored for the current job.'
+    )
+
     args = parser.parse_args()
 
-    s3 = boto3.client('s3')
+    s3 = boto3.client("s3")
     bucket = args.bucket
 
     jobid = os.environ.get("AWS_BATCH_JOB_ID")
@@ -114,18 +207,45 @@ if __name__ == "__main__":
     if args.arrayjob:
         jobid = jobid.split(':')[0]
 
+    if args.input_jobid:
+        key = '/'.join([
+            'cloudknot.jobs',
+            os.environ.get("CLOUDKNOT_S3_JOBDEF_KEY"),
+            jobid,
+            'input-indices.pickle'
+        ])
+
+        with timed('download'):
+            response = s3.get_object(Bucket=bucket, Key=key)
+            body = response.get('Body').read()
+        with timed('unpickle'):
+            input_indices = pickle.loads(body)
+        input_jobid = args.input_jobid
+    else:
+        input_indices = None
+        input_jobid = jobid
+
     key = '/'.join([
         'cloudknot.jobs',
         os.environ.get("CLOUDKNOT_S3_JOBDEF_KEY"),
-        jobid,
+        input_jobid,
         'input.pickle'
     ])
 
-    response = s3.get_object(Bucket=bucket, Key=key)
-    input_ = pickle.loads(response.get('Body').read())
+    with timed('download'):
+        response = s3.get_object(Bucket=bucket, Key=key)
+        body = response.get('Body').read()
+    with timed('unpickle'):
+        input_ = pickle.loads(body)
 
     if args.arrayjob:
         array_index = int(os.environ.get("AWS_BATCH_JOB_ARRAY_INDEX"))
+    else:
+        array_index = 0
+
+    if input_indices is not None:
+        input_ = input_[input_indices[array_index]]
+    elif args.arrayjob:
         input_ = input_[array_index]
 
     if args.starmap:
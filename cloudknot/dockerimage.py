@@ -2,27 +2,112 @@ from __future__ import absolute_import, division, print_function
 
 import configparser
 import docker
+import hashlib
 import inspect
+import json
 import logging
 import os
 import re
+import shutil
 import six
 import subprocess
+import sys
 import tempfile
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from pipreqs import pipreqs
 from string import Template
 
 from . import aws
 from . import config as ckconfig
-from .aws.base_classes import get_region, get_profile, \
-    ResourceDoesNotExistException, ResourceClobberedException, \
-    CloudknotInputError, CloudknotConfigurationError
+from . import requirements
+from .aws.base_classes import ResourceDoesNotExistException, \
+    ResourceClobberedException, CloudknotInputError, PreflightError
 from .config import get_config_file, rlock
 
-__all__ = ["DockerImage"]
+__all__ = ["DockerImage", "PushStats"]
 
 mod_logger = logging.getLogger(__name__)
 
+#: Image profiles, from the largest to the smallest image. See DockerImage
+IMAGE_PROFILES = ('full', 'slim', 'distroless')
+
+#: Base image of the distroless profile and the image in which its python
+#: dependencies are installed. Both must have the same python version.
+DISTROLESS_BASE_IMAGE = 'gcr.io/distroless/python3-debian12'
+DISTROLESS_BUILDER_IMAGE = 'python:3.11-bookworm'
+
+#: Statistics of one push of an image tag, see DockerImage.push_stats
+PushStats = namedtuple(
+    'PushStats',
+    ['repository', 'tag', 'bytes', 'seconds', 'bytes_per_s',
+     'layers_pushed', 'layers_skipped']
+)
+
+_client_lock = threading.Lock()
+_clients = {}
+
+
+def _docker_client():
+    """Return the docker client shared by all DockerImages in this process
+
+    Creating a client queries the Docker daemon, so one client, with its
+    connection pool, is reused by all builds and pushes. Forked processes
+    create their own.
+    """
+    with _client_lock:
+        pid = os.getpid()
+        if pid not in _clients:
+            _clients.clear()
+            _clients[pid] = docker.from_env()
+        return _clients[pid]
+
+
+def _parse_push_stream(stream):
+    """Consume the decoded progress stream of a docker push
+
+    Parameters
+    ----------
+    stream : iterable of dicts
+        The decoded JSON progress messages of the Docker daemon
+
+    Returns
+    -------
+    n_bytes : int
+        Total size of the uploaded layers
+
+    layers_pushed : int
+        Number of uploaded layers
+
+    layers_skipped : int
+        Number of layers that the registry already held
+    """
+    uploaded = {}
+    pushed = set()
+    skipped = set()
+    for message in stream:
+        mod_logger.debug(message)
+
+        if 'error' in message:
+            raise docker.errors.APIError(message['error'])
+
+        layer = message.get('id')
+        status = message.get('status', '')
+        if layer is None:
+            continue
+
+        detail = message.get('progressDetail') or {}
+        if status == 'Pushing' and 'current' in detail:
+            uploaded[layer] = max(uploaded.get(layer, 0), detail['current'])
+        elif status == 'Pushed':
+            pushed.add(layer)
+        elif status == 'Layer already exists':
+            skipped.add(layer)
+
+    return sum(uploaded.values()), len(pushed), len(skipped)
+
 
 # noinspection PyPropertyAccess,PyAttributeOutsideInit
 class DockerImage(aws.NamedObject):
@@ -43,7 +128,9 @@ class DockerImage(aws.NamedObject):
     """
     def __init__(self, name=None, func=None, script_path=None,
                  dir_name=None, base_image=None,
-                 github_installs=(), username=None):
+                 github_installs=(), username=None, runner=False,
+                 shared_deps=False, buildkit=False,
+                 image_profile=None):
         """Initialize a DockerImage instance
 
         Parameters
@@ -77,12 +164,55 @@ class DockerImage(aws.NamedObject):
             Default: ()
 
         username : string
-            Default user created in the Dockerfile
-            Default: 'cloudknot-user'
+            Default user created in the Dockerfile. Distroless images run as
+            their base image's 'nonroot' user, and accept no other username.
+            Default: 'cloudknot-user', or 'nonroot' for distroless images
+
+        runner : bool
+            If True, build a generic runner image instead of embedding `func`
+            in the container script. The runner image depends only on the
+            requirements of `func` and is named after their hash, so that
+            functions with the same requirements share one image. The
+            function itself is cloudpickled and stored in S3 by the Knot
+            that uses the image. Requires `func`.
+            Default: False
+
+        shared_deps : bool
+            If True, install the requirements in a separate dependency image,
+            named after the hash of the requirements, github installs, base
+            image and username, and build this image `FROM` it. The
+            dependency image is built once per dependency set, pushed to ECR
+            with the tag 'deps-<hash>' and pulled from ECR by later builds on
+            other machines.
+            Default: False
+
+        buildkit : bool
+            If True, build with BuildKit through the docker command line
+            client. The generated Dockerfiles then keep pip's download and
+            wheel cache in a cache mount that persists across builds,
+            instead of passing --no-cache-dir.
+            Default: False
+
+        image_profile : string
+            The kind of image to build, one of
+            - 'full' : the official python image with a default user
+            - 'slim' : the slim variant of the official python image. Apt
+              and pip caches are kept out of the image, and the standard
+              library and dependencies are precompiled to bytecode, so that
+              containers do not recompile them on every start.
+            - 'distroless' : dependencies are installed and precompiled in
+              DISTROLESS_BUILDER_IMAGE and copied into DISTROLESS_BASE_IMAGE,
+              which has no shell or package manager. The script runs as the
+              image's `nonroot` user in /home/nonroot.
+            Use the report method to compare the size and startup time of
+            the resulting images. The 'slim' and 'distroless' profiles
+            cannot be combined with `shared_deps`.
+            Default: 'full'
         """
         # Check for redundant input
         if name and any([func, script_path, dir_name, username,
-                         base_image, github_installs]):
+                         base_image, github_installs, runner, shared_deps,
+                         buildkit, image_profile]):
             raise CloudknotInputError(
                 "You specified a name plus other stuff. The name parameter is "
                 "only used to retrieve a pre-existing DockerImage instance. "
@@ -95,6 +225,27 @@ class DockerImage(aws.NamedObject):
             raise CloudknotInputError('You must suppy either `name`, `func` '
                                       'or `script_path`.')
 
+        if runner and (script_path or not func):
+            raise CloudknotInputError('A runner image requires `func` and '
+                                      'cannot be built from `script_path`.')
+
+        if image_profile is not None and image_profile not in IMAGE_PROFILES:
+            raise CloudknotInputError('image_profile must be one of '
+                                      '{p!s}.'.format(p=IMAGE_PROFILES))
+
+        if image_profile == 'distroless' \
+                and username not in (None, 'nonroot'):
+            raise CloudknotInputError(
+                "Distroless images run as the 'nonroot' user of their base "
+                "image and cannot use the username {u!s}.".format(u=username)
+            )
+
+        if image_profile not in (None, 'full') and shared_deps:
+            raise CloudknotInputError(
+                'The {p:s} image profile cannot be combined with '
+                '`shared_deps`.'.format(p=image_profile)
+            )
+
         # If both `func` and `script_path` are specified,
         # input is over-specified
         if script_path and func:
@@ -127,36 +278,69 @@ class DockerImage(aws.NamedObject):
                 )
 
             self._func = None
-            self._build_path = config.get(section_name, 'build-path')
-            self._script_path = config.get(section_name, 'script-path')
-            self._docker_path = config.get(section_name, 'docker-path')
-            self._req_path = config.get(section_name, 'req-path')
-            self._base_image = config.get(section_name, 'base-image')
-            self._github_installs = config.get(section_name,
-                                               'github-imports').split()
-            self._username = config.get(section_name, 'username')
-            self._clobber_script = config.getboolean(section_name,
-                                                     'clobber-script')
-
-            images_str = config.get(section_name, 'images')
-            images_list = [s.split(':') for s in images_str.split()]
-            self._images = [{'name': i[0], 'tag': i[1]}
-                            for i in images_list]
-
-            uri = config.get(section_name, 'repo-uri')
-            self._repo_uri = uri if uri else None
+            self._read_config(config, section_name)
 
             # Set self.pip_imports and self.missing_imports
-            self._set_imports()
+            self._read_imports()
         else:
             self._func = func
-            self._username = username if username else 'cloudknot-user'
+            self._runner = runner
+            self._shared_deps = shared_deps
+            self._buildkit = buildkit
+            self._image_profile = image_profile if image_profile else 'full'
+            if self.image_profile == 'distroless':
+                self._username = 'nonroot'
+            else:
+                self._username = username if username else 'cloudknot-user'
 
+            suffix = '-slim' if self.image_profile == 'slim' else ''
             if base_image is not None:
                 self._base_image = base_image
+            elif self.image_profile == 'distroless':
+                self._base_image = DISTROLESS_BASE_IMAGE
+            elif runner:
+                # cloudpickled functions only load in the same python version
+                self._base_image = 'python:{0:d}.{1:d}'.format(
+                    *sys.version_info[:2]
+                ) + suffix
             else:
                 py_ver = '3' if six.PY3 else '2'
-                self._base_image = 'python:' + py_ver
+                self._base_image = 'python:' + py_ver + suffix
+
+            if runner and self.image_profile == 'distroless' \
+                    and not DISTROLESS_BUILDER_IMAGE.startswith(
+                        'python:{0:d}.{1:d}-'.format(*sys.version_info[:2])
+                    ):
+                mod_logger.warning(
+                    'The distroless image runs {b:s}, but functions are '
+                    'pickled by this python version, {v:s}. Loading the '
+                    'function may fail.'.format(
+                        b=DISTROLESS_BUILDER_IMAGE,
+                        v=sys.version.split()[0]
+                    )
+                )
+
+            # Validate github installs
+            if isinstance(github_installs, six.string_types):
+                self._github_installs = [github_installs]
+            elif all(isinstance(x, six.string_types) for x in github_installs):
+                self._github_installs = list(github_installs)
+            else:
+                raise CloudknotInputError('github_installs must be a string '
+                                          'or a sequence of strings.')
+
+            pattern = r'(https|git)(://github.com/).*/.*\.git($|@.*$)'
+            for install in self._github_installs:
+                match_obj = re.match(pattern, install)
+                if match_obj is None:
+                    raise CloudknotInputError(
+                        'One of your github_installs, {i:s} is not formatted '
+                        'correctly. It should look something like '
+                        'git://github.com/user/repo.git, '
+                        'git://github.com/user/repo.git@branch, '
+                        'https://github.com/user/repo.git, or '
+                        'https://github.com/user/repo.git@branch, '
+                    )
 
             # Validate dir_name input
             if dir_name and not os.path.isdir(dir_name):
@@ -189,7 +373,20 @@ class DockerImage(aws.NamedObject):
                 # We will create the script, Dockerfile, and requirements.txt
                 # in a new directory
                 self._clobber_script = True
-                super(DockerImage, self).__init__(name=func.__name__)
+
+                if runner:
+                    # The runner image is named after the function's
+                    # requirements, so resolve them first
+                    self._set_imports(source=self._render_script())
+                    name = 'runner-' + self._requirements_hash()[:16]
+                else:
+                    name = func.__name__
+
+                super(DockerImage, self).__init__(name=name)
+
+                # Functions with the same requirements share one runner image
+                if runner and self._adopt_shared_runner():
+                    return
 
                 if dir_name:
                     self._build_path = os.path.abspath(dir_name)
@@ -244,38 +441,21 @@ class DockerImage(aws.NamedObject):
                     'if it is no longer needed.'.format(file=self.req_path)
                 )
 
-            # Validate github installs before building Dockerfile
-            if isinstance(github_installs, six.string_types):
-                self._github_installs = [github_installs]
-            elif all(isinstance(x, six.string_types) for x in github_installs):
-                self._github_installs = list(github_installs)
-            else:
-                raise CloudknotInputError('github_installs must be a string '
-                                          'or a sequence of strings.')
-
-            pattern = r'(https|git)(://github.com/).*/.*\.git($|@.*$)'
-            for install in self._github_installs:
-                match_obj = re.match(pattern, install)
-                if match_obj is None:
-                    raise CloudknotInputError(
-                        'One of your github_installs, {i:s} is not formatted '
-                        'correctly. It should look something like '
-                        'git://github.com/user/repo.git, '
-                        'git://github.com/user/repo.git@branch, '
-                        'https://github.com/user/repo.git, or '
-                        'https://github.com/user/repo.git@branch, '
-                    )
-
             # Set self.pip_imports and self.missing_imports
-            self._set_imports()
+            if not runner:
+                self._set_imports()
 
             # Write the requirements.txt file and Dockerfile
             pipreqs.generate_requirements_file(self.req_path, self.pip_imports)
 
             self._write_dockerfile()
+            self._write_dockerignore()
 
             self._images = []
             self._repo_uri = None
+            self._context_hash = None
+            self._image_id = None
+            self._push_stats = []
 
             # Add to config file
             section_name = 'docker-image ' + self.name
@@ -296,6 +476,25 @@ class DockerImage(aws.NamedObject):
             ckconfig.add_resource(
                 section_name, 'clobber-script', str(self._clobber_script)
             )
+            ckconfig.add_resource(section_name, 'runner', str(self.runner))
+            ckconfig.add_resource(section_name, 'shared-deps',
+                                  str(self.shared_deps))
+            ckconfig.add_resource(section_name, 'buildkit', str(self.buildkit))
+            ckconfig.add_resource(section_name, 'image-profile',
+                                  self.image_profile)
+            ckconfig.add_resource(section_name, 'clobber-dockerignore',
+                                  str(self._clobber_dockerignore))
+            ckconfig.add_resource(section_name, 'references', '1')
+
+            # Keep the record of a previous build of a DockerImage with this
+            # name, so that build() can reuse it if the context is unchanged
+            config = configparser.ConfigParser()
+            with rlock:
+                config.read(get_config_file())
+            self._context_hash = config.get(section_name, 'context-hash',
+                                            fallback='') or None
+            self._image_id = config.get(section_name, 'image-id',
+                                        fallback='') or None
 
     # Declare read-only properties
     @property
@@ -362,24 +561,166 @@ class DockerImage(aws.NamedObject):
         """Location of remote repository to which the image was pushed"""
         return self._repo_uri
 
-    def _write_script(self):
-        """Write this instance's function to a script with a CLI.
+    @property
+    def runner(self):
+        """True if this is a generic runner image that loads its function
+        from S3
+        """
+        return self._runner
+
+    @property
+    def shared_deps(self):
+        """True if this image is built from a shared dependency image"""
+        return self._shared_deps
+
+    @property
+    def buildkit(self):
+        """True if this image is built with BuildKit"""
+        return self._buildkit
+
+    @property
+    def image_profile(self):
+        """Image profile, one of IMAGE_PROFILES"""
+        return self._image_profile
+
+    @property
+    def dockerignore_path(self):
+        """Path to the .dockerignore file in the build path"""
+        return os.path.join(self.build_path, '.dockerignore')
+
+    @property
+    def deps_docker_path(self):
+        """Path to the generated Dockerfile of the dependency image"""
+        return os.path.join(self.build_path, 'Dockerfile.deps')
+
+    @property
+    def deps_tag(self):
+        """Tag of the shared dependency image, or None if not shared"""
+        if not self.shared_deps:
+            return None
+        return 'deps-' + self._requirements_hash()[:16]
+
+    @property
+    def deps_image(self):
+        """Local name of the shared dependency image, or None if not shared
+        """
+        if not self.shared_deps:
+            return None
+        return 'cloudknot/deps:' + self.deps_tag
+
+    @property
+    def push_stats(self):
+        """List of PushStats, one for each tag uploaded by push"""
+        return self._push_stats
+
+    @property
+    def context_hash(self):
+        """SHA-256 hash of the build context of the most recent build"""
+        return self._context_hash
+
+    @property
+    def image_id(self):
+        """Docker ID of the most recently built image"""
+        return self._image_id
+
+    @property
+    def references(self):
+        """Number of unclobbered DockerImages that share this image
+
+        Runner images are shared by all functions with the same
+        requirements. clobber only removes the image once it has no other
+        references.
+        """
+        config = configparser.ConfigParser()
+        with rlock:
+            config.read(get_config_file())
+        return config.getint('docker-image ' + self.name, 'references',
+                             fallback=1)
+
+    def _hash_context(self):
+        """Return the SHA-256 hex digest of this instance's build context
+
+        The Dockerfile copies only the requirements file and the script into
+        the image, so the hash covers those two files and the Dockerfile.
+        """
+        sha = hashlib.sha256()
+        for path in [self.docker_path, self.req_path, self.script_path]:
+            sha.update(os.path.basename(path).encode('utf-8') + b'\0')
+            with open(path, 'rb') as f:
+                sha.update(f.read())
+            sha.update(b'\0')
+
+        return sha.hexdigest()
+
+    def _reusable_image(self, client, context_hash):
+        """Return the local image previously built from this context or None
+        """
+        if self.image_id is None or context_hash != self.context_hash:
+            return None
+
+        try:
+            return client.images.get(self.image_id)
+        except docker.errors.ImageNotFound:
+            mod_logger.info('Image {id:s} built from the same context no '
+                            'longer exists'.format(id=self.image_id))
+            return None
+
+    def _render_script(self):
+        """Return this instance's function as a script with a CLI
 
         Use the template file to insert the self.func source code and name
         """
-        with open(self.script_path, 'w') as f:
-            template_path = os.path.abspath(os.path.join(
-                os.path.dirname(__file__),
-                'templates',
-                'script.template'
-            ))
+        template_path = os.path.abspath(os.path.join(
+            os.path.dirname(__file__),
+            'templates',
+            'script.template'
+        ))
 
-            with open(template_path, 'r') as template:
-                s = Template(template.read())
-                f.write(s.substitute(
-                    func_source=inspect.getsource(self.func),
-                    func_name=self.func.__name__
-                ))
+        with open(template_path, 'r') as template:
+            s = Template(template.read())
+            return s.substitute(
+                func_source=inspect.getsource(self.func),
+                func_name=self.func.__name__
+            )
+
+    def _render_runner_script(self):
+        """Return the generic runner script with a CLI
+
+        The runner script loads its function from S3 instead of embedding
+        the function's source code. The function is loaded only once the
+        command line has been parsed, so that `--help` works without S3.
+        """
+        templates_dir = os.path.abspath(os.path.join(
+            os.path.dirname(__file__), 'templates'
+        ))
+
+        with open(os.path.join(templates_dir, 'runner.template'), 'r') as f:
+            runner_source = f.read()
+
+        with open(os.path.join(templates_dir, 'script.template'), 'r') as f:
+            s = Template(f.read())
+            return s.substitute(
+                func_source=runner_source,
+                func_name='load_function()'
+            )
+
+    def _requirements_hash(self):
+        """Return the SHA-256 hex digest of the image's dependency set"""
+        requirements = sorted(
+            '{name:s}=={version!s}'.format(**item)
+            for item in self.pip_imports
+        )
+        spec = '\n'.join(requirements + sorted(self.github_installs)
+                         + [self.base_image, self.username])
+        return hashlib.sha256(spec.encode('utf-8')).hexdigest()
+
+    def _write_script(self):
+        """Write this instance's function, or the runner, to a script"""
+        with open(self.script_path, 'w') as f:
+            if self.runner:
+                f.write(self._render_runner_script())
+            else:
+                f.write(self._render_script())
 
         mod_logger.info(
             'Wrote python function {func:s} to script {script:s}'.format(
@@ -389,52 +730,248 @@ class DockerImage(aws.NamedObject):
         )
 
     def _write_dockerfile(self):
-        """Write Dockerfile to containerize this instance's python function"""
-        with open(self.docker_path, 'w') as f:
-            template_path = os.path.abspath(os.path.join(
-                os.path.dirname(__file__),
-                'templates',
-                'Dockerfile.template'
-            ))
+        """Write Dockerfile to containerize this instance's python function
 
-            if self.github_installs:
-                github_installs_string = ''.join([
-                    ' \\\n    && pip install --no-cache-dir git+' + install
-                    for install in self.github_installs
-                ])
-            else:
-                github_installs_string = ''
+        With shared dependencies, also write the Dockerfile of the
+        dependency image.
+        """
+        templates_dir = os.path.abspath(os.path.join(
+            os.path.dirname(__file__), 'templates'
+        ))
 
-            with open(template_path, 'r') as template:
-                s = Template(template.read())
-                f.write(s.substitute(
-                    app_name=self.name,
-                    username=self.username,
-                    base_image=self.base_image,
-                    script_base_name=os.path.basename(self.script_path),
-                    github_installs_string=github_installs_string
-                ))
+        if self.buildkit:
+            # Keep pip's cache in a BuildKit cache mount between builds
+            pip_cache_mount = '--mount=type=cache,target=/root/.cache/pip '
+            pip_install = 'pip install'
+        else:
+            pip_cache_mount = ''
+            pip_install = 'pip install --no-cache-dir'
+
+        if self.image_profile == 'distroless':
+            # Install into a directory that is copied to the runtime image
+            pip_install += ' --target /opt/cloudknot/site-packages'
+
+        if self.image_profile == 'slim' and self.github_installs:
+            # The slim images lack git
+            git_install = ('apt-get update \\\n'
+                           '    && apt-get install -y --no-install-recommends'
+                           ' git \\\n'
+                           '    && rm -rf /var/lib/apt/lists/* \\\n'
+                           '    && ')
+        else:
+            git_install = ''
 
-        mod_logger.info(
-            'Wrote Dockerfile {path:s}'.format(path=self.docker_path)
+        if self.github_installs:
+            github_installs_string = ''.join([
+                ' \\\n    && ' + pip_install + ' git+' + install
+                for install in self.github_installs
+            ])
+        else:
+            github_installs_string = ''
+
+        substitutions = dict(
+            app_name=self.name,
+            username=self.username,
+            base_image=self.base_image,
+            script_base_name=os.path.basename(self.script_path),
+            github_installs_string=github_installs_string,
+            pip_cache_mount=pip_cache_mount,
+            pip_install=pip_install,
+            git_install=git_install,
+            builder_image=DISTROLESS_BUILDER_IMAGE
         )
 
-    def _set_imports(self):
-        """Set required imports for the python script at self.script_path"""
-        # Get the names of packages imported in the script
-        import_names = pipreqs.get_all_imports(os.path.dirname(
+        if self.shared_deps:
+            substitutions['deps_image'] = self.deps_image
+            substitutions['deps_hash'] = self._requirements_hash()
+            dockerfiles = [
+                (self.deps_docker_path, 'Dockerfile.deps.template'),
+                (self.docker_path, 'Dockerfile.app.template'),
+            ]
+        elif self.image_profile == 'full':
+            dockerfiles = [(self.docker_path, 'Dockerfile.template')]
+        else:
+            dockerfiles = [(self.docker_path,
+                            'Dockerfile.' + self.image_profile + '.template')]
+
+        for path, template_name in dockerfiles:
+            template_path = os.path.join(templates_dir, template_name)
+            with open(path, 'w') as f, open(template_path, 'r') as template:
+                if self.buildkit:
+                    # Cache mounts need the BuildKit Dockerfile frontend
+                    f.write('# syntax=docker/dockerfile:1\n')
+                s = Template(template.read())
+                f.write(s.substitute(**substitutions))
+
+            mod_logger.info('Wrote Dockerfile {path:s}'.format(path=path))
+
+    def _write_dockerignore(self):
+        """Write a .dockerignore that excludes all but the copied files
+
+        Without it, the whole build path, e.g. the repository holding a
+        user-supplied script, is sent to the Docker daemon on every build.
+        A pre-existing .dockerignore is left alone.
+        """
+        if os.path.isfile(self.dockerignore_path):
+            self._clobber_dockerignore = False
+            mod_logger.info('Keeping pre-existing {path:s}'.format(
+                path=self.dockerignore_path
+            ))
+            return
+
+        with open(self.dockerignore_path, 'w') as f:
+            f.write('# Generated by cloudknot. Send only the files that the '
+                    'Dockerfile copies.\n')
+            f.write('*\n')
+            f.write('!' + os.path.basename(self.docker_path) + '\n')
+            if self.shared_deps:
+                f.write('!' + os.path.basename(self.deps_docker_path) + '\n')
+            f.write('!requirements.txt\n')
+            f.write('!' + os.path.basename(self.script_path) + '\n')
+
+        self._clobber_dockerignore = True
+        mod_logger.info('Wrote {path:s}'.format(path=self.dockerignore_path))
+
+    def _set_imports(self, source=None):
+        """Set required imports for the python script at self.script_path
+
+        Import names are resolved from the installed distributions, then
+        the persistent cache, then PyPI. See cloudknot.requirements.
+
+        Parameters
+        ----------
+        source : string
+            Source code to analyze instead of the script at
             self.script_path
-        ))
+            Default: None
+        """
+        # Get the names of packages imported in the script
+        if source is None:
+            import_names = pipreqs.get_all_imports(os.path.dirname(
+                self.script_path
+            ))
+        else:
+            source_dir = tempfile.mkdtemp(prefix='cloudknot_imports_')
+            try:
+                with open(os.path.join(source_dir, 'script.py'), 'w') as f:
+                    f.write(source)
+                import_names = pipreqs.get_all_imports(source_dir)
+            finally:
+                shutil.rmtree(source_dir, ignore_errors=True)
 
         # Of those names, store that ones that are available via pip
-        self._pip_imports = pipreqs.get_imports_info(import_names)
+        resolved = requirements.resolve_imports(import_names)
+        self._pip_imports = []
+        for item in resolved.values():
+            if item not in self._pip_imports:
+                self._pip_imports.append(item)
 
         # If some imports were left out, store their names
-        pip_names = set([i['name'] for i in self.pip_imports])
-        self._missing_imports = list(set(import_names) - pip_names)
+        self._missing_imports = [n for n in import_names
+                                 if n not in resolved]
+
+        self._warn_missing_imports()
+
+    def _adopt_shared_runner(self):
+        """Adopt the existing runner image with this instance's name, if any
+
+        The image's reference count is incremented, so that clobber keeps
+        the image for its other users.
+
+        Returns
+        -------
+        bool
+            True if an existing runner image was adopted
+        """
+        section_name = 'docker-image ' + self.name
+        config = configparser.ConfigParser()
+
+        with rlock:
+            config.read(get_config_file())
+            if section_name not in config.sections() or not os.path.isfile(
+                    config.get(section_name, 'docker-path')
+            ):
+                return False
+
+            self._read_config(config, section_name)
+            references = config.getint(section_name, 'references',
+                                       fallback=1)
+            ckconfig.add_resource(section_name, 'references',
+                                  str(references + 1))
+
+        mod_logger.info('Adopted runner image {name:s}, which is shared by '
+                        '{n:d} DockerImages'.format(name=self.name,
+                                                    n=references + 1))
+        return True
+
+    def _read_config(self, config, section_name):
+        """Set this instance's attributes from its config file section"""
+        self._build_path = config.get(section_name, 'build-path')
+        self._script_path = config.get(section_name, 'script-path')
+        self._docker_path = config.get(section_name, 'docker-path')
+        self._req_path = config.get(section_name, 'req-path')
+        self._base_image = config.get(section_name, 'base-image')
+        self._github_installs = config.get(section_name,
+                                           'github-imports').split()
+        self._username = config.get(section_name, 'username')
+        self._clobber_script = config.getboolean(section_name,
+                                                 'clobber-script')
+        self._runner = config.getboolean(section_name, 'runner',
+                                         fallback=False)
+        self._shared_deps = config.getboolean(section_name, 'shared-deps',
+                                              fallback=False)
+        self._buildkit = config.getboolean(section_name, 'buildkit',
+                                           fallback=False)
+        self._image_profile = config.get(section_name, 'image-profile',
+                                         fallback='full')
+        self._clobber_dockerignore = config.getboolean(
+            section_name, 'clobber-dockerignore', fallback=False
+        )
+
+        images_str = config.get(section_name, 'images')
+        images_list = [s.split(':') for s in images_str.split()]
+        self._images = [{'name': i[0], 'tag': i[1]} for i in images_list]
+
+        uri = config.get(section_name, 'repo-uri')
+        self._repo_uri = uri if uri else None
+
+        # Sections written before build contexts were hashed lack these
+        self._context_hash = config.get(section_name, 'context-hash',
+                                        fallback='') or None
+        self._image_id = config.get(section_name, 'image-id',
+                                    fallback='') or None
+        self._push_stats = []
+
+    def _read_imports(self):
+        """Set required imports from the existing requirements.txt file
+
+        Used when adopting a DockerImage from the config file, so that no
+        import resolution is needed. Falls back on _set_imports if the file
+        is missing.
+        """
+        if not os.path.isfile(self.req_path):
+            self._set_imports()
+            return
+
+        self._pip_imports = []
+        with open(self.req_path) as f:
+            for line in f:
+                name, sep, version = line.strip().partition('==')
+                if name and not name.startswith('#'):
+                    self._pip_imports.append({
+                        'name': name, 'version': version if sep else None
+                    })
 
-        if len(import_names) != (len(self.pip_imports)
-                                 + len(self.github_installs)):
+        import_names = pipreqs.get_all_imports(os.path.dirname(
+            self.script_path
+        ))
+        resolved = requirements.resolve_imports(import_names, offline=True)
+        self._missing_imports = [n for n in import_names
+                                 if n not in resolved]
+
+    def _warn_missing_imports(self):
+        """Warn the user about imports that pipreqs could not resolve"""
+        if len(self.missing_imports) > len(self.github_installs):
             # And warn the user
             mod_logger.warning(
                 'Warning, some imports not found by pipreqs. You will '
@@ -443,9 +980,112 @@ class DockerImage(aws.NamedObject):
                 '{missing!s}'.format(missing=self.missing_imports)
             )
 
-    def build(self, tags, image_name=None):
+    def _build_image(self, client, dockerfile, tag):
+        """Build an image from the build path and return it
+
+        Parameters
+        ----------
+        client : docker.DockerClient
+
+        dockerfile : string
+            Path to the Dockerfile
+
+        tag : string
+            Name and tag of the image, e.g. 'cloudknot/func:tag'
+
+        Returns
+        -------
+        image : docker.models.images.Image
+        """
+        if not self.buildkit:
+            image = client.images.build(
+                path=self.build_path, dockerfile=dockerfile, tag=tag
+            )
+
+            # docker>=3.0.0 also returns the build logs
+            return image[0] if isinstance(image, tuple) else image
+
+        # docker-py cannot use BuildKit, so use the command line client
+        env = dict(os.environ)
+        env['DOCKER_BUILDKIT'] = '1'
+        cmd = ['docker', 'build', '--progress', 'plain',
+               '--file', dockerfile, '--tag', tag, self.build_path]
+
+        try:
+            output = subprocess.check_output(cmd, env=env,
+                                             stderr=subprocess.STDOUT)
+        except subprocess.CalledProcessError as e:
+            mod_logger.error('BuildKit build of {tag:s} failed:\n'
+                             '{out:s}'.format(
+                                 tag=tag,
+                                 out=e.output.decode('utf-8', 'replace')
+                             ))
+            raise
+
+        mod_logger.debug(output.decode('utf-8', 'replace'))
+        return client.images.get(tag)
+
+    def _ensure_deps_image(self, client):
+        """Make the shared dependency image available locally
+
+        Use the local image if it exists, else pull it from the ECR
+        repository to which this image was pushed or from the default
+        cloudknot repository, else build it.
+
+        Parameters
+        ----------
+        client : docker.DockerClient
+        """
+        try:
+            client.images.get(self.deps_image)
+            mod_logger.info('Using local dependency image '
+                            '{name:s}'.format(name=self.deps_image))
+            return
+        except docker.errors.ImageNotFound:
+            pass
+
+        if self.repo_uri is not None:
+            repo_uri = self.repo_uri.split(':')[0]
+        else:
+            try:
+                response = aws.clients['ecr'].describe_repositories(
+                    repositoryNames=[aws.get_ecr_repo()]
+                )
+                repo_uri = response['repositories'][0]['repositoryUri']
+            except aws.clients['ecr'].exceptions.ClientError:
+                repo_uri = None
+
+        if repo_uri is not None:
+            try:
+                auth_config = aws.get_ecr_auth_config(
+                    registry_id=repo_uri.split('.')[0]
+                )
+                image = client.images.pull(repo_uri, tag=self.deps_tag,
+                                           auth_config=auth_config)
+                image.tag(repository='cloudknot/deps', tag=self.deps_tag)
+                mod_logger.info('Pulled dependency image {uri:s}:{tag:s}'
+                                ''.format(uri=repo_uri, tag=self.deps_tag))
+                return
+            except (docker.errors.APIError,
+                    aws.clients['ecr'].exceptions.ClientError) as e:
+                mod_logger.warning('Could not pull dependency image '
+                                   '{uri:s}:{tag:s}, building it instead: '
+                                   '{err!s}'.format(uri=repo_uri,
+                                                    tag=self.deps_tag,
+                                                    err=e))
+
+        mod_logger.info('Building dependency image {name:s}'.format(
+            name=self.deps_image
+        ))
+        self._build_image(client, self.deps_docker_path, self.deps_image)
+
+    def build(self, tags, image_name=None, force=False):
         """Build a DockerContainer image
 
+        If the Dockerfile, requirements.txt and script are identical to those
+        of the previous build of this DockerImage, and that image still
+        exists locally, it is tagged with `tags` instead of being rebuilt.
+
         Parameters
         ----------
         tags : str or sequence of str
@@ -454,6 +1094,10 @@ class DockerImage(aws.NamedObject):
         image_name : str
             Name of Docker image to be built
             Default: 'cloudknot/' + self.name
+
+        force : bool
+            If True, build the image even if the build context is unchanged
+            Default: False
         """
         if self.clobbered:
             raise ResourceClobberedException(
@@ -480,18 +1124,36 @@ class DockerImage(aws.NamedObject):
         images = [{'name': image_name, 'tag': t} for t in tags]
         self._images += [im for im in images if im not in self.images]
 
-        # Use docker low-level APIClient
-        c = docker.from_env()
+        c = _docker_client()
+
+        if self.shared_deps:
+            self._ensure_deps_image(c)
+
+        context_hash = self._hash_context()
+        image = None if force else self._reusable_image(c, context_hash)
+
         for im in images:
-            mod_logger.info('Building image {name:s} with tag {tag:s}'.format(
-                name=im['name'], tag=im['tag']
-            ))
+            full_name = im['name'] + ':' + im['tag']
+            if image is None:
+                mod_logger.info(
+                    'Building image {name:s} with tag {tag:s}'.format(
+                        name=im['name'], tag=im['tag']
+                    )
+                )
 
-            c.images.build(
-                path=self.build_path,
-                dockerfile=self.docker_path,
-                tag=im['name'] + ':' + im['tag']
-            )
+                image = self._build_image(c, self.docker_path, full_name)
+            elif full_name not in image.tags:
+                mod_logger.info(
+                    'Build context unchanged, tagging image {id:s} as '
+                    '{name:s}'.format(id=image.id, name=full_name)
+                )
+                image.tag(repository=im['name'], tag=im['tag'])
+            else:
+                mod_logger.info('Build context unchanged, reusing image '
+                                '{name:s}'.format(name=full_name))
+
+        self._context_hash = context_hash
+        self._image_id = image.id
 
         # Update the config file images list
         config_file = get_config_file()
@@ -518,10 +1180,251 @@ class DockerImage(aws.NamedObject):
 
         # Reload to config file
         ckconfig.add_resource(section_name, 'images', config_images_str)
+        ckconfig.add_resource(section_name, 'context-hash', context_hash)
+        ckconfig.add_resource(section_name, 'image-id', image.id)
+
+    def report(self, n_runs=3):
+        """Measure the size and startup time of the most recently built image
+
+        Startup time is the wall time of running the image's script with
+        `--help` on the local Docker daemon. It covers container creation,
+        interpreter start and the script's imports, which every child of
+        an array job pays before doing any work. A container that exits
+        with an error raises PreflightError with the container's output.
+
+        Parameters
+        ----------
+        n_runs : int
+            Number of containers to run
+            Default: 3
+
+        Returns
+        -------
+        ImageReport : namedtuple
+            A namedtuple with fields image (the image ID), image_profile,
+            size_mb (the uncompressed image size in MB) and startup_s (the
+            median startup time in seconds)
+        """
+        if self.clobbered:
+            raise ResourceClobberedException(
+                'This docker image has already been clobbered.',
+                self.name
+            )
+
+        if self.image_id is None:
+            raise CloudknotInputError(
+                'This image has not been built yet. Call '
+                '`build(tags=<tags>)` before calling `report()`.'
+            )
+
+        if not isinstance(n_runs, int) or n_runs < 1:
+            raise CloudknotInputError('n_runs must be a positive integer.')
+
+        c = _docker_client()
+        image = c.images.get(self.image_id)
+
+        startup_times = []
+        for _ in range(n_runs):
+            start = time.time()
+            try:
+                c.containers.run(image.id, command=['--help'], remove=True)
+            except docker.errors.ContainerError as e:
+                logs = e.stderr.decode('utf-8', 'replace') if e.stderr else ''
+                raise PreflightError(image=image.id, exit_code=e.exit_status,
+                                     logs=logs)
+            startup_times.append(time.time() - start)
+
+        startup_times.sort()
+        ImageReport = namedtuple('ImageReport',
+                                 ['image', 'image_profile', 'size_mb',
+                                  'startup_s'])
+        report = ImageReport(
+            image=image.id,
+            image_profile=self.image_profile,
+            size_mb=image.attrs['Size'] / 1e6,
+            startup_s=startup_times[(n_runs - 1) // 2]
+        )
+
+        mod_logger.info(
+            'Image {name:s} ({profile:s}): {size:.1f} MB, median startup '
+            '{startup:.2f} s'.format(name=self.name,
+                                     profile=report.image_profile,
+                                     size=report.size_mb,
+                                     startup=report.startup_s)
+        )
+
+        return report
+
+    def _remote_manifest(self, image, tags):
+        """Find an image in this instance's ECR repository
+
+        Parameters
+        ----------
+        image : docker.models.images.Image
+            Local image to look for
+
+        tags : sequence of str
+            Tags under which the image may have been pushed
+
+        Returns
+        -------
+        manifest : dict or None
+            The imageManifest, imageManifestMediaType and imageDigest of the
+            image in ECR, plus the set of tags it carries there, or None if
+            ECR does not hold the image
+        """
+        repo_uri = self.repo_uri.split(':')[0]
+        registry_id = repo_uri.split('.')[0]
+        repo_name = repo_uri.split('/', 1)[1]
+
+        # Manifest digests under which the image was pushed from this host
+        digests = [d.split('@', 1)[1]
+                   for d in image.attrs.get('RepoDigests', [])
+                   if d.split('@', 1)[0] == repo_uri]
+
+        image_ids = ([{'imageDigest': d} for d in digests]
+                     + [{'imageTag': t} for t in tags])
+
+        try:
+            response = aws.clients['ecr'].batch_get_image(
+                registryId=registry_id,
+                repositoryName=repo_name,
+                imageIds=image_ids,
+                acceptedMediaTypes=[
+                    'application/vnd.docker.distribution.manifest.v2+json'
+                ]
+            )
+        except aws.clients['ecr'].exceptions.ClientError as e:
+            mod_logger.info('Could not look up image {id:s} in ECR: '
+                            '{err!s}'.format(id=image.id, err=e))
+            return None
+
+        manifest = None
+        remote_tags = set()
+        for remote in response.get('images', []):
+            try:
+                config_digest = json.loads(
+                    remote['imageManifest']
+                )['config']['digest']
+            except (ValueError, KeyError, TypeError):
+                config_digest = None
+
+            # The local image ID is the digest of the image config
+            if (remote['imageId']['imageDigest'] in digests
+                    or config_digest == image.id):
+                manifest = {
+                    'imageManifest': remote['imageManifest'],
+                    'imageDigest': remote['imageId']['imageDigest'],
+                }
+                if remote.get('imageManifestMediaType'):
+                    manifest['imageManifestMediaType'] = \
+                        remote['imageManifestMediaType']
+                if remote['imageId'].get('imageTag'):
+                    remote_tags.add(remote['imageId']['imageTag'])
+
+        if manifest is not None:
+            manifest['tags'] = remote_tags
+
+        return manifest
+
+    def _push_image(self, cli, image, tags, auth_config):
+        """Push a local image with tags to this instance's ECR repository
+
+        Skip the upload if ECR already holds the image and only add the
+        missing tags.
+
+        Parameters
+        ----------
+        cli : docker.models.images.ImageCollection
+            Docker image client
 
-    def push(self, repo=None, repo_uri=None):
+        image : docker.models.images.Image
+            The local image, already tagged with self.repo_uri and `tags`
+
+        tags : sequence of str
+            Tags under which to push the image
+
+        auth_config : dict
+            ECR credentials, from aws.get_ecr_auth_config
+        """
+        manifest = self._remote_manifest(image, tags)
+
+        if manifest is None:
+            for tag in tags:
+                # Log push info
+                mod_logger.info(
+                    'Pushing image {uri:s} with tag {tag:s}'.format(
+                        uri=self.repo_uri, tag=tag
+                    )
+                )
+
+                start = time.time()
+                n_bytes, layers_pushed, layers_skipped = _parse_push_stream(
+                    cli.push(repository=self.repo_uri, tag=tag, stream=True,
+                             decode=True, auth_config=auth_config)
+                )
+                seconds = time.time() - start
+
+                stats = PushStats(
+                    repository=self.repo_uri, tag=tag, bytes=n_bytes,
+                    seconds=seconds,
+                    bytes_per_s=n_bytes / seconds if seconds > 0 else None,
+                    layers_pushed=layers_pushed,
+                    layers_skipped=layers_skipped
+                )
+                self._push_stats.append(stats)
+
+                mod_logger.info(
+                    'Pushed {n:d} layers ({mb:.1f} MB) of {uri:s}:{tag:s} in '
+                    '{t:.1f} s, {rate:.1f} MB/s. The repository held {k:d} '
+                    'layers already.'.format(
+                        n=layers_pushed, mb=n_bytes / 1e6, uri=self.repo_uri,
+                        tag=tag, t=seconds,
+                        rate=(stats.bytes_per_s or 0) / 1e6,
+                        k=layers_skipped
+                    )
+                )
+
+            return
+
+        mod_logger.info('ECR already holds image {id:s} as {digest:s}, '
+                        'skipping push'.format(
+                            id=image.id, digest=manifest['imageDigest']
+                        ))
+
+        # Apply the missing tags remotely by putting the manifest
+        for tag in tags:
+            if tag in manifest['tags']:
+                continue
+
+            mod_logger.info('Tagging remote image {digest:s} with tag '
+                            '{tag:s}'.format(
+                                digest=manifest['imageDigest'], tag=tag
+                            ))
+
+            put_kwargs = {
+                'registryId': self.repo_uri.split('.')[0],
+                'repositoryName': self.repo_uri.split('/', 1)[1],
+                'imageManifest': manifest['imageManifest'],
+                'imageTag': tag,
+            }
+            if 'imageManifestMediaType' in manifest:
+                put_kwargs['imageManifestMediaType'] = \
+                    manifest['imageManifestMediaType']
+
+            try:
+                aws.clients['ecr'].put_image(**put_kwargs)
+            except aws.clients['ecr'].exceptions \
+                    .ImageAlreadyExistsException:
+                pass
+
+    def push(self, repo=None, repo_uri=None, max_threads=4):
         """Tag and push a DockerContainer image to a repository
 
+        Distinct local images, e.g. from builds of different contexts under
+        different tags, are pushed concurrently. The shared dependency
+        image, if any, is pushed first.
+
         Parameters
         ----------
         repo : DockerRepo, optional
@@ -529,6 +1432,10 @@ class DockerImage(aws.NamedObject):
 
         repo_uri : string, optional
             URI for the docker repository to which to push this instance
+
+        max_threads : int, optional
+            Maximum number of images pushed at once
+            Default: 4
         """
         if self.clobbered:
             raise ResourceClobberedException(
@@ -554,36 +1461,6 @@ class DockerImage(aws.NamedObject):
                 'first before calling `tag()`.'
             )
 
-        fallback = 'from_env'
-        if get_profile(fallback=fallback) != fallback:
-            cmd = [
-                'aws', 'ecr', 'get-login', '--no-include-email',
-                '--region', get_region(),
-                '--profile', get_profile(),
-            ]
-        else:
-            cmd = [
-                'aws', 'ecr', 'get-login', '--no-include-email',
-                '--region', get_region(),
-            ]
-
-        # Refresh the aws ecr login credentials
-        login_cmd = subprocess.check_output(cmd)
-
-        # Login
-        login_cmd = login_cmd.decode('ASCII').rstrip('\n').split(' ')
-        fnull = open(os.devnull, 'w')
-        login_result = subprocess.call(login_cmd,
-                                       stdout=fnull, stderr=subprocess.STDOUT)
-
-        # If login failed, pass error to user
-        if login_result:  # pragma: nocover
-            raise CloudknotConfigurationError(
-                'Unable to login to AWS ECR using `{login:s}`'.format(
-                    login=login_cmd.decode()
-                )
-            )
-
         if repo:
             if not isinstance(repo, aws.DockerRepo):
                 raise CloudknotInputError('repo must be of type DockerRepo.')
@@ -593,10 +1470,20 @@ class DockerImage(aws.NamedObject):
                 raise CloudknotInputError('`repo_uri` must be a string.')
             self._repo_uri = repo_uri
 
+        # Credentials for the registry, cached until the token expires
+        auth_config = aws.get_ecr_auth_config(
+            registry_id=self.repo_uri.split('.')[0]
+        )
+
         # Use docker low-level APIClient for tagging
-        c = docker.from_env().api
+        c = _docker_client().api
         # And the image client for pushing
-        cli = docker.from_env().images
+        cli = _docker_client().images
+
+        # Group the tags by local image, so that each image is looked up in
+        # ECR once
+        tags_by_image = {}
+        local_images = {}
         for im in self.images:
             # Log tagging info
             mod_logger.info('Tagging image {name:s} with tag {tag:s}'.format(
@@ -607,15 +1494,30 @@ class DockerImage(aws.NamedObject):
             c.tag(image=im['name'] + ':' + im['tag'],
                   repository=self.repo_uri, tag=im['tag'])
 
-            # Log push info
-            mod_logger.info('Pushing image {name:s} with tag {tag:s}'.format(
-                name=im['name'], tag=im['tag']
-            ))
+            image = cli.get(im['name'] + ':' + im['tag'])
+            local_images[image.id] = image
+            tags_by_image.setdefault(image.id, []).append(im['tag'])
+
+        if self.shared_deps:
+            # Push the dependency image first, so that the application
+            # image only uploads its own layers
+            c.tag(image=self.deps_image, repository=self.repo_uri,
+                  tag=self.deps_tag)
+            self._push_image(cli, cli.get(self.deps_image), [self.deps_tag],
+                             auth_config)
+
+        # Each image's tags are pushed in order, so that its layers are
+        # uploaded once
+        n_threads = max(1, min(max_threads, len(tags_by_image)))
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            futures = [
+                executor.submit(self._push_image, cli, local_images[image_id],
+                                tags, auth_config)
+                for image_id, tags in tags_by_image.items()
+            ]
 
-            for l in cli.push(
-                    repository=self.repo_uri, tag=im['tag'], stream=True
-            ):
-                mod_logger.debug(l)
+        for future in futures:
+            future.result()
 
         self._repo_uri = self._repo_uri + ':' + self.images[-1]['tag']
 
@@ -634,12 +1536,40 @@ class DockerImage(aws.NamedObject):
         if self.clobbered:
             return
 
+        # Keep a shared runner image for its other users
+        section_name = 'docker-image ' + self.name
+        with rlock:
+            references = self.references
+            if references > 1:
+                ckconfig.add_resource(section_name, 'references',
+                                      str(references - 1))
+
+        if references > 1:
+            self._clobbered = True
+            mod_logger.info('Kept docker image {name:s}, which is shared by '
+                            '{n:d} other DockerImages'.format(
+                                name=self.name, n=references - 1
+                            ))
+            return
+
         if self._clobber_script:
             os.remove(self.script_path)
             mod_logger.info('Removed {path:s}'.format(path=self.script_path))
 
         os.remove(self.docker_path)
         mod_logger.info('Removed {path:s}'.format(path=self.docker_path))
+        if self._clobber_dockerignore \
+                and os.path.isfile(self.dockerignore_path):
+            os.remove(self.dockerignore_path)
+            mod_logger.info('Removed {path:s}'.format(
+                path=self.dockerignore_path
+            ))
+        if self.shared_deps and os.path.isfile(self.deps_docker_path):
+            # The dependency image itself is shared with other images
+            os.remove(self.deps_docker_path)
+            mod_logger.info('Removed {path:s}'.format(
+                path=self.deps_docker_path
+            ))
         os.remove(self.req_path)
         mod_logger.info('Removed {path:s}'.format(path=self.req_path))
 
@@ -651,7 +1581,7 @@ class DockerImage(aws.NamedObject):
             # that we shouldn't mess with.
             pass
 
-        cli = docker.from_env().images
+        cli = _docker_client().images
         # Get local images first (lol stands for list_of_lists
         local_image_lol = [im.tags for im in cli.list()]
         # Flatten the list of lists
@@ -0,0 +1,979 @@
+"""The emulator module emulates the parts of AWS Batch and S3 used by cloudknot
+
+This module contains in-process stand-ins for the boto3 Batch and S3
+clients:
+    - EmulatedS3Client : filesystem-backed S3 buckets
+    - EmulatedBatchClient : job definitions, job queues and jobs, including
+      array jobs, whose containers run on the local Docker daemon
+    - EmulatedIamClient : the IAM policy calls made when setting the
+      cloudknot S3 bucket
+    - AwsEmulator : context manager that swaps the emulated clients into
+      `cloudknot.aws.clients`
+
+Containers receive the same AWS_BATCH_JOB_* environment variables as on
+AWS Batch, as well as CLOUDKNOT_LOCAL_S3_ROOT, the filesystem-backed bucket.
+DockerRunner runs the image's script through LOCAL_S3_SHIM, which points the
+script's S3 clients at that bucket, so that the container script itself has
+no emulator code. This lets the images built by DockerImage.build, the
+container script and the client be tested end to end on a single Linux
+machine.
+
+Only the subset of the Batch and S3 APIs that cloudknot calls is emulated.
+"""
+from __future__ import absolute_import, division, print_function
+
+import botocore.exceptions
+import copy
+import errno
+import io
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from . import dockerimage
+from .aws import base_classes
+
+__all__ = ["EmulatedS3Client", "EmulatedBatchClient", "EmulatedIamClient",
+           "DockerRunner", "AwsEmulator"]
+
+#: Script that runs a container script with S3 clients that read and write
+#: CLOUDKNOT_LOCAL_S3_ROOT. Usage: python LOCAL_S3_SHIM <script> [args ...]
+LOCAL_S3_SHIM = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'templates', 'local_s3.template')
+
+mod_logger = logging.getLogger(__name__)
+
+
+def _client_error(name, code, operation):
+    """Return a botocore ClientError subclass named `name`"""
+    cls = type(name, (botocore.exceptions.ClientError,), {})
+
+    def __init__(self, message=''):
+        botocore.exceptions.ClientError.__init__(
+            self, {'Error': {'Code': code, 'Message': message}}, operation
+        )
+
+    cls.__init__ = __init__
+    return cls
+
+
+def _now():
+    """Return the current time in milliseconds, like AWS Batch timestamps"""
+    return int(time.time() * 1000)
+
+
+class _Exceptions(object):
+    """Namespace of exception classes, like boto3's client.exceptions"""
+    def __init__(self, **exceptions):
+        self.ClientError = botocore.exceptions.ClientError
+        for name, cls in exceptions.items():
+            setattr(self, name, cls)
+
+
+class _EmulatedClient(object):
+    """Base class for emulated clients with injected latency and throttling"""
+    def __init__(self, latency=0, max_call_rate=None):
+        """Initialize an emulated client
+
+        Parameters
+        ----------
+        latency : float or dict
+            Seconds to sleep at the start of each API call. If a dict, map
+            from operation name (e.g. 'submit_job') to seconds; operations
+            not in the dict have no latency.
+            Default: 0
+
+        max_call_rate : float or dict
+            Maximum sustained calls per second of each operation. Calls in
+            excess of this rate are throttled: they wait until the rate
+            allows them, as botocore's retries would, and are counted in
+            `throttled_calls`. If a dict, map from operation name to rate;
+            operations not in the dict are not throttled. If None, no calls
+            are throttled.
+            Default: None
+        """
+        self._latency = latency
+        self._max_call_rate = max_call_rate
+        self._stats_lock = threading.Lock()
+        self._next_call_time = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Reset the call counts and throttling statistics"""
+        with self._stats_lock:
+            #: Number of calls of each operation
+            self.call_counts = {}
+            #: Number of calls of each operation that were throttled
+            self.throttled_calls = {}
+
+    def _option(self, option, operation):
+        """Return the value of a latency or rate option for an operation"""
+        if isinstance(option, dict):
+            return option.get(operation)
+        return option
+
+    def _call(self, operation):
+        """Record an API call, waiting for injected latency and throttling"""
+        wait = 0
+        rate = self._option(self._max_call_rate, operation)
+
+        with self._stats_lock:
+            self.call_counts[operation] = self.call_counts.get(operation,
+                                                               0) + 1
+            if rate:
+                now = time.time()
+                next_time = max(self._next_call_time.get(operation, now),
+                                now)
+                wait = next_time - now
+                self._next_call_time[operation] = next_time + 1.0 / rate
+                if wait > 0:
+                    self.throttled_calls[operation] = \
+                        self.throttled_calls.get(operation, 0) + 1
+
+        latency = self._option(self._latency, operation)
+        if wait > 0 or latency:
+            time.sleep(wait + (latency or 0))
+
+
+class EmulatedS3Client(_EmulatedClient):
+    """Filesystem-backed emulation of the boto3 S3 client"""
+    def __init__(self, root_dir, latency=0, max_call_rate=None):
+        """Initialize an emulated S3 client
+
+        Parameters
+        ----------
+        root_dir : string
+            Directory holding the buckets. Object `key` of bucket `bucket`
+            is stored at <root_dir>/<bucket>/<key>.
+
+        latency : float or dict
+            Seconds of latency injected into each call, see _EmulatedClient
+            Default: 0
+
+        max_call_rate : float or dict
+            Maximum calls per second, see _EmulatedClient
+            Default: None
+        """
+        super(EmulatedS3Client, self).__init__(latency=latency,
+                                               max_call_rate=max_call_rate)
+        self._root_dir = root_dir
+        self.exceptions = _Exceptions(
+            NoSuchKey=_client_error('NoSuchKey', 'NoSuchKey', 'GetObject'),
+            NoSuchBucket=_client_error('NoSuchBucket', 'NoSuchBucket',
+                                       'GetObject'),
+            BucketAlreadyExists=_client_error(
+                'BucketAlreadyExists', 'BucketAlreadyExists', 'CreateBucket'
+            ),
+            BucketAlreadyOwnedByYou=_client_error(
+                'BucketAlreadyOwnedByYou', 'BucketAlreadyOwnedByYou',
+                'CreateBucket'
+            ),
+        )
+
+    def reset_stats(self):
+        """Reset the call counts, throttling and transfer statistics"""
+        super(EmulatedS3Client, self).reset_stats()
+        with self._stats_lock:
+            #: Total size of the objects uploaded with put_object
+            self.bytes_uploaded = 0
+            #: Total size of the objects downloaded with get_object
+            self.bytes_downloaded = 0
+
+    @property
+    def root_dir(self):
+        """Directory holding the buckets"""
+        return self._root_dir
+
+    def _path(self, bucket, key):
+        return os.path.join(self._root_dir, bucket, *key.split('/'))
+
+    def _makedirs(self, path):
+        """Create directories that containers running as any user can use"""
+        if os.path.isdir(path):
+            return
+
+        self._makedirs(os.path.dirname(path))
+        try:
+            os.mkdir(path)
+            os.chmod(path, 0o777)
+        except OSError as e:
+            if not (e.errno == errno.EEXIST and os.path.isdir(path)):
+                raise e
+
+    def create_bucket(self, Bucket, **kwargs):
+        self._call('create_bucket')
+        self._makedirs(os.path.join(self._root_dir, Bucket))
+        return {'Location': '/' + Bucket}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self._call('put_object')
+        path = self._path(Bucket, Key)
+        self._makedirs(os.path.dirname(path))
+
+        if not isinstance(Body, bytes):
+            Body = Body.encode() if hasattr(Body, 'encode') else Body.read()
+
+        with open(path, 'wb') as f:
+            f.write(Body)
+
+        with self._stats_lock:
+            self.bytes_uploaded += len(Body)
+
+        return {}
+
+    def get_object(self, Bucket, Key):
+        self._call('get_object')
+        if not os.path.isdir(os.path.join(self._root_dir, Bucket)):
+            raise self.exceptions.NoSuchBucket(Bucket)
+
+        path = self._path(Bucket, Key)
+        if not os.path.isfile(path):
+            raise self.exceptions.NoSuchKey(Key)
+
+        with open(path, 'rb') as f:
+            body = f.read()
+
+        with self._stats_lock:
+            self.bytes_downloaded += len(body)
+
+        return {'Body': io.BytesIO(body), 'ContentLength': len(body)}
+
+    def delete_object(self, Bucket, Key):
+        self._call('delete_object')
+        path = self._path(Bucket, Key)
+        if os.path.isfile(path):
+            os.remove(path)
+
+        return {}
+
+
+class EmulatedIamClient(_EmulatedClient):
+    """Emulation of the IAM policy calls made by `set_s3_params`"""
+    def __init__(self, latency=0, max_call_rate=None):
+        """Initialize an emulated IAM client
+
+        Parameters
+        ----------
+        latency : float or dict
+            Seconds of latency injected into each call, see _EmulatedClient
+            Default: 0
+
+        max_call_rate : float or dict
+            Maximum calls per second, see _EmulatedClient
+            Default: None
+        """
+        super(EmulatedIamClient, self).__init__(latency=latency,
+                                                max_call_rate=max_call_rate)
+        self._policies = {}
+        self.exceptions = _Exceptions(
+            EntityAlreadyExistsException=_client_error(
+                'EntityAlreadyExistsException', 'EntityAlreadyExists',
+                'CreatePolicy'
+            ),
+        )
+
+    def create_policy(self, PolicyName, PolicyDocument, Path='/', **kwargs):
+        self._call('create_policy')
+        if PolicyName in self._policies:
+            raise self.exceptions.EntityAlreadyExistsException(PolicyName)
+
+        self._policies[PolicyName] = {
+            'PolicyName': PolicyName,
+            'Path': Path,
+            'Arn': 'arn:aws:iam::000000000000:policy{p:s}{n:s}'.format(
+                p=Path, n=PolicyName
+            ),
+            'Document': PolicyDocument,
+        }
+        return {'Policy': dict(self._policies[PolicyName])}
+
+    def list_policies(self, PathPrefix='/', **kwargs):
+        self._call('list_policies')
+        return {'Policies': [dict(p) for p in self._policies.values()
+                             if p['Path'].startswith(PathPrefix)]}
+
+    def create_policy_version(self, PolicyArn, PolicyDocument, **kwargs):
+        self._call('create_policy_version')
+        for policy in self._policies.values():
+            if policy['Arn'] == PolicyArn:
+                policy['Document'] = PolicyDocument
+
+        return {'PolicyVersion': {'IsDefaultVersion': True}}
+
+
+class DockerRunner(object):
+    """Run emulated batch job attempts as containers on the Docker daemon"""
+    #: Path inside the container at which LOCAL_S3_SHIM is mounted
+    _shim_path = '/cloudknot-emulator/local_s3.py'
+
+    def __init__(self, mount_point='/cloudknot-s3'):
+        """Initialize a DockerRunner
+
+        Parameters
+        ----------
+        mount_point : string
+            Path inside the container at which the emulated S3 root
+            directory is mounted
+            Default: '/cloudknot-s3'
+        """
+        self._client = dockerimage._docker_client()
+        self._mount_point = mount_point
+
+    def __call__(self, image, command, environment):
+        """Run one attempt of a job and return its exit code
+
+        See `run` for the parameters.
+        """
+        return self.run(image, command, environment)[0]
+
+    def run(self, image, command, environment):
+        """Run one attempt of a job and return its exit code and output
+
+        Parameters
+        ----------
+        image : string
+            The Docker image to run
+
+        command : list of strings
+            The container command
+
+        environment : dict
+            Container environment variables. CLOUDKNOT_LOCAL_S3_ROOT is
+            rewritten to the mount point of the emulated S3 root directory.
+
+        Returns
+        -------
+        exit_code : int
+
+        logs : string
+            The container's stdout and stderr
+        """
+        environment = dict(environment)
+        s3_root = environment['CLOUDKNOT_LOCAL_S3_ROOT']
+        environment['CLOUDKNOT_LOCAL_S3_ROOT'] = self._mount_point
+
+        # Run the image's entrypoint, python and the container script,
+        # through the local S3 shim
+        entrypoint = self._client.images.get(image).attrs['Config'].get(
+            'Entrypoint'
+        )
+        if not entrypoint or len(entrypoint) < 2:
+            raise base_classes.CloudknotInputError(
+                'The emulator can only run images whose entrypoint runs a '
+                'python script, like those built by DockerImage. Image '
+                '{image:s} has entrypoint {e!s}.'.format(image=image,
+                                                         e=entrypoint)
+            )
+
+        container = self._client.containers.run(
+            image, command=command, environment=environment, detach=True,
+            entrypoint=[entrypoint[0], self._shim_path] + entrypoint[1:],
+            volumes={
+                s3_root: {'bind': self._mount_point, 'mode': 'rw'},
+                LOCAL_S3_SHIM: {'bind': self._shim_path, 'mode': 'ro'},
+            }
+        )
+
+        try:
+            response = container.wait()
+            exit_code = (response['StatusCode'] if isinstance(response, dict)
+                         else response)
+            logs = container.logs().decode('utf-8', 'replace')
+            mod_logger.debug('Container {id:s} for {job:s} exited with code '
+                             '{code:d}:\n{logs:s}'.format(
+                                 id=container.id,
+                                 job=environment['AWS_BATCH_JOB_ID'],
+                                 code=exit_code, logs=logs
+                             ))
+        finally:
+            container.remove(force=True)
+
+        return exit_code, logs
+
+
+class EmulatedBatchClient(_EmulatedClient):
+    """In-process emulation of the boto3 AWS Batch client"""
+    def __init__(self, s3, concurrency=4, latency=0, max_call_rate=None,
+                 runner=None, max_array_size=10000, scheduling_delay=0.5,
+                 region='us-east-1', account='000000000000'):
+        """Initialize an emulated Batch client
+
+        Parameters
+        ----------
+        s3 : EmulatedS3Client
+            The emulated S3 client whose root directory is exposed to jobs
+
+        concurrency : int
+            Maximum number of job attempts running at once
+            Default: 4
+
+        latency : float or dict
+            Seconds of latency injected into each call, see _EmulatedClient
+            Default: 0
+
+        max_call_rate : float or dict
+            Maximum calls per second, see _EmulatedClient
+            Default: None
+
+        runner : callable
+            Called as runner(image, command, environment) to run one attempt
+            of a job, returning its exit code. If None, use a DockerRunner.
+            Default: None
+
+        max_array_size : int
+            Maximum size of an array job. AWS Batch allows 10000. If None,
+            array jobs may have any size of at least 2.
+            Default: 10000
+
+        scheduling_delay : float
+            Minimum seconds between submit_job returning and the job
+            starting. As on AWS Batch, this leaves the client time to upload
+            the job's input after submit_job returns the jobID.
+            Default: 0.5
+
+        region : string
+            Region used in emulated ARNs
+            Default: 'us-east-1'
+
+        account : string
+            Account ID used in emulated ARNs
+            Default: '000000000000'
+        """
+        super(EmulatedBatchClient, self).__init__(latency=latency,
+                                                  max_call_rate=max_call_rate)
+        self._s3 = s3
+        self._max_array_size = max_array_size
+        self._scheduling_delay = scheduling_delay
+        self._start_after = {}
+        self._runner = runner if runner is not None else DockerRunner()
+        self._arn_prefix = 'arn:aws:batch:{r:s}:{a:s}:'.format(r=region,
+                                                               a=account)
+        self._executor = ThreadPoolExecutor(concurrency)
+        self._lock = threading.RLock()
+        self._job_definitions = []
+        self._job_queues = {}
+        self._jobs = {}
+        self._job_order = []
+
+        self.exceptions = _Exceptions(
+            ClientException=_client_error('ClientException',
+                                          'ClientException', 'Batch'),
+            ServerException=_client_error('ServerException',
+                                          'ServerException', 'Batch'),
+        )
+
+    # Job definitions
+    # ---------------
+    def register_job_definition(self, jobDefinitionName, type,
+                                containerProperties, retryStrategy=None,
+                                **kwargs):
+        self._call('register_job_definition')
+        with self._lock:
+            revision = 1 + len([
+                jd for jd in self._job_definitions
+                if jd['jobDefinitionName'] == jobDefinitionName
+            ])
+            arn = '{p:s}job-definition/{n:s}:{r:d}'.format(
+                p=self._arn_prefix, n=jobDefinitionName, r=revision
+            )
+            self._job_definitions.append({
+                'jobDefinitionName': jobDefinitionName,
+                'jobDefinitionArn': arn,
+                'revision': revision,
+                'status': 'ACTIVE',
+                'type': type,
+                'containerProperties': copy.deepcopy(containerProperties),
+                'retryStrategy': retryStrategy or {'attempts': 1},
+            })
+
+        return {'jobDefinitionName': jobDefinitionName,
+                'jobDefinitionArn': arn, 'revision': revision}
+
+    def describe_job_definitions(self, jobDefinitions=None,
+                                 jobDefinitionName=None, status=None,
+                                 **kwargs):
+        self._call('describe_job_definitions')
+        with self._lock:
+            job_defs = [
+                jd for jd in self._job_definitions
+                if (jobDefinitions is None
+                    or jd['jobDefinitionArn'] in jobDefinitions
+                    or jd['jobDefinitionName'] in jobDefinitions)
+                and (jobDefinitionName is None
+                     or jd['jobDefinitionName'] == jobDefinitionName)
+                and (status is None or jd['status'] == status)
+            ]
+            return {'jobDefinitions': copy.deepcopy(job_defs)}
+
+    def deregister_job_definition(self, jobDefinition):
+        self._call('deregister_job_definition')
+        with self._lock:
+            for jd in self._job_definitions:
+                if jobDefinition in [jd['jobDefinitionArn'],
+                                     jd['jobDefinitionName']]:
+                    jd['status'] = 'INACTIVE'
+
+        return {}
+
+    def _job_definition(self, job_definition):
+        """Return the job definition record for an ARN or name[:revision]"""
+        with self._lock:
+            matches = [
+                jd for jd in self._job_definitions
+                if job_definition in [
+                    jd['jobDefinitionArn'], jd['jobDefinitionName'],
+                    '{n:s}:{r:d}'.format(n=jd['jobDefinitionName'],
+                                         r=jd['revision'])
+                ]
+            ]
+
+        if not matches:
+            raise self.exceptions.ClientException(
+                'Job definition {jd:s} does not exist'.format(
+                    jd=job_definition
+                )
+            )
+
+        return sorted(matches, key=lambda jd: jd['revision'])[-1]
+
+    # Job queues
+    # ----------
+    def create_job_queue(self, jobQueueName, priority,
+                         computeEnvironmentOrder=(), state='ENABLED',
+                         **kwargs):
+        self._call('create_job_queue')
+        arn = '{p:s}job-queue/{n:s}'.format(p=self._arn_prefix,
+                                            n=jobQueueName)
+        with self._lock:
+            self._job_queues[arn] = {
+                'jobQueueName': jobQueueName,
+                'jobQueueArn': arn,
+                'state': state,
+                'status': 'VALID',
+                'priority': priority,
+                'computeEnvironmentOrder': list(computeEnvironmentOrder),
+            }
+
+        return {'jobQueueName': jobQueueName, 'jobQueueArn': arn}
+
+    def describe_job_queues(self, jobQueues=None, **kwargs):
+        self._call('describe_job_queues')
+        with self._lock:
+            queues = [
+                q for q in self._job_queues.values()
+                if jobQueues is None
+                or q['jobQueueArn'] in jobQueues
+                or q['jobQueueName'] in jobQueues
+            ]
+            return {'jobQueues': copy.deepcopy(queues)}
+
+    def update_job_queue(self, jobQueue, state=None, priority=None,
+                         **kwargs):
+        self._call('update_job_queue')
+        with self._lock:
+            for q in self._job_queues.values():
+                if jobQueue in [q['jobQueueArn'], q['jobQueueName']]:
+                    if state is not None:
+                        q['state'] = state
+                    if priority is not None:
+                        q['priority'] = priority
+
+        return {}
+
+    def delete_job_queue(self, jobQueue):
+        self._call('delete_job_queue')
+        with self._lock:
+            for arn, q in list(self._job_queues.items()):
+                if jobQueue in [arn, q['jobQueueName']]:
+                    del self._job_queues[arn]
+
+        return {}
+
+    # Jobs
+    # ----
+    def submit_job(self, jobName, jobQueue, jobDefinition,
+                   containerOverrides=None, arrayProperties=None, **kwargs):
+        self._call('submit_job')
+        job_def = self._job_definition(jobDefinition)
+        overrides = containerOverrides or {}
+
+        size = (arrayProperties or {}).get('size')
+        if size is not None and (size < 2 or (
+                self._max_array_size is not None
+                and size > self._max_array_size)):
+            raise self.exceptions.ClientException(
+                'Array size must be between 2 and {n!s}'.format(
+                    n=self._max_array_size
+                )
+            )
+
+        job_id = str(uuid.uuid4())
+        container = {
+            'image': job_def['containerProperties']['image'],
+            'command': list(overrides.get(
+                'command', job_def['containerProperties'].get('command', [])
+            )),
+            'environment': (
+                list(job_def['containerProperties'].get('environment', []))
+                + list(overrides.get('environment', []))
+            ),
+        }
+
+        job = {
+            'jobId': job_id,
+            'jobName': jobName,
+            'jobQueue': jobQueue,
+            'jobDefinition': job_def['jobDefinitionArn'],
+            'status': 'SUBMITTED',
+            'statusReason': None,
+            'createdAt': _now(),
+            'attempts': [],
+            'container': container,
+            'retryStrategy': job_def['retryStrategy'],
+        }
+
+        children = []
+        if size is not None:
+            job['arrayProperties'] = {'size': size,
+                                      'statusSummary': {'RUNNABLE': size}}
+            for idx in range(size):
+                # Children share the parent's container properties, which
+                # are never modified
+                child = dict(job)
+                child['jobId'] = '{id:s}:{i:d}'.format(id=job_id, i=idx)
+                child['attempts'] = []
+                child['arrayProperties'] = {'index': idx}
+                child['status'] = 'RUNNABLE'
+                children.append(child)
+
+        with self._lock:
+            self._jobs[job_id] = job
+            self._job_order.append(job_id)
+            for child in children:
+                self._jobs[child['jobId']] = child
+                self._job_order.append(child['jobId'])
+
+            runnable = children if children else [job]
+            if children:
+                self._update_parent(job)
+            else:
+                job['status'] = 'RUNNABLE'
+
+        for unit in runnable:
+            self._executor.submit(self._run, unit['jobId'])
+
+        with self._lock:
+            self._start_after[job_id] = time.time() + self._scheduling_delay
+
+        return {'jobName': jobName, 'jobId': job_id}
+
+    def _run(self, job_id):
+        """Run the attempts of one job or array child until done"""
+        with self._lock:
+            job = self._jobs[job_id]
+            max_attempts = job['retryStrategy'].get('attempts', 1)
+
+        # Wait for the scheduling delay, which starts once submit_job returns
+        while True:
+            with self._lock:
+                start_after = self._start_after.get(job_id.split(':')[0])
+
+            if start_after is not None and start_after <= time.time():
+                break
+
+            time.sleep(max(start_after - time.time(), 0) if start_after
+                       else 0.01)
+
+        while True:
+            with self._lock:
+                if job['status'] != 'RUNNABLE':
+                    return
+
+                self._set_status(job, 'RUNNING')
+                job['startedAt'] = _now()
+                attempt_number = len(job['attempts']) + 1
+
+            environment = {e['name']: e['value']
+                           for e in job['container']['environment']}
+            environment.update({
+                'AWS_BATCH_JOB_ID': job_id,
+                'AWS_BATCH_JOB_ATTEMPT': str(attempt_number),
+                'AWS_BATCH_JQ_NAME': job['jobQueue'].split('/')[-1],
+                'CLOUDKNOT_LOCAL_S3_ROOT': self._s3.root_dir,
+            })
+            if 'index' in job.get('arrayProperties', {}):
+                environment['AWS_BATCH_JOB_ARRAY_INDEX'] = str(
+                    job['arrayProperties']['index']
+                )
+
+            try:
+                exit_code = self._runner(job['container']['image'],
+                                         job['container']['command'],
+                                         environment)
+                reason = 'Essential container in task exited'
+            except Exception as e:
+                exit_code = 1
+                reason = 'Runner error: {e!r}'.format(e=e)
+
+            with self._lock:
+                stopped_at = _now()
+                job['attempts'].append({
+                    'container': {'exitCode': exit_code,
+                                  'logStreamName': None},
+                    'startedAt': job['startedAt'],
+                    'stoppedAt': stopped_at,
+                    'statusReason': reason,
+                })
+
+                if job['status'] != 'RUNNING':
+                    # Terminated while running
+                    job['stoppedAt'] = stopped_at
+                elif exit_code == 0:
+                    self._set_status(job, 'SUCCEEDED')
+                    job['stoppedAt'] = stopped_at
+                elif attempt_number < max_attempts:
+                    self._set_status(job, 'RUNNABLE')
+                else:
+                    self._set_status(job, 'FAILED')
+                    job['statusReason'] = reason
+                    job['stoppedAt'] = stopped_at
+
+    def _parent(self, job):
+        """Return the array parent of a child job, or the job itself"""
+        return self._jobs[job['jobId'].split(':')[0]]
+
+    def _set_status(self, job, status):
+        """Set a job's status, keeping its array parent up to date"""
+        old_status = job['status']
+        job['status'] = status
+
+        if 'index' in job.get('arrayProperties', {}):
+            parent = self._parent(job)
+            summary = parent['arrayProperties']['statusSummary']
+            summary[old_status] -= 1
+            if not summary[old_status]:
+                del summary[old_status]
+            summary[status] = summary.get(status, 0) + 1
+            self._update_parent(parent)
+
+    def _update_parent(self, parent):
+        """Derive an array parent's status from its children's summary"""
+        size = parent['arrayProperties']['size']
+        summary = parent['arrayProperties']['statusSummary']
+
+        if summary.get('SUCCEEDED', 0) == size:
+            parent['status'] = 'SUCCEEDED'
+        elif summary.get('SUCCEEDED', 0) + summary.get('FAILED', 0) == size:
+            parent['status'] = 'FAILED'
+            parent['statusReason'] = 'Array Child Job failed'
+        elif summary.get('RUNNING'):
+            parent['status'] = 'RUNNING'
+            parent.setdefault('startedAt', _now())
+        else:
+            parent['status'] = 'RUNNABLE'
+
+        if parent['status'] in ['SUCCEEDED', 'FAILED']:
+            parent.setdefault('stoppedAt', _now())
+
+    def _matching_jobs(self, job_ids):
+        """Return job records for `job_ids`, expanding array parents"""
+        with self._lock:
+            jobs = []
+            for job_id in job_ids:
+                if job_id not in self._jobs:
+                    continue
+                job = self._jobs[job_id]
+                jobs.append(job)
+                if 'size' in job.get('arrayProperties', {}):
+                    jobs += [self._jobs['{id:s}:{i:d}'.format(id=job_id, i=i)]
+                             for i in range(job['arrayProperties']['size'])]
+            return jobs
+
+    def _stop(self, jobId, reason, statuses):
+        """Fail a job, and its children, if its status is in `statuses`"""
+        with self._lock:
+            for job in self._matching_jobs([jobId]):
+                # Array parent statuses follow from their children
+                if (job['status'] in statuses
+                        and 'size' not in job.get('arrayProperties', {})):
+                    self._set_status(job, 'FAILED')
+                    job['statusReason'] = reason
+                    job['stoppedAt'] = _now()
+
+        return {}
+
+    def cancel_job(self, jobId, reason):
+        self._call('cancel_job')
+        return self._stop(jobId, reason,
+                          ['SUBMITTED', 'PENDING', 'RUNNABLE'])
+
+    def terminate_job(self, jobId, reason):
+        """Terminate a job
+
+        Running attempts are not interrupted, but their result is
+        discarded and the job is marked FAILED.
+        """
+        self._call('terminate_job')
+        return self._stop(jobId, reason,
+                          ['SUBMITTED', 'PENDING', 'RUNNABLE', 'STARTING',
+                           'RUNNING'])
+
+    def describe_jobs(self, jobs):
+        self._call('describe_jobs')
+        if len(jobs) > 100:
+            raise self.exceptions.ClientException(
+                'describe_jobs accepts at most 100 jobs'
+            )
+
+        with self._lock:
+            return {'jobs': [copy.deepcopy(self._jobs[jid]) for jid in jobs
+                             if jid in self._jobs]}
+
+    def list_jobs(self, jobQueue=None, arrayJobId=None, jobStatus='RUNNING',
+                  maxResults=100, nextToken=None):
+        self._call('list_jobs')
+        with self._lock:
+            if arrayJobId is not None:
+                parent = self._jobs.get(arrayJobId)
+                size = (parent or {}).get('arrayProperties', {}).get('size', 0)
+                candidates = [self._jobs['{id:s}:{i:d}'.format(id=arrayJobId,
+                                                               i=i)]
+                              for i in range(size)]
+            else:
+                # AWS Batch lists array parents, but not their children, by
+                # job queue
+                candidates = [self._jobs[jid] for jid in self._job_order
+                              if ':' not in jid
+                              and jobQueue in [self._jobs[jid]['jobQueue'],
+                                               None]]
+
+            matching = [j for j in candidates if j['status'] == jobStatus]
+            start = int(nextToken) if nextToken else 0
+            page = matching[start:start + maxResults]
+
+            keys = ['jobId', 'jobName', 'status', 'statusReason',
+                    'createdAt', 'startedAt', 'stoppedAt', 'arrayProperties']
+            summaries = [{k: copy.deepcopy(j[k]) for k in keys if k in j}
+                         for j in page]
+
+        response = {'jobSummaryList': summaries}
+        if start + maxResults < len(matching):
+            response['nextToken'] = str(start + maxResults)
+
+        return response
+
+    def shutdown(self, wait=True):
+        """Stop running new job attempts
+
+        Parameters
+        ----------
+        wait : bool
+            If True, wait for running attempts to finish
+            Default: True
+        """
+        with self._lock:
+            for job in self._jobs.values():
+                if (job['status'] in ['SUBMITTED', 'PENDING', 'RUNNABLE']
+                        and 'size' not in job.get('arrayProperties', {})):
+                    self._set_status(job, 'FAILED')
+                    job['statusReason'] = 'Emulator shut down'
+
+        self._executor.shutdown(wait=wait)
+
+
+class AwsEmulator(object):
+    """Context manager that runs cloudknot against emulated Batch and S3
+
+    Inside the context, the 'batch', 's3' and 'iam' entries of
+    `cloudknot.aws.clients` are emulated clients, also after calls to
+    `refresh_clients`, `set_region` or `set_profile`. All other clients are
+    untouched.
+
+    Examples
+    --------
+    >>> with AwsEmulator(concurrency=8) as emulator:  # doctest: +SKIP
+    ...     emulator.batch.create_job_queue(jobQueueName='q', priority=1)
+    ...     job_queue = cloudknot.aws.JobQueue(name='q')
+    """
+    def __init__(self, root_dir=None, concurrency=4, latency=0,
+                 max_call_rate=None, runner=None, max_array_size=10000,
+                 scheduling_delay=0.5):
+        """Initialize the emulator
+
+        Parameters
+        ----------
+        root_dir : string
+            Directory holding the emulated S3 buckets. If None, use a new
+            temporary directory that is removed when the context exits.
+            Default: None
+
+        concurrency : int
+            Maximum number of job attempts running at once
+            Default: 4
+
+        latency : float or dict
+            Seconds to sleep at the start of each emulated API call. If a
+            dict, map from operation name (e.g. 'describe_jobs') to seconds.
+            Default: 0
+
+        max_call_rate : float or dict
+            Maximum sustained calls per second of each emulated operation.
+            Excess calls are delayed and counted as throttled. If a dict,
+            map from operation name to rate. If None, nothing is throttled.
+            Default: None
+
+        runner : callable
+            Called as runner(image, command, environment) to run one attempt
+            of a job, returning its exit code. If None, run the job's Docker
+            image on the local Docker daemon.
+            Default: None
+
+        max_array_size : int
+            Maximum size of an emulated array job. If None, unlimited.
+            Default: 10000
+
+        scheduling_delay : float
+            Minimum seconds between submitting a job and starting it
+            Default: 0.5
+        """
+        self._owns_root_dir = root_dir is None
+        root_dir = (root_dir if root_dir is not None
+                    else tempfile.mkdtemp(prefix='cloudknot-emulator-'))
+        os.chmod(root_dir, 0o777)
+
+        self.s3 = EmulatedS3Client(root_dir=root_dir, latency=latency,
+                                   max_call_rate=max_call_rate)
+        self.batch = EmulatedBatchClient(
+            s3=self.s3, concurrency=concurrency, latency=latency,
+            max_call_rate=max_call_rate, runner=runner,
+            max_array_size=max_array_size, scheduling_delay=scheduling_delay
+        )
+        self.iam = EmulatedIamClient(latency=latency,
+                                     max_call_rate=max_call_rate)
+        self._saved_clients = {}
+
+    def __enter__(self):
+        emulated = {'batch': self.batch, 's3': self.s3, 'iam': self.iam}
+        with base_classes.rlock:
+            self._saved_clients = {k: base_classes.clients[k]
+                                   for k in emulated}
+            base_classes.client_overrides.update(emulated)
+            base_classes.clients.update(emulated)
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with base_classes.rlock:
+            for name in self._saved_clients:
+                base_classes.client_overrides.pop(name, None)
+            base_classes.clients.update(self._saved_clients)
+
+        self.batch.shutdown(wait=True)
+
+        if self._owns_root_dir:
+            shutil.rmtree(self.s3.root_dir, ignore_errors=True)
@@ -0,0 +1,548 @@
+"""The local module runs cloudknot jobs on a local process pool
+
+LocalKnot mirrors the `Knot.map` API without using AWS at all. Each job
+follows the same contract as the cloudknot container script: the input is
+pickled with cloudpickle into a job directory, each child process loads the
+input, calls the function on its element, and pickles the output to a key
+laid out exactly as in S3. Results are then collected by the same BatchJob
+code paths used for AWS Batch jobs.
+
+This is intended for development and profiling of serialization, chunking
+and result assembly, not as a replacement for AWS Batch.
+"""
+from __future__ import absolute_import, division, print_function
+
+import cloudpickle
+import errno
+import logging
+import os
+import pickle
+import shutil
+import six
+import tempfile
+import uuid
+from collections import Iterable, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from . import aws
+
+__all__ = ["LocalBatchJob", "LocalKnot"]
+
+mod_logger = logging.getLogger(__name__)
+
+# Stand-in for the JobDefinition attributes used to locate job files
+_LocalJobDefinition = namedtuple('_LocalJobDefinition',
+                                 ['name', 'output_bucket', 'retries'])
+
+
+def _key_path(root_dir, key):
+    """Return the local path of the object with S3-style key `key`"""
+    return os.path.join(root_dir, *key.split('/'))
+
+
+def _write_object(root_dir, key, body):
+    """Write `body` to the local object with S3-style key `key`"""
+    path = _key_path(root_dir, key)
+    try:
+        os.makedirs(os.path.dirname(path))
+    except OSError as e:
+        pre_existing = (e.errno == errno.EEXIST
+                        and os.path.isdir(os.path.dirname(path)))
+        if not pre_existing:
+            raise e
+
+    with open(path, 'wb') as f:
+        f.write(body)
+
+
+def _run_child(root_dir, job_key, array_index, array_job, starmap,
+               environment_variables):
+    """Run one child of a local job in a worker process
+
+    This mirrors the cloudknot container script: load the pickled function
+    and input, select this child's element, call the function and pickle
+    any non-None output to the child's output key.
+
+    Parameters
+    ----------
+    root_dir : string
+        Root directory of the local bucket
+
+    job_key : string
+        Key prefix of the job, i.e. 'cloudknot.jobs/<name>/<job_id>'
+
+    array_index : int
+        Index of this child in the job's input
+
+    array_job : bool
+        If True, select element `array_index` of the input
+
+    starmap : bool
+        If True, unpack the input element into positional arguments
+
+    environment_variables : list of dict
+        Environment variables to set while the function runs
+    """
+    with open(_key_path(root_dir, job_key + '/function.pickle'), 'rb') as f:
+        func = pickle.load(f)
+
+    with open(_key_path(root_dir, job_key + '/input.pickle'), 'rb') as f:
+        input_ = pickle.load(f)
+
+    if array_job:
+        input_ = input_[array_index]
+
+    old_environ = dict(os.environ)
+    for env in environment_variables or []:
+        os.environ[env['name']] = env['value']
+
+    try:
+        result = func(*input_) if starmap else func(input_)
+    finally:
+        os.environ.clear()
+        os.environ.update(old_environ)
+
+    # Only pickle output if it is not None
+    if result is not None:
+        key = '/'.join([job_key, str(array_index), '000', 'output.pickle'])
+        _write_object(root_dir, key, cloudpickle.dumps(result))
+
+
+# noinspection PyPropertyAccess,PyAttributeOutsideInit
+class LocalBatchJob(aws.BatchJob):
+    """Batch job that runs on a local process pool instead of AWS Batch"""
+    _poll_interval = 0.05
+
+    def __init__(self, name, func, input_, executor, root_dir, starmap=False,
+                 environment_variables=None, array_job=True,
+                 result_cache_dir=None):
+        """Submit a local job
+
+        Parameters
+        ----------
+        name : string
+            Name of the job
+
+        func : function
+            The function to call on each element of the input
+
+        input_ :
+            The input to be pickled and passed to `func`
+
+        executor : concurrent.futures.ProcessPoolExecutor
+            The process pool on which to run the job
+
+        root_dir : string
+            Root directory of the local bucket holding job input and output
+
+        starmap : bool
+            If True, assume input is already grouped in
+            tuples from a single iterable.
+            Default: False
+
+        environment_variables : list of dict
+            list of key/value pairs representing environment variables
+            set while `func` runs
+            Default: None
+
+        array_job : bool
+            If True, this job has one child for each element of `input_`.
+            Default: True
+
+        result_cache_dir : string
+            If provided, collected results are also saved in a subdirectory
+            of this directory, named for this job's jobID.
+            Default: None
+        """
+        if environment_variables:
+            if not all(isinstance(s, dict) for s in environment_variables):
+                raise aws.CloudknotInputError('env_vars must be a sequence of '
+                                              'dicts')
+            if not all(set(d.keys()) == {'name', 'value'}
+                       for d in environment_variables):
+                raise aws.CloudknotInputError('each dict in env_vars must '
+                                              'have keys "name" and "value"')
+
+        # Do not call the BatchJob or NamedObject constructors, since they
+        # require cloudknot to be configured for AWS
+        self._name = str(name)
+        self._clobbered = False
+        self._region = None
+        self._profile = None
+
+        self._job_queue = None
+        self._job_queue_arn = None
+        self._job_definition = _LocalJobDefinition(
+            name=self._name, output_bucket=root_dir, retries=0
+        )
+        self._job_definition_arn = None
+        self._environment_variables = environment_variables or None
+        self._input = input_
+        self._starmap = starmap
+        self._array_job = array_job
+        self._input_job_id = None
+        self._input_indices = None
+        self._init_state(result_cache_dir=result_cache_dir)
+
+        self._func = func
+        self._executor = executor
+        self._root_dir = root_dir
+        self._job_id = self._create()
+
+    def _create(self):
+        """Pickle this job's function and input and submit its children
+
+        Returns
+        -------
+        job_id : string
+            A unique ID for this job
+        """
+        job_id = str(uuid.uuid4())
+        job_key = self._job_key(job_id)
+
+        with self._timings.span('serialize'):
+            pickled_func = cloudpickle.dumps(self._func)
+            pickled_input = cloudpickle.dumps(self.input)
+
+        with self._timings.span('upload'):
+            _write_object(self._root_dir,
+                          self._job_key(job_id, 'function.pickle'),
+                          pickled_func)
+            _write_object(self._root_dir,
+                          self._job_key(job_id, 'input.pickle'),
+                          pickled_input)
+
+        num_children = len(self.input) if self.array_job else 1
+        with self._timings.span('submit'):
+            self._child_futures = [
+                self._executor.submit(
+                    _run_child, self._root_dir, job_key, idx, self.array_job,
+                    self.starmap, self.environment_variables
+                )
+                for idx in range(num_children)
+            ]
+
+        mod_logger.info(
+            'Submitted local job {name:s} with jobID '
+            '{job_id:s}'.format(name=self.name, job_id=job_id)
+        )
+
+        return job_id
+
+    def _get_object(self, key):
+        """Return the contents of a local object, or None if it is missing"""
+        path = _key_path(self._root_dir, key)
+        if not os.path.isfile(path):
+            return None
+
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def check_profile_and_region(self):
+        """Local jobs have no profile or region to check"""
+        pass
+
+    @staticmethod
+    def _child_status(future):
+        """Return the AWS Batch status equivalent of a child's future"""
+        if future.cancelled():
+            return 'FAILED'
+        elif future.done():
+            return 'FAILED' if future.exception() else 'SUCCEEDED'
+        elif future.running():
+            return 'RUNNING'
+        else:
+            return 'RUNNABLE'
+
+    @property
+    def status(self):
+        """Return this job's status in the form used by AWS Batch
+
+        Returns
+        -------
+        status : dict
+            dictionary with keys: {status, statusReason, attempts}, and
+            arrayProperties for array jobs
+        """
+        if self.clobbered:
+            raise aws.ResourceClobberedException(
+                'This batch job has already been clobbered.',
+                self.job_id
+            )
+
+        child_statuses = [self._child_status(f) for f in self._child_futures]
+        summary = {s: child_statuses.count(s) for s in aws.JOB_STATUSES}
+
+        if summary['SUCCEEDED'] + summary['FAILED'] < len(child_statuses):
+            job_status = 'RUNNING' if summary['RUNNING'] else 'RUNNABLE'
+        elif summary['FAILED']:
+            job_status = 'FAILED'
+        else:
+            job_status = 'SUCCEEDED'
+
+        reason = None
+        if job_status == 'FAILED':
+            errors = [f.exception() for f in self._child_futures
+                      if f.done() and not f.cancelled() and f.exception()]
+            if errors:
+                reason = repr(errors[0])
+
+        status = {'status': job_status, 'statusReason': reason,
+                  'attempts': []}
+
+        if self.array_job:
+            status['arrayProperties'] = {'size': len(child_statuses),
+                                         'statusSummary': summary}
+
+        return status
+
+    def _final_statuses(self):
+        """Return the final status of each finished child of this job"""
+        statuses = {}
+        for idx, future in enumerate(self._child_futures):
+            status = self._child_status(future)
+            if status in ['SUCCEEDED', 'FAILED']:
+                statuses[idx] = status
+
+        return statuses
+
+    def resubmit_failed(self, name=None):
+        """Submit a new local job covering only the failed children
+
+        Parameters
+        ----------
+        name : string
+            Name of the new job. Default: this job's name + '-resubmit'
+
+        Returns
+        -------
+        LocalBatchJob
+            The new job, or None if no children have failed
+        """
+        if not self.array_job:
+            raise aws.CloudknotInputError('resubmit_failed is only '
+                                          'available for array jobs.')
+
+        failed = [idx for idx in self.failed_indices()
+                  if idx not in self._substitutes]
+        if not failed:
+            return None
+
+        job = LocalBatchJob(
+            name=name if name else self.name + '-resubmit',
+            func=self._func,
+            input_=[self.input[i] for i in failed],
+            executor=self._executor,
+            root_dir=self._root_dir,
+            starmap=self.starmap,
+            environment_variables=self.environment_variables,
+            array_job=True,
+            result_cache_dir=self.result_cache_dir
+        )
+
+        for sub_idx, idx in enumerate(failed):
+            self._substitutes[idx] = (job, sub_idx)
+
+        self._substitutes_changed()
+        return job
+
+    def terminate(self, reason):
+        """Cancel children of this job that have not yet started
+
+        Parameters
+        ----------
+        reason : string
+            Reason for termination, written to the log
+        """
+        for future in self._child_futures:
+            future.cancel()
+
+        mod_logger.info('Cancelled local job {id:s} with reason '
+                        '{r:s}'.format(id=self.job_id, r=reason))
+
+    def clobber(self):
+        """Cancel this job and delete its input and output"""
+        if self.clobbered:
+            return
+
+        self.terminate(reason='Clobbered')
+        shutil.rmtree(_key_path(self._root_dir, self._job_key(self.job_id)),
+                      ignore_errors=True)
+        self._clobbered = True
+
+
+class LocalKnot(object):
+    """Run a function on a local process pool with the Knot.map interface"""
+    def __init__(self, func, name='local', max_workers=None, root_dir=None):
+        """Initialize a LocalKnot instance
+
+        Parameters
+        ----------
+        func : function
+            The function to run. Unlike Knot, it does not need to be
+            importable from a Docker image.
+
+        name : string
+            Name of the knot, used to name its jobs
+            Default: 'local'
+
+        max_workers : int
+            Maximum number of worker processes. If None, use the number
+            of CPUs on this machine.
+            Default: None
+
+        root_dir : string
+            Directory in which job input and output are stored. If None,
+            use a new temporary directory that is removed on `clobber`.
+            Default: None
+        """
+        if not callable(func):
+            raise aws.CloudknotInputError('func must be a function.')
+
+        if not isinstance(name, six.string_types):
+            raise aws.CloudknotInputError('name must be a string.')
+
+        self._func = func
+        self._name = name
+        self._owns_root_dir = root_dir is None
+        self._root_dir = (root_dir if root_dir is not None
+                          else tempfile.mkdtemp(prefix='cloudknot-local-'))
+        self._executor = ProcessPoolExecutor(max_workers=max_workers)
+        self._jobs = []
+        self._clobbered = False
+
+    @property
+    def name(self):
+        """The name of this knot"""
+        return self._name
+
+    @property
+    def root_dir(self):
+        """Directory in which job input and output are stored"""
+        return self._root_dir
+
+    @property
+    def clobbered(self):
+        """Has this instance been previously clobbered"""
+        return self._clobbered
+
+    @property
+    def jobs(self):
+        """List of LocalBatchJob instances that this knot has launched"""
+        return self._jobs
+
+    @property
+    def job_ids(self):
+        """List of job IDs that this knot has launched"""
+        return [job.job_id for job in self._jobs]
+
+    def map(self, iterdata, env_vars=None, max_threads=64,
+            starmap=False, job_type='array'):
+        """Run the function on each element of `iterdata` in local processes
+
+        Parameters
+        ----------
+        iterdata :
+            An iteratable of input data
+
+        env_vars : sequence of dicts
+            Additional environment variables set while the function runs.
+            Each dict must have only 'name' and 'value' keys.
+            Default: None
+
+        max_threads : int
+            Maximum number of threads used to wait for results.
+            Default: 64
+
+        starmap : bool
+            If True, assume argument parameters are already grouped in
+            tuples from a single iterable.
+            Default: False
+
+        job_type : string, 'array' or 'independent'
+            If 'array', submit one job with a child for each input element
+            and return one future for the entire results list. If
+            'independent', submit one job for each input element and return
+            a list of futures.
+            Default: 'array'
+
+        Returns
+        -------
+        map : future or list of futures
+            If `job_type` is 'array', a future for the list of results.
+            If `job_type` is 'independent', list of futures for each job.
+            Each future has a `timings` attribute holding the JobTimings
+            of its job.
+        """
+        if job_type not in ['array', 'independent']:
+            raise ValueError("`job_type` must be 'array' or 'independent'.")
+
+        if self.clobbered:
+            raise aws.ResourceClobberedException(
+                'This LocalKnot has already been clobbered.',
+                self.name
+            )
+
+        if not isinstance(iterdata, Iterable):
+            raise TypeError('iterdata must be an iterable.')
+
+        def submit(input_, array_job):
+            job = LocalBatchJob(
+                name='{n:s}-{i:d}'.format(n=self.name, i=len(self._jobs)),
+                func=self._func,
+                input_=input_,
+                executor=self._executor,
+                root_dir=self._root_dir,
+                starmap=starmap,
+                environment_variables=env_vars,
+                array_job=array_job
+            )
+            self._jobs.append(job)
+            return job
+
+        if job_type == 'independent':
+            these_jobs = [submit(input_, False) for input_ in iterdata]
+        else:
+            these_jobs = [submit(list(iterdata), True)]
+
+        if not these_jobs:
+            return []
+
+        executor = ThreadPoolExecutor(
+            max(min(len(these_jobs), max_threads), 2)
+        )
+
+        futures = [executor.submit(lambda j: j.result(), jb)
+                   for jb in these_jobs]
+
+        for future, jb in zip(futures, these_jobs):
+            future.timings = jb.timings
+
+        # Shutdown the executor but do not wait to return the futures
+        executor.shutdown(wait=False)
+
+        if job_type == 'independent':
+            return futures
+        else:
+            return futures[0]
+
+    def stats(self):
+        """Return the combined JobTimings of all jobs in `jobs`"""
+        return aws.JobTimings.merge(jb.timings for jb in self._jobs)
+
+    def clobber(self):
+        """Cancel all jobs, shut down the process pool and delete job files"""
+        if self.clobbered:
+            return
+
+        for job in self._jobs:
+            job.clobber()
+
+        self._executor.shutdown(wait=True)
+
+        if self._owns_root_dir:
+            shutil.rmtree(self._root_dir, ignore_errors=True)
+
+        self._clobbered = True
+
+        mod_logger.info('Clobbered LocalKnot {name:s}'.format(name=self.name))
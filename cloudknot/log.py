@@ -0,0 +1,296 @@
+"""Non-blocking, per-process file logging for cloudknot
+
+Log records are put on an in-memory queue by the calling thread and written
+to disk by a background listener thread, so that job submission and polling
+loops never wait on disk I/O. Each process writes to its own log file,
+~/.cloudknot/logs/cloudknot-<pid>.log by default, which is rotated when it
+reaches a maximum size. Processes forked from a process that has already
+configured logging, e.g. the workers of a LocalKnot, switch to their own
+file and listener on their first log record.
+
+On python 2, which lacks logging.handlers.QueueHandler, records are written
+to the rotating file directly.
+"""
+from __future__ import absolute_import, division, print_function
+
+import atexit
+import copy
+import errno
+import json
+import logging
+import logging.handlers
+import multiprocessing.util
+import os
+import threading
+import time
+from datetime import datetime, timedelta, tzinfo
+
+from six.moves import queue
+
+__all__ = ["JsonFormatter", "configure_logging", "get_log_path"]
+
+mod_logger = logging.getLogger(__name__)
+
+
+class _UTC(tzinfo):
+    """UTC time zone, for python 2, which lacks datetime.timezone"""
+    def utcoffset(self, dt):
+        return timedelta(0)
+
+    def tzname(self, dt):
+        return 'UTC'
+
+    def dst(self, dt):
+        return timedelta(0)
+
+
+try:
+    from datetime import timezone
+    _utc = timezone.utc
+except ImportError:  # pragma: nocover
+    _utc = _UTC()
+
+
+#: The record attributes that are not copied into the JSON "extra" field
+_STANDARD_ATTRS = frozenset(
+    logging.LogRecord('', 0, '', 0, '', (), None).__dict__.keys()
+) | frozenset(['message', 'asctime'])
+
+
+# noinspection PyPropertyAccess,PyAttributeOutsideInit
+class JsonFormatter(logging.Formatter):
+    """Format log records as single-line JSON objects
+
+    Each line has the keys time (ISO 8601, UTC, with an explicit offset),
+    level, logger, process, thread and message, plus exception if the record
+    carries exception info and extra for any attributes passed with the
+    `extra` keyword argument.
+    """
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created,
+                                           tz=_utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'process': record.process,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+
+        extra = {k: v for k, v in record.__dict__.items()
+                 if k not in _STANDARD_ATTRS}
+        if extra:
+            entry['extra'] = extra
+
+        return json.dumps(entry, default=str)
+
+
+def _file_handler(path, max_bytes, backup_count, json_format):
+    """Return a rotating file handler that opens its file on first use"""
+    handler = logging.handlers.RotatingFileHandler(
+        path, maxBytes=max_bytes, backupCount=backup_count, delay=True
+    )
+    handler.setLevel(logging.DEBUG)
+
+    if json_format:
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(
+            '%(asctime)s - %(process)d - %(name)s - %(levelname)s - '
+            '%(message)s'
+        ))
+
+    return handler
+
+
+_QueueHandler = getattr(logging.handlers, 'QueueHandler', None)
+
+
+if _QueueHandler is not None:
+    # noinspection PyPropertyAccess,PyAttributeOutsideInit
+    class _ProcessQueueHandler(_QueueHandler):
+        """QueueHandler with one queue, listener and log file per process
+
+        Parameters
+        ----------
+        handler_factory : callable
+            Called with a process ID, returns the handler to which that
+            process's listener writes
+        """
+        def __init__(self, handler_factory):
+            self._handler_factory = handler_factory
+            self._pid = None
+            self._listener = None
+            self._start_lock = threading.Lock()
+            _QueueHandler.__init__(self, queue.Queue(-1))
+            self._start()
+
+        def _start(self):
+            """Start a listener thread that writes this process's records"""
+            forked = self._pid is not None
+            self.queue = queue.Queue(-1)
+            self._listener = logging.handlers.QueueListener(
+                self.queue, self._handler_factory(os.getpid()),
+                respect_handler_level=True
+            )
+            self._listener.start()
+            self._pid = os.getpid()
+
+            if forked:
+                # multiprocessing workers exit without running atexit
+                # handlers, but do run its finalizers
+                multiprocessing.util.Finalize(self, self.close,
+                                              exitpriority=100)
+
+        def prepare(self, record):
+            """Merge the record's arguments, keeping its traceback apart
+
+            QueueHandler.prepare merges the traceback into the message,
+            which would hide it from the JsonFormatter's exception key.
+            """
+            record = copy.copy(record)
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                record.exc_text = logging.Formatter().formatException(
+                    record.exc_info
+                )
+            record.exc_info = None
+            return record
+
+        def emit(self, record):
+            if self._pid != os.getpid():
+                # This is a forked process, whose copy of the listener
+                # thread does not exist
+                with self._start_lock:
+                    if self._pid != os.getpid():
+                        self._start()
+
+            _QueueHandler.emit(self, record)
+
+        def close(self):
+            """Write out any queued records, then close the handler"""
+            if self._listener is not None and self._pid == os.getpid():
+                self._listener.stop()
+                for handler in self._listener.handlers:
+                    handler.close()
+                self._listener = None
+
+            _QueueHandler.close(self)
+
+
+def _prune_logs(log_dir, retention_days):
+    """Delete per-process log files not modified in `retention_days`"""
+    cutoff = time.time() - retention_days * 86400
+    for name in os.listdir(log_dir):
+        path = os.path.join(log_dir, name)
+        if name.startswith('cloudknot-') and '.log' in name:
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                # Another process may have removed it first
+                pass
+
+
+_log_dir = None
+
+
+def get_log_path(pid=None):
+    """Return the path of the log file of a cloudknot process
+
+    Parameters
+    ----------
+    pid : int
+        The process ID.
+        Default: the current process
+
+    Returns
+    -------
+    path : string or None
+        The log file path, or None if logging has not been configured
+    """
+    if _log_dir is None:
+        return None
+
+    pid = os.getpid() if pid is None else pid
+    return os.path.join(_log_dir, 'cloudknot-{pid:d}.log'.format(pid=pid))
+
+
+def configure_logging(logger, log_dir=None, max_bytes=10 * 2 ** 20,
+                      backup_count=3, json_format=True, retention_days=7):
+    """Attach a non-blocking, rotating, per-process file handler to a logger
+
+    Parameters
+    ----------
+    logger : logging.Logger
+        The logger to which to attach the handler, usually the top-level
+        cloudknot logger
+
+    log_dir : string
+        Directory of the log files.
+        Default: the CLOUDKNOT_LOG_DIR environment variable if set,
+        otherwise ~/.cloudknot/logs
+
+    max_bytes : int
+        Size in bytes at which a log file is rotated.
+        Default: 10 MiB
+
+    backup_count : int
+        Number of rotated files kept for each process.
+        Default: 3
+
+    json_format : bool
+        If True, write one JSON object per record. Otherwise, write plain
+        text lines.
+        Default: True
+
+    retention_days : float
+        Log files of any process that have not been modified for this many
+        days are deleted.
+        Default: 7
+
+    Returns
+    -------
+    handler : logging.Handler
+        The handler that was attached to `logger`
+    """
+    global _log_dir
+
+    if log_dir is None:
+        log_dir = os.environ.get('CLOUDKNOT_LOG_DIR', os.path.join(
+            os.path.expanduser('~'), '.cloudknot', 'logs'
+        ))
+
+    try:
+        os.makedirs(log_dir)
+    except OSError as e:
+        pre_existing = (e.errno == errno.EEXIST and os.path.isdir(log_dir))
+        if not pre_existing:
+            raise e
+
+    _log_dir = log_dir
+    _prune_logs(log_dir, retention_days)
+
+    def handler_factory(pid):
+        return _file_handler(get_log_path(pid), max_bytes, backup_count,
+                             json_format)
+
+    if _QueueHandler is not None:
+        handler = _ProcessQueueHandler(handler_factory)
+    else:  # pragma: nocover
+        # python 2.7 compatibility
+        handler = handler_factory(os.getpid())
+
+    handler.setLevel(logging.DEBUG)
+    logger.addHandler(handler)
+
+    # Write out queued records when the interpreter exits
+    atexit.register(handler.close)
+
+    return handler
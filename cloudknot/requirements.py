@@ -0,0 +1,183 @@
+"""Resolve the pip requirements of a script's imports, with a local cache
+
+pipreqs finds the names imported by a script without network access, but
+looks up the distribution and version of each name on PyPI. This module
+resolves each import name, in order of preference,
+    - from the distributions installed in the current environment,
+    - from a persistent cache of earlier PyPI lookups, kept next to the
+      cloudknot config file, e.g. ~/.aws/cloudknot.imports,
+    - from PyPI, unless cloudknot is offline. Set the CLOUDKNOT_OFFLINE
+      environment variable to 1 to never query PyPI.
+"""
+from __future__ import absolute_import, division, print_function
+
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from pipreqs import pipreqs
+
+from .config import get_config_file, rlock
+
+__all__ = ["get_imports_cache_file", "is_offline", "resolve_imports",
+           "clear_imports_cache"]
+
+mod_logger = logging.getLogger(__name__)
+
+#: Seconds after which a cached PyPI lookup is repeated when online
+PYPI_CACHE_TTL = 30 * 24 * 3600
+
+
+def get_imports_cache_file():
+    """Get the path to the import resolution cache
+
+    The cache sits next to the cloudknot config file, e.g.
+    ~/.aws/cloudknot.imports
+
+    Returns
+    -------
+    cache_file : string
+        Path to the JSON cache file
+    """
+    return get_config_file() + '.imports'
+
+
+def is_offline():
+    """Return True if the CLOUDKNOT_OFFLINE environment variable is set"""
+    return os.environ.get('CLOUDKNOT_OFFLINE', '0').lower() \
+        not in ('', '0', 'false', 'no')
+
+
+def _installed_distributions():
+    """Return a dict mapping import names to installed (name, version)"""
+    installed = {}
+
+    try:
+        from importlib import metadata
+    except ImportError:  # pragma: nocover
+        # python 2.7 and <3.8 compatibility
+        metadata = None
+
+    if metadata is not None:
+        for dist in metadata.distributions():
+            name = dist.metadata['Name']
+            if not name:
+                continue
+            top_level = (dist.read_text('top_level.txt') or '').split()
+            for import_name in top_level + [name.replace('-', '_')]:
+                installed.setdefault(import_name, (name, dist.version))
+    else:  # pragma: nocover
+        import pkg_resources
+        for dist in pkg_resources.working_set:
+            top_level = []
+            if dist.has_metadata('top_level.txt'):
+                top_level = list(dist.get_metadata_lines('top_level.txt'))
+            name = dist.project_name
+            for import_name in top_level + [name.replace('-', '_')]:
+                installed.setdefault(import_name, (name, dist.version))
+
+    return installed
+
+
+def _read_cache(cache_file):
+    """Return the cached PyPI lookups, or an empty dict"""
+    try:
+        with open(cache_file) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _write_cache(cache_file, cache):
+    """Write the cache atomically so concurrent readers never see a part"""
+    tmp_file = '{f:s}.{pid:d}.tmp'.format(f=cache_file, pid=os.getpid())
+    with open(tmp_file, 'w') as f:
+        json.dump(cache, f, indent=1, sort_keys=True)
+
+    try:
+        os.replace(tmp_file, cache_file)
+    except AttributeError:  # pragma: nocover
+        # python 2.7 compatibility
+        os.rename(tmp_file, cache_file)
+
+
+def resolve_imports(import_names, offline=None):
+    """Return the pip requirement of each resolvable import name
+
+    Parameters
+    ----------
+    import_names : sequence of strings
+        Names of imported modules, e.g. from pipreqs.get_all_imports
+
+    offline : bool
+        If True, never query PyPI. Names that are neither installed nor
+        cached are left unresolved.
+        Default: the value of is_offline()
+
+    Returns
+    -------
+    pip_imports : OrderedDict
+        Maps each resolved import name to a dict with keys name and version,
+        the distribution name and version in the format of
+        pipreqs.get_imports_info
+    """
+    offline = is_offline() if offline is None else offline
+    installed = _installed_distributions()
+    cache_file = get_imports_cache_file()
+
+    with rlock:
+        cache = _read_cache(cache_file)
+
+    now = time.time()
+    resolved = {}
+    misses = []
+    for import_name in import_names:
+        cached = cache.get(import_name)
+        if import_name in installed:
+            name, version = installed[import_name]
+            resolved[import_name] = {'name': name, 'version': version}
+        elif cached is not None and (
+                offline or now - cached['time'] < PYPI_CACHE_TTL
+        ):
+            if cached['name'] is not None:
+                resolved[import_name] = {'name': cached['name'],
+                                         'version': cached['version']}
+        else:
+            misses.append(import_name)
+
+    if misses and offline:
+        mod_logger.info('Offline, not looking up {names!s} on '
+                        'PyPI'.format(names=misses))
+    elif misses:
+        mod_logger.info('Looking up {names!s} on PyPI'.format(names=misses))
+        found = {item['name']: item
+                 for item in pipreqs.get_imports_info(misses)}
+
+        with rlock:
+            # Re-read, another process may have added entries meanwhile
+            cache = _read_cache(cache_file)
+            for import_name in misses:
+                item = found.get(import_name)
+                if item is not None:
+                    resolved[import_name] = {'name': item['name'],
+                                             'version': item['version']}
+
+                # Remember names that are not on PyPI too
+                cache[import_name] = {
+                    'name': item['name'] if item else None,
+                    'version': item['version'] if item else None,
+                    'time': now,
+                }
+            _write_cache(cache_file, cache)
+
+    return OrderedDict((n, resolved[n]) for n in import_names if n in resolved)
+
+
+def clear_imports_cache():
+    """Delete the import resolution cache"""
+    with rlock:
+        try:
+            os.remove(get_imports_cache_file())
+        except OSError:
+            pass
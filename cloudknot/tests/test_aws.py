@@ -23,8 +23,11 @@ The tests for each resource all follow the same pattern:
 """
 from __future__ import absolute_import, division, print_function
 
+import base64
+import botocore.stub
 import cloudknot as ck
 import configparser
+import datetime
 import errno
 import json
 import os
@@ -32,8 +35,12 @@ import os.path as op
 import pytest
 import shutil
 import six
+import string
+import subprocess
+import sys
 import tempfile
 import tenacity
+import time
 import uuid
 
 UNIT_TEST_PREFIX = 'cloudknot-unit-test'
@@ -2349,8 +2356,23 @@ def test_JobQueue(pars):
         with pytest.raises(ck.aws.CloudknotInputError):
             jq.get_jobs(status='INVALID')
 
+        with pytest.raises(ck.aws.CloudknotInputError):
+            jq.get_jobs(status=['RUNNING', 'INVALID'])
+
+        with pytest.raises(ck.aws.CloudknotInputError):
+            list(jq.iter_jobs(page_size=0))
+
         assert jq.get_jobs() == []
         assert jq.get_jobs(status='STARTING') == []
+        assert jq.get_jobs(status=['STARTING', 'RUNNING']) == []
+        assert list(jq.iter_jobs()) == []
+
+        table = jq.get_jobs_table()
+        assert list(table.keys()) == [
+            'job_id', 'job_name', 'status', 'status_reason', 'array_index',
+            'created_at', 'started_at', 'stopped_at'
+        ]
+        assert all(v == [] for v in table.values())
 
         # Assert that clobber raises RegionException if we change the region
         old_region = ck.get_region()
@@ -2722,6 +2744,16 @@ def test_BatchJob(pars):
                 environment_variables=[42]
             )
 
+        # Assert ck.aws.CloudknotInputError on input_job_id without indices
+        with pytest.raises(ck.aws.CloudknotInputError):
+            ck.aws.BatchJob(
+                name=get_testing_name(),
+                input_=[42, 43],
+                job_queue=job_queue,
+                job_definition=job_def,
+                input_job_id='some-job-id'
+            )
+
         job_queue.clobber()
         compute_environment.clobber()
         job_def.clobber()
@@ -2736,3 +2768,598 @@ def test_BatchJob(pars):
             job_def.clobber()
 
         raise e
+
+
+def _emulated_job_definition(emu, name, retries=1):
+    """Register an emulated job definition and job queue named `name`"""
+    bucket = ck.get_s3_params().bucket
+    response = emu.batch.register_job_definition(
+        jobDefinitionName=name + '-jd', type='container',
+        containerProperties={
+            'image': name + '-image', 'vcpus': 1, 'memory': 100,
+            'user': 'cloudknot-user', 'jobRoleArn': name + '-role',
+            'environment': [
+                {'name': 'CLOUDKNOT_JOBS_S3_BUCKET', 'value': bucket},
+                {'name': 'CLOUDKNOT_S3_JOBDEF_KEY', 'value': name + '-jd'},
+            ]
+        },
+        retryStrategy={'attempts': retries}
+    )
+    emu.batch.create_job_queue(jobQueueName=name + '-jq', priority=1)
+
+    return (ck.aws.JobDefinition(arn=response['jobDefinitionArn']),
+            ck.aws.JobQueue(name=name + '-jq'))
+
+
+def _script_runner(script_dir, func_source, func_name, environment=None):
+    """Return an emulator runner that runs the container script locally
+
+    The rendered container script for `func_source` is run in a subprocess
+    instead of a Docker container, with `environment` added to the
+    container environment.
+    """
+    with open(op.join(ck.__path__[0], 'templates', 'script.template')) as f:
+        template = string.Template(f.read())
+
+    script_path = op.join(script_dir, func_name + '.py')
+    with open(script_path, 'w') as f:
+        f.write(template.substitute(func_source=func_source,
+                                    func_name=func_name))
+
+    def runner(image, command, container_environment):
+        env = dict(os.environ)
+        env.update(container_environment)
+        env.update(environment or {})
+        return subprocess.call([sys.executable, ck.emulator.LOCAL_S3_SHIM,
+                                script_path] + command, env=env)
+
+    return runner
+
+
+def test_BatchJob_partial_results(monkeypatch):
+    monkeypatch.setattr(ck.aws.BatchJob, '_poll_interval', 0.05)
+
+    # Negative inputs fail while the flag file exists
+    script_dir = tempfile.mkdtemp()
+    fail_flag = op.join(script_dir, 'fail')
+    open(fail_flag, 'w').close()
+    runner = _script_runner(
+        script_dir,
+        'def flaky_func(x):\n'
+        '    import os\n'
+        '    if x < 0 and os.path.exists(os.environ["FAIL_FLAG"]):\n'
+        '        raise ValueError("x must be non-negative")\n'
+        '    return 10 * abs(x)\n',
+        'flaky_func', environment={'FAIL_FLAG': fail_flag}
+    )
+
+    try:
+        with ck.emulator.AwsEmulator(concurrency=2, runner=runner) as emu:
+            jd, jq = _emulated_job_definition(emu, 'partial')
+            job = ck.aws.BatchJob(name='partial-job', job_queue=jq,
+                                  job_definition=jd, input_=[1, -2, 3, -4])
+
+            # The FAILED array parent is done, so this does not hang
+            partial = job.result(partial=True)
+            assert partial.results == [10, None, 30, None]
+            assert sorted(partial.errors.keys()) == [1, 3]
+            assert job.failed_indices() == [1, 3]
+            with pytest.raises(ck.aws.BatchJobFailedError):
+                job.result()
+
+            # The resubmitted job reads the original input and only covers
+            # the failed children
+            os.remove(fail_flag)
+            resubmitted = job.resubmit_failed()
+            assert resubmitted.input_job_id == job.job_id
+            assert resubmitted.input_indices == [1, 3]
+
+            assert job.result() == [10, 20, 30, 40]
+            assert job.failed_indices() == []
+            assert job.resubmit_failed() is None
+            assert resubmitted.result() == [20, 40]
+
+            with pytest.raises(ck.aws.CloudknotInputError):
+                ck.aws.BatchJob(name='partial-single', job_queue=jq,
+                                job_definition=jd, input_=1,
+                                array_job=False).resubmit_failed()
+    finally:
+        shutil.rmtree(script_dir)
+
+
+def test_BatchJob_stragglers(monkeypatch):
+    monkeypatch.setattr(ck.aws.BatchJob, '_poll_interval', 0.05)
+
+    # Negative inputs are slow in the original job, until the stop flag
+    # exists, but fast in the speculative duplicates, which read their
+    # input through --input-jobid
+    script_dir = tempfile.mkdtemp()
+    stop_flag = op.join(script_dir, 'stop')
+    runner = _script_runner(
+        script_dir,
+        'def slow_func(x):\n'
+        '    import os, sys, time\n'
+        '    if x < 0 and "--input-jobid" not in sys.argv:\n'
+        '        while not os.path.exists(os.environ["STOP_FLAG"]):\n'
+        '            time.sleep(0.05)\n'
+        '    return 10 * abs(x)\n',
+        'slow_func', environment={'STOP_FLAG': stop_flag}
+    )
+
+    try:
+        with ck.emulator.AwsEmulator(concurrency=6, runner=runner) as emu:
+            try:
+                jd, jq = _emulated_job_definition(emu, 'straggler')
+
+                # One slow child is duplicated, the duplicate wins the race and
+                # the original child is terminated
+                policy = ck.aws.StragglerPolicy(quantile=0.5, multiplier=2)
+                job = ck.aws.BatchJob(name='straggler-job', job_queue=jq,
+                                      job_definition=jd, input_=[1, 2, 3, -4],
+                                      straggler_policy=policy)
+                assert job.result() == [10, 20, 30, 40]
+
+                names = [j['jobName'] for j in jq.get_jobs()]
+                assert names.count('straggler-job-speculative') == 1
+                original = ck.aws.describe_jobs([job.job_id + ':3'])[0]
+                assert original['status'] == 'FAILED'
+                assert original['statusReason'] == \
+                    'Speculative duplicate finished first'
+
+                # Runtimes of succeeded children were taken from list_jobs
+                assert sorted(job._succeeded_runtimes.keys()) == [0, 1, 2]
+
+                # Two slow children, but only one duplicate is allowed
+                policy = ck.aws.StragglerPolicy(quantile=0.5, multiplier=2,
+                                                max_duplicates=1)
+                job = ck.aws.BatchJob(name='capped-job', job_queue=jq,
+                                      job_definition=jd, input_=[1, 2, -3, -4],
+                                      straggler_policy=policy)
+                with pytest.raises(ck.aws.CKTimeoutError):
+                    job.result(timeout=8)
+
+                names = [j['jobName'] for j in jq.get_jobs()]
+                assert names.count('capped-job-speculative') == 1
+                assert list(job._substitutes.keys()) == [2]
+
+                # Once the slow original finishes, the result is complete
+                open(stop_flag, 'w').close()
+                assert job.result() == [10, 20, 30, 40]
+            finally:
+                # Let the slow originals finish, so that the emulator can
+                # shut down
+                open(stop_flag, 'w').close()
+    finally:
+        shutil.rmtree(script_dir)
+
+
+def test_BatchJob_stragglers_original_wins(monkeypatch):
+    monkeypatch.setattr(ck.aws.BatchJob, '_poll_interval', 0.05)
+
+    # Negative inputs are slow until their flag file exists: the original
+    # child waits for the stop flag and the duplicate for the duplicate flag
+    script_dir = tempfile.mkdtemp()
+    stop_flag = op.join(script_dir, 'stop')
+    duplicate_flag = op.join(script_dir, 'duplicate')
+    runner = _script_runner(
+        script_dir,
+        'def slow_func(x):\n'
+        '    import os, sys, time\n'
+        '    flag = ("DUPLICATE_FLAG" if "--input-jobid" in sys.argv\n'
+        '            else "STOP_FLAG")\n'
+        '    while x < 0 and not os.path.exists(os.environ[flag]):\n'
+        '        time.sleep(0.05)\n'
+        '    return 10 * abs(x)\n',
+        'slow_func',
+        environment={'STOP_FLAG': stop_flag, 'DUPLICATE_FLAG': duplicate_flag}
+    )
+
+    def on_substitute(job):
+        # Let the original straggler finish once it has been duplicated
+        substitutes.append(dict(job._substitutes))
+        open(stop_flag, 'w').close()
+
+    substitutes = []
+
+    try:
+        with ck.emulator.AwsEmulator(concurrency=6, runner=runner) as emu:
+            try:
+                jd, jq = _emulated_job_definition(emu, 'original-wins')
+
+                # The original straggler is the last child to finish, so the
+                # parent finishes while the duplicate is still running
+                policy = ck.aws.StragglerPolicy(quantile=0.5, multiplier=2)
+                job = ck.aws.BatchJob(name='original-wins-job', job_queue=jq,
+                                      job_definition=jd, input_=[1, 2, 3, -4],
+                                      straggler_policy=policy,
+                                      on_substitute=on_substitute)
+                assert job.result() == [10, 20, 30, 40]
+
+                # The losing duplicate is terminated and no longer recorded
+                duplicates = [
+                    j for j in jq.get_jobs()
+                    if j['jobName'] == 'original-wins-job-speculative'
+                ]
+                assert len(duplicates) == 1
+                duplicate = ck.aws.describe_jobs(
+                    [duplicates[0]['jobId']]
+                )[0]
+                assert duplicate['status'] == 'FAILED'
+                assert duplicate['statusReason'] == \
+                    'Original job finished first'
+                assert job._substitutes == {}
+                assert job._speculative == {}
+                assert [list(s.keys()) for s in substitutes] == [[3], []]
+            finally:
+                # Let the duplicate finish, so that the emulator can shut down
+                open(stop_flag, 'w').close()
+                open(duplicate_flag, 'w').close()
+    finally:
+        shutil.rmtree(script_dir)
+
+
+def test_describe_jobs():
+    with ck.emulator.AwsEmulator(
+            concurrency=4, runner=lambda image, command, environment: 0
+    ) as emu:
+        jd, jq = _emulated_job_definition(emu, 'describe')
+        response = emu.batch.submit_job(
+            jobName='describe-job', jobQueue='describe-jq',
+            jobDefinition=jd.arn, arrayProperties={'size': 250}
+        )
+        child_ids = ['{id:s}:{i:d}'.format(id=response['jobId'], i=i)
+                     for i in reversed(range(250))]
+
+        # 251 IDs are described in three concurrent chunks, and merged in
+        # the order of the input. Unknown IDs are omitted.
+        emu.batch.reset_stats()
+        jobs = ck.aws.describe_jobs(child_ids + ['unknown-id'],
+                                    max_threads=4)
+        assert [j['jobId'] for j in jobs] == child_ids
+        assert emu.batch.call_counts['describe_jobs'] == 3
+        assert ck.aws.describe_jobs([]) == []
+
+        table = ck.aws.job_status_table(jobs[:3])
+        assert list(table.keys()) == ['job_id', 'array_index', 'status',
+                                      'attempts', 'started_at',
+                                      'stopped_at']
+        assert table['job_id'] == child_ids[:3]
+        assert table['array_index'] == [249, 248, 247]
+        assert set(table['status']) <= {'RUNNABLE', 'RUNNING', 'SUCCEEDED'}
+
+
+def test_JobQueue_iter_jobs_pagination():
+    with ck.emulator.AwsEmulator(
+            concurrency=4, runner=lambda image, command, environment: 0
+    ) as emu:
+        jd, jq = _emulated_job_definition(emu, 'paginate')
+        job_ids = [emu.batch.submit_job(
+            jobName='paginate-job-{i:d}'.format(i=i), jobQueue=jq.arn,
+            jobDefinition=jd.arn
+        )['jobId'] for i in range(7)]
+        array_id = emu.batch.submit_job(
+            jobName='paginate-array', jobQueue=jq.arn,
+            jobDefinition=jd.arn, arrayProperties={'size': 5}
+        )['jobId']
+        child_ids = ['{id:s}:{i:d}'.format(id=array_id, i=i)
+                     for i in range(5)]
+
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            jobs = ck.aws.describe_jobs(job_ids + [array_id] + child_ids)
+            if all(j['status'] == 'SUCCEEDED' for j in jobs):
+                break
+            time.sleep(0.1)
+
+        # Eight queue jobs in pages of three are listed with three calls,
+        # following nextToken, and each job is yielded exactly once
+        emu.batch.reset_stats()
+        listed = [j['jobId'] for j in jq.iter_jobs(status='SUCCEEDED',
+                                                   page_size=3)]
+        assert emu.batch.call_counts['list_jobs'] == 3
+        assert sorted(listed) == sorted(job_ids + [array_id])
+
+        # Paginating over every status also yields each job exactly once
+        listed = [j['jobId'] for j in jq.iter_jobs(page_size=1)]
+        assert sorted(listed) == sorted(job_ids + [array_id])
+
+        # Array children are paginated in the same way
+        emu.batch.reset_stats()
+        listed = [j['jobId'] for j in ck.aws.batch._list_jobs(
+            array_job_id=array_id, status='SUCCEEDED', page_size=2
+        )]
+        assert emu.batch.call_counts['list_jobs'] == 3
+        assert listed == child_ids
+
+
+def test_AwsEmulator():
+    # Run the rendered container script in a subprocess instead of Docker
+    with open(op.join(ck.__path__[0], 'templates', 'script.template')) as f:
+        template = string.Template(f.read())
+
+    script_dir = tempfile.mkdtemp()
+    script_path = op.join(script_dir, 'script.py')
+    with open(script_path, 'w') as f:
+        f.write(template.substitute(
+            func_source=(
+                'def emulator_testing_func(x):\n'
+                '    if x < 0:\n'
+                '        raise ValueError("x must be non-negative")\n'
+                '    return 10 * x\n'
+            ),
+            func_name='emulator_testing_func'
+        ))
+
+    def runner(image, command, environment):
+        env = dict(os.environ)
+        env.update(environment)
+        return subprocess.call([sys.executable, ck.emulator.LOCAL_S3_SHIM,
+                                script_path] + command, env=env)
+
+    try:
+        with ck.emulator.AwsEmulator(concurrency=2, runner=runner) as emu:
+            assert ck.aws.clients['batch'] is emu.batch
+            ck.refresh_clients()
+            assert ck.aws.clients['s3'] is emu.s3
+
+            bucket = ck.get_s3_params().bucket
+            response = emu.batch.register_job_definition(
+                jobDefinitionName='emulated-jd', type='container',
+                containerProperties={
+                    'image': 'emulated-image', 'vcpus': 1, 'memory': 100,
+                    'user': 'cloudknot-user', 'jobRoleArn': 'emulated-role',
+                    'environment': [
+                        {'name': 'CLOUDKNOT_JOBS_S3_BUCKET',
+                         'value': bucket},
+                        {'name': 'CLOUDKNOT_S3_JOBDEF_KEY',
+                         'value': 'emulated-jd'},
+                    ]
+                },
+                retryStrategy={'attempts': 2}
+            )
+            emu.batch.create_job_queue(jobQueueName='emulated-jq', priority=1)
+
+            jd = ck.aws.JobDefinition(arn=response['jobDefinitionArn'])
+            jq = ck.aws.JobQueue(name='emulated-jq')
+
+            job = ck.aws.BatchJob(
+                name='emulated-job', job_queue=jq, job_definition=jd,
+                input_=[1, -1, 3],
+                environment_variables=[{'name': 'CLOUDKNOT_METRICS',
+                                        'value': '1'}]
+            )
+            partial = job.result(partial=True)
+            assert partial.results == [10, None, 30]
+            assert list(partial.errors.keys()) == [1]
+
+            # The container script saved its runtime metrics, except for
+            # the child whose function raised
+            metrics = job.container_metrics()
+            assert sorted(metrics.keys()) == [0, 2]
+            stats = ck.aws.summarize_container_metrics(metrics.values())
+            assert stats.count == 2
+            assert list(stats.phases.keys())[-5:] == [
+                'download', 'unpickle', 'compute', 'pickle', 'upload'
+            ]
+            assert stats.phases['compute'].count == 2
+
+            # The failed child was retried
+            child = ck.aws.describe_jobs([job.job_id + ':1'])[0]
+            assert child['status'] == 'FAILED'
+            assert len(child['attempts']) == 2
+
+            single = ck.aws.BatchJob(name='emulated-single', job_queue=jq,
+                                     job_definition=jd, input_=2,
+                                     array_job=False)
+            assert single.result() == 20
+
+            # Metrics are only saved on request
+            assert single.container_metrics() == {}
+
+            # Client and server-side phases were timed
+            phases = single.timings.phases
+            assert list(phases.keys()) == [
+                'serialize', 'submit', 'upload', 'record', 'queue', 'run',
+                'wait', 'download', 'unpickle'
+            ]
+            assert all(t.count == 1 and t.total_s >= 0
+                       for t in phases.values())
+
+            statuses = [j['status'] for j in jq.get_jobs()]
+            assert sorted(statuses) == ['FAILED', 'SUCCEEDED']
+
+        assert ck.aws.clients['batch'] is not emu.batch
+    finally:
+        shutil.rmtree(script_dir)
+
+
+def test_DockerRunner(monkeypatch):
+    class FakeContainer(object):
+        id = 'container-id'
+
+        def wait(self):
+            return {'StatusCode': 3}
+
+        def logs(self):
+            return b'container output'
+
+        def remove(self, force=False):
+            pass
+
+    class FakeImage(object):
+        def __init__(self, entrypoint):
+            self.attrs = {'Config': {'Entrypoint': entrypoint}}
+
+    class FakeClient(object):
+        def __init__(self):
+            self.runs = []
+            self.images = self
+            self.containers = self
+            self.entrypoints = {
+                'script-image': ['python', '/home/cloudknot-user/script.py'],
+                'shell-image': None,
+            }
+
+        def get(self, image):
+            return FakeImage(self.entrypoints[image])
+
+        def run(self, image, **kwargs):
+            self.runs.append((image, kwargs))
+            return FakeContainer()
+
+    client = FakeClient()
+    monkeypatch.setattr(ck.dockerimage, '_docker_client', lambda: client)
+
+    environment = {'AWS_BATCH_JOB_ID': 'job-id',
+                   'CLOUDKNOT_LOCAL_S3_ROOT': '/tmp/s3-root'}
+    runner = ck.emulator.DockerRunner()
+    assert runner._client is client
+    assert runner.run('script-image', ['bucket'], environment) == \
+        (3, 'container output')
+
+    # The container script runs through the local S3 shim, which is
+    # mounted next to the emulated S3 root
+    image, kwargs = client.runs[0]
+    assert kwargs['entrypoint'] == ['python', runner._shim_path,
+                                    '/home/cloudknot-user/script.py']
+    assert kwargs['command'] == ['bucket']
+    assert kwargs['environment']['CLOUDKNOT_LOCAL_S3_ROOT'] == \
+        '/cloudknot-s3'
+    assert kwargs['volumes'] == {
+        '/tmp/s3-root': {'bind': '/cloudknot-s3', 'mode': 'rw'},
+        ck.emulator.LOCAL_S3_SHIM: {'bind': runner._shim_path, 'mode': 'ro'},
+    }
+
+    with pytest.raises(ck.aws.CloudknotInputError):
+        runner.run('shell-image', ['bucket'], environment)
+
+    # The production container script has no emulator code
+    with open(op.join(ck.__path__[0], 'templates', 'script.template')) as f:
+        assert 'CLOUDKNOT_LOCAL_S3_ROOT' not in f.read()
+
+
+def test_analytics():
+    def job(job_id, created, attempts, status='SUCCEEDED'):
+        return {
+            'jobId': job_id, 'status': status, 'createdAt': created,
+            'startedAt': attempts[-1][0], 'stoppedAt': attempts[-1][1],
+            'attempts': [{'startedAt': a, 'stoppedAt': b}
+                         for a, b in attempts]
+        }
+
+    # Timestamps are in milliseconds. The array parent is skipped.
+    jobs = [
+        {'jobId': 'parent', 'arrayProperties': {'size': 3},
+         'createdAt': 0, 'startedAt': 1000, 'stoppedAt': 9000},
+        job('parent:0', 0, [(1000, 5000)]),
+        job('parent:1', 0, [(1000, 3000), (3000, 9000)]),
+        job('parent:2', 0, [(5000, 9000)]),
+    ]
+
+    result = ck.analytics.map_analytics(jobs, capacity=4)
+    assert result.num_jobs == 3
+    assert result.queue_s['min'] == 1.0
+    assert result.queue_s['max'] == 5.0
+    assert result.queue_s['p50'] == 1.0
+    assert result.run_s['p50'] == 4.0
+    assert result.run_s['mean'] == pytest.approx(14 / 3.0)
+    assert result.retries == {0: 2, 1: 1}
+    assert result.makespan_s == 8.0
+    assert result.peak_concurrency == 2
+    # 16 busy seconds over an 8 second makespan
+    assert result.mean_concurrency == 2.0
+    assert result.utilization == 0.5
+
+    assert ck.analytics.concurrency_timeline(result.lifecycles) == [
+        (1.0, 2), (9.0, 0)
+    ]
+
+    report = ck.analytics.format_report(result, bins=2)
+    assert 'utilization: 50.0%' in report
+    assert len(report.splitlines()) == 11
+
+    assert ck.analytics.percentiles([]) == {}
+    assert ck.analytics.text_histogram([None]) == '(no data)'
+
+    # Chrome trace-event export
+    timings = ck.aws.JobTimings()
+    timings.add('submit', 0.5, start=0.0)
+    trace = ck.analytics.chrome_trace(jobs, timings={'parent': timings})
+    spans = [e for e in trace['traceEvents'] if e['ph'] == 'X']
+    assert [e['cat'] for e in spans] == ['client'] + ['queue'] * 3 + \
+        ['run'] * 4
+    assert spans[0]['ts'] == 0 and spans[0]['dur'] == 500000
+    # Overlapping spans are packed into separate rows
+    assert sorted(e['tid'] for e in spans if e['cat'] == 'run') == \
+        [0, 0, 1, 1]
+    assert {e['tid'] for e in spans if e['cat'] == 'queue'} == {0, 1, 2}
+
+
+def test_api_metrics():
+    metrics = ck.aws.enable_api_metrics(ck.aws.ApiMetrics())
+    try:
+        # Handlers are registered again on refreshed clients
+        ck.refresh_clients()
+        batch = ck.aws.clients['batch']
+
+        with botocore.stub.Stubber(batch) as stubber:
+            stubber.add_response('describe_jobs', {'jobs': []},
+                                 {'jobs': ['job-id']})
+            stubber.add_client_error(
+                'describe_jobs', service_error_code='ThrottlingException',
+                http_status_code=400
+            )
+            batch.describe_jobs(jobs=['job-id'])
+            with pytest.raises(batch.exceptions.ClientError):
+                batch.describe_jobs(jobs=['job-id'])
+
+        stats = metrics.stats[('batch', 'describe_jobs')]
+        assert stats.count == 2
+        assert stats.errors == 1
+        assert stats.throttles == 1
+        assert sum(stats.buckets) == 2
+
+        text = metrics.to_openmetrics()
+        assert ('cloudknot_aws_api_calls_total{service="batch",'
+                'operation="describe_jobs"} 2') in text
+        assert ('cloudknot_aws_api_call_duration_seconds_bucket{'
+                'service="batch",operation="describe_jobs",le="+Inf"} 2'
+                ) in text
+        assert text.endswith('# EOF\n')
+    finally:
+        assert ck.aws.disable_api_metrics() is metrics
+
+    assert ck.aws.get_api_metrics() is None
+    ck.refresh_clients()
+
+
+def test_get_ecr_auth_config():
+    ck.aws.clear_ecr_auth_cache()
+    ecr = ck.aws.clients['ecr']
+    token = base64.b64encode(b'AWS:secret').decode('ascii')
+    expires = datetime.datetime.utcnow() + datetime.timedelta(hours=12)
+
+    try:
+        with botocore.stub.Stubber(ecr) as stubber:
+            stubber.add_response(
+                'get_authorization_token',
+                {'authorizationData': [{
+                    'authorizationToken': token,
+                    'expiresAt': expires,
+                    'proxyEndpoint': 'https://123456789012.dkr.ecr.'
+                                     'us-east-1.amazonaws.com',
+                }]},
+                {'registryIds': ['123456789012']}
+            )
+
+            auth = ck.aws.get_ecr_auth_config(registry_id='123456789012')
+            assert auth['username'] == 'AWS'
+            assert auth['password'] == 'secret'
+
+            # The second call is served from the cache
+            assert ck.aws.get_ecr_auth_config(
+                registry_id='123456789012'
+            ) == auth
+            stubber.assert_no_pending_responses()
+    finally:
+        ck.aws.clear_ecr_auth_cache()
@@ -1,15 +1,24 @@
 from __future__ import absolute_import, division, print_function
 
+import botocore.stub
 import cloudknot as ck
+import cloudpickle
+import collections
 import configparser
 import docker
 import filecmp
+import json
+import logging
 import os
 import os.path as op
 import pytest
+import shutil
 import six
+import subprocess
+import sys
 import tempfile
 import tenacity
+import time
 import uuid
 
 UNIT_TEST_PREFIX = 'cloudknot-unit-test'
@@ -1244,6 +1253,11 @@ def test_Knot(cleanup_repos):
         assert knot.job_definition.name == pre + 'job-definition'
         assert knot.job_queue.name == pre + 'job-queue'
         assert knot.compute_environment.name == pre + 'compute-environment'
+        assert knot.map_ids == []
+
+        # Assert ck.aws.CloudknotInputError on resume of unknown map session
+        with pytest.raises(ck.aws.CloudknotInputError):
+            knot.resume_map('not-a-map-session')
 
         # Now remove the knot section from config file
         config = configparser.ConfigParser()
@@ -1376,3 +1390,1166 @@ def test_Knot(cleanup_repos):
     # Assert ck.aws.CloudknotInputError on invalid pars input
     with pytest.raises(ck.aws.CloudknotInputError):
         ck.Knot(func=unit_testing_func, pars=42)
+
+
+def local_testing_func(x, offset=0):
+    """Test function for unit testing of cloudknot.LocalKnot"""
+    if x < 0:
+        raise ValueError('x must be non-negative')
+    return x * x + offset
+
+
+def test_LocalKnot():
+    knot = ck.LocalKnot(func=local_testing_func, max_workers=2)
+
+    try:
+        assert knot.map([1, 2, 3]).result() == [1, 4, 9]
+
+        futures = knot.map([(1, 1), (2, 2)], starmap=True,
+                           job_type='independent')
+        assert [f.result() for f in futures] == [2, 6]
+        assert len(knot.job_ids) == 3
+
+        assert futures[0].timings is knot.jobs[1].timings
+        assert knot.stats().phases['serialize'].count == 3
+        assert knot.stats().phases['download'].count == 5
+
+        # Failed children are reported like failed AWS Batch children
+        future = knot.map([1, -1, 2])
+        with pytest.raises(ck.aws.BatchJobFailedError):
+            future.result()
+
+        job = knot.jobs[-1]
+        assert job.failed_indices() == [1]
+        partial = job.result(partial=True)
+        assert partial.results == [1, None, 4]
+        assert list(partial.errors.keys()) == [1]
+
+        # Local jobs share the state of AWS Batch jobs, so inherited
+        # methods work on them
+        recorded = []
+        job._on_substitute = recorded.append
+        resubmitted = job.resubmit_failed()
+        assert recorded == [job]
+        assert job.substitutes['jobs'] == [{
+            'index': 1, 'job_id': resubmitted.job_id, 'sub_index': 0,
+            'speculative': False,
+        }]
+        assert job._succeeded_runtimes == {}
+        assert job._running_started == {}
+
+        with pytest.raises(ValueError):
+            knot.map([1], job_type='invalid')
+    finally:
+        knot.clobber()
+
+    assert not op.exists(knot.root_dir)
+
+    with pytest.raises(ck.aws.ResourceClobberedException):
+        knot.map([1])
+
+    # Assert ck.aws.CloudknotInputError on invalid func
+    with pytest.raises(ck.aws.CloudknotInputError):
+        ck.LocalKnot(func=42)
+
+
+def test_resolve_imports(monkeypatch):
+    config_file = tempfile.mktemp()
+    monkeypatch.setenv('CLOUDKNOT_CONFIG_FILE', config_file)
+
+    lookups = []
+
+    def get_imports_info(names):
+        lookups.append(list(names))
+        return [{'name': n, 'version': '1.0'} for n in names
+                if n != 'not_on_pypi']
+
+    monkeypatch.setattr(ck.requirements.pipreqs, 'get_imports_info',
+                        get_imports_info)
+
+    try:
+        names = ['six', 'some_pypi_package', 'not_on_pypi']
+        resolved = ck.requirements.resolve_imports(names, offline=False)
+
+        # Installed distributions are never looked up
+        assert lookups == [['some_pypi_package', 'not_on_pypi']]
+        assert resolved['six']['version'] == six.__version__
+        assert resolved['some_pypi_package'] == {
+            'name': 'some_pypi_package', 'version': '1.0'
+        }
+        assert 'not_on_pypi' not in resolved
+
+        # Misses, including names not on PyPI, are served from the cache
+        assert ck.requirements.resolve_imports(names) == resolved
+        assert len(lookups) == 1
+
+        # Offline, unknown names are left unresolved
+        monkeypatch.setenv('CLOUDKNOT_OFFLINE', '1')
+        assert ck.requirements.resolve_imports(['unknown']) == {}
+        assert len(lookups) == 1
+    finally:
+        ck.requirements.clear_imports_cache()
+        if op.isfile(config_file):
+            os.remove(config_file)
+
+
+def test_runner_script():
+    # Render the generic runner script without building a DockerImage
+    di = ck.DockerImage.__new__(ck.DockerImage)
+    script_dir = tempfile.mkdtemp()
+    script_path = op.join(script_dir, 'runner.py')
+    with open(script_path, 'w') as f:
+        f.write(di._render_runner_script())
+
+    def runner(image, command, environment):
+        env = dict(os.environ)
+        env.update(environment)
+        return subprocess.call([sys.executable, ck.emulator.LOCAL_S3_SHIM,
+                                script_path] + command, env=env)
+
+    try:
+        # The function is only loaded after parsing the command line, so
+        # --help works without S3, e.g. when timing the image's startup
+        env = {k: v for k, v in os.environ.items()
+               if not k.startswith('CLOUDKNOT_')}
+        with open(os.devnull, 'w') as fnull:
+            assert subprocess.call([sys.executable, script_path, '--help'],
+                                   env=env, stdout=fnull) == 0
+
+        with ck.emulator.AwsEmulator(concurrency=2, runner=runner) as emu:
+            bucket = ck.get_s3_params().bucket
+            response = emu.batch.register_job_definition(
+                jobDefinitionName='runner-jd', type='container',
+                containerProperties={
+                    'image': 'runner-image', 'vcpus': 1, 'memory': 100,
+                    'user': 'cloudknot-user', 'jobRoleArn': 'runner-role',
+                    'environment': [
+                        {'name': 'CLOUDKNOT_JOBS_S3_BUCKET',
+                         'value': bucket},
+                        {'name': 'CLOUDKNOT_S3_JOBDEF_KEY',
+                         'value': 'runner-jd'},
+                    ]
+                }
+            )
+            emu.batch.create_job_queue(jobQueueName='runner-jq', priority=1)
+
+            jd = ck.aws.JobDefinition(arn=response['jobDefinitionArn'])
+            jq = ck.aws.JobQueue(name='runner-jq')
+
+            # The runner loads the function that the knot would upload
+            offset = 100
+            emu.s3.put_object(
+                Bucket=bucket, Key='cloudknot.jobs/runner-jd/function.pickle',
+                Body=cloudpickle.dumps(lambda x: x + offset)
+            )
+
+            job = ck.aws.BatchJob(name='runner-job', job_queue=jq,
+                                  job_definition=jd, input_=[1, 2])
+            assert job.result() == [101, 102]
+    finally:
+        shutil.rmtree(script_dir)
+
+
+def test_image_profiles(monkeypatch):
+    with pytest.raises(ck.aws.CloudknotInputError):
+        ck.DockerImage(func=unit_testing_func, image_profile='tiny')
+
+    with pytest.raises(ck.aws.CloudknotInputError):
+        ck.DockerImage(func=unit_testing_func, image_profile='slim',
+                       shared_deps=True)
+
+    # Render the Dockerfiles without building a DockerImage
+    build_path = tempfile.mkdtemp()
+    di = ck.DockerImage.__new__(ck.DockerImage)
+    di._name = 'profile-test'
+    di._username = 'cloudknot-user'
+    di._build_path = build_path
+    di._script_path = op.join(build_path, 'profile-test.py')
+    di._docker_path = op.join(build_path, 'Dockerfile')
+    di._github_installs = ['https://github.com/user/repo.git']
+    di._shared_deps = False
+    di._buildkit = False
+
+    try:
+        di._image_profile = 'slim'
+        di._base_image = 'python:3-slim'
+        di._write_dockerfile()
+        with open(di.docker_path) as f:
+            dockerfile = f.read()
+        assert 'FROM python:3-slim\n' in dockerfile
+        assert 'apt-get install -y --no-install-recommends git' in dockerfile
+        assert 'python -m compileall -q /usr/local/lib' in dockerfile
+
+        di._image_profile = 'distroless'
+        di._username = 'nonroot'
+        di._base_image = ck.dockerimage.DISTROLESS_BASE_IMAGE
+        di._write_dockerfile()
+        with open(di.docker_path) as f:
+            dockerfile = f.read()
+        assert 'AS builder' in dockerfile
+        assert ('pip install --no-cache-dir --target '
+                '/opt/cloudknot/site-packages git+') in dockerfile
+        assert 'USER nonroot' in dockerfile
+        assert 'apt-get' not in dockerfile
+    finally:
+        shutil.rmtree(build_path)
+
+    # The image profile is stored apart from the AWS profile of the image
+    client = _FakeDockerClient()
+    monkeypatch.setattr(ck.dockerimage, '_docker_client', lambda: client)
+    di = ck.DockerImage(func=runner_testing_func, image_profile='slim')
+    try:
+        config = configparser.ConfigParser()
+        with ck.config.rlock:
+            config.read(ck.config.get_config_file())
+        section = 'docker-image ' + di.name
+        assert config.get(section, 'image-profile') == 'slim'
+        assert not config.has_option(section, 'profile')
+        assert ck.DockerImage(name=di.name).image_profile == 'slim'
+    finally:
+        di.clobber()
+
+    # Distroless images run as the base image's nonroot user, which the job
+    # definition registers as the container user
+    with pytest.raises(ck.aws.CloudknotInputError):
+        ck.DockerImage(func=runner_testing_func, image_profile='distroless',
+                       username='cloudknot-user')
+
+    di = ck.DockerImage(func=runner_testing_func, image_profile='distroless')
+    try:
+        assert di.username == 'nonroot'
+        with open(di.docker_path) as f:
+            users = [line.split()[1] for line in f
+                     if line.startswith('USER ')]
+        assert users == ['nonroot']
+
+        role = ck.aws.IamRole.__new__(ck.aws.IamRole)
+        role._arn = 'arn:aws:iam::123456789012:role/distroless-role'
+        with ck.emulator.AwsEmulator(runner=lambda image, command,
+                                     environment: 0) as emu:
+            jd = ck.aws.JobDefinition(
+                name='distroless-jd', job_role=role,
+                docker_image='cloudknot/' + di.name, username=di.username
+            )
+            response = emu.batch.describe_job_definitions(
+                jobDefinitions=[jd.arn]
+            )
+            container = response['jobDefinitions'][0]['containerProperties']
+            assert container['user'] == users[0]
+            jd.clobber()
+    finally:
+        di.clobber()
+
+
+def test_Knot_preflight(monkeypatch):
+    # Render the container script without building a DockerImage
+    di = ck.DockerImage.__new__(ck.DockerImage)
+    di._func = local_testing_func
+    script_dir = tempfile.mkdtemp()
+    script_path = op.join(script_dir, 'preflight.py')
+    with open(script_path, 'w') as f:
+        f.write(di._render_script())
+
+    class ScriptRunner(object):
+        """Run the container script in a subprocess instead of Docker"""
+        def run(self, image, command, environment):
+            env = dict(os.environ)
+            env.update(environment)
+            proc = subprocess.Popen([sys.executable, ck.emulator.LOCAL_S3_SHIM,
+                                     script_path] + command,
+                                    env=env, stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT)
+            output = proc.communicate()[0]
+            return proc.returncode, output.decode('utf-8', 'replace')
+
+    monkeypatch.setattr(ck.emulator, 'DockerRunner', ScriptRunner)
+
+    client = _FakeDockerClient()
+    client.images._add('preflight-image:latest')
+    monkeypatch.setattr(ck.dockerimage, '_docker_client', lambda: client)
+    monkeypatch.setattr(ck.aws, 'get_ecr_auth_config',
+                        lambda registry_id=None: {'username': 'AWS'})
+
+    # A knot needs only its job definition to run the pre-flight check
+    knot = ck.Knot.__new__(ck.Knot)
+    knot._name = 'preflight-knot'
+    knot._docker_image = None
+    JobDef = collections.namedtuple(
+        'JobDef', ['name', 'output_bucket', 'docker_image']
+    )
+    knot._job_definition = JobDef('preflight-jd', 'preflight-bucket',
+                                  'preflight-image:latest')
+
+    try:
+        assert knot._preflight(3) == 9
+        assert knot._preflight((3, 1), starmap=True) == 10
+        assert client.images.calls == []
+
+        with pytest.raises(ck.aws.PreflightError) as e:
+            knot._preflight(-1)
+        assert 'ValueError: x must be non-negative' in e.value.logs
+        assert e.value.exit_code != 0
+
+        # An image that the daemon does not hold is pulled from ECR
+        uri = '123456789012.dkr.ecr.us-east-1.amazonaws.com/cloudknot'
+        client.images.remote[uri + ':v1'] = True
+        knot._job_definition = JobDef('preflight-jd', 'preflight-bucket',
+                                      uri + ':v1')
+        assert knot._preflight(3) == 9
+        assert client.images.calls == [('pull', uri + ':v1')]
+
+        # An image that cannot be pulled raises a cloudknot error
+        knot._job_definition = JobDef('preflight-jd', 'preflight-bucket',
+                                      uri + ':missing')
+        with pytest.raises(ck.aws.CloudknotInputError) as e:
+            knot._preflight(3)
+        assert 'could not be pulled' in str(e.value)
+
+        # So does a missing Docker daemon
+        def no_daemon():
+            raise docker.errors.DockerException('daemon not running')
+
+        monkeypatch.setattr(ck.dockerimage, '_docker_client', no_daemon)
+        with pytest.raises(ck.aws.CloudknotInputError) as e:
+            knot._preflight(3)
+        assert 'needs a local Docker daemon' in str(e.value)
+    finally:
+        shutil.rmtree(script_dir)
+
+
+def test_parse_push_stream():
+    stream = [
+        {'status': 'The push refers to repository [repo]'},
+        {'status': 'Preparing', 'id': 'a', 'progressDetail': {}},
+        {'status': 'Preparing', 'id': 'b', 'progressDetail': {}},
+        {'status': 'Layer already exists', 'id': 'a', 'progressDetail': {}},
+        {'status': 'Pushing', 'id': 'b',
+         'progressDetail': {'current': 512, 'total': 2048}},
+        {'status': 'Pushing', 'id': 'b',
+         'progressDetail': {'current': 2048, 'total': 2048}},
+        {'status': 'Pushed', 'id': 'b', 'progressDetail': {}},
+        {'status': 'tag: digest: sha256:0 size: 1234'},
+    ]
+    parse = ck.dockerimage._parse_push_stream
+    assert parse(stream) == (2048, 1, 1)
+
+    with pytest.raises(docker.errors.APIError):
+        parse(stream[:2] + [{'error': 'denied', 'errorDetail': {}}])
+
+
+def test_Knot_resume_map(monkeypatch):
+    monkeypatch.setattr(ck.aws.BatchJob, '_poll_interval', 0.05)
+
+    di = ck.DockerImage.__new__(ck.DockerImage)
+    di._func = local_testing_func
+    script_dir = tempfile.mkdtemp()
+    script_path = op.join(script_dir, 'resume.py')
+    with open(script_path, 'w') as f:
+        f.write(di._render_script())
+
+    def runner(image, command, environment):
+        env = dict(os.environ)
+        env.update(environment)
+        return subprocess.call([sys.executable, ck.emulator.LOCAL_S3_SHIM,
+                                script_path] + command, env=env)
+
+    def emulated_knot(name, jq, jd, map_ids):
+        """Build the parts of a Knot that map and resume_map use"""
+        knot = ck.Knot.__new__(ck.Knot)
+        knot._name = name
+        knot._knot_name = 'knot ' + name
+        knot._clobbered = False
+        knot._region = ck.get_region()
+        knot._profile = ck.get_profile()
+        knot._job_queue = jq
+        knot._job_definition = jd
+        knot._jobs = []
+        knot._job_ids = []
+        knot._map_ids = list(map_ids)
+        return knot
+
+    name = 'resume-knot-' + uuid.uuid4().hex[:8]
+    config_file = ck.config.get_config_file()
+    config = configparser.ConfigParser()
+    with ck.config.rlock:
+        config.read(config_file)
+        config.add_section('knot ' + name)
+        with open(config_file, 'w') as f:
+            config.write(f)
+
+    map_ids = []
+    try:
+        with ck.emulator.AwsEmulator(concurrency=4, runner=runner) as emu:
+            bucket = ck.get_s3_params().bucket
+            response = emu.batch.register_job_definition(
+                jobDefinitionName='resume-jd', type='container',
+                containerProperties={
+                    'image': 'resume-image', 'vcpus': 1, 'memory': 100,
+                    'user': 'cloudknot-user', 'jobRoleArn': 'resume-role',
+                    'environment': [
+                        {'name': 'CLOUDKNOT_JOBS_S3_BUCKET',
+                         'value': bucket},
+                        {'name': 'CLOUDKNOT_S3_JOBDEF_KEY',
+                         'value': 'resume-jd'},
+                    ]
+                }
+            )
+            emu.batch.create_job_queue(jobQueueName='resume-jq', priority=1)
+            jd = ck.aws.JobDefinition(arn=response['jobDefinitionArn'])
+            jq = ck.aws.JobQueue(name='resume-jq')
+
+            knot = emulated_knot(name, jq, jd, [])
+            policy = ck.aws.StragglerPolicy(quantile=0.5, max_duplicates=2)
+            future = knot.map([0, 1, 2, 3], straggler_policy=policy,
+                              cache_results=True, collect_metrics=True)
+            assert future.result() == [0, 1, 4, 9]
+            assert sorted(knot.jobs[0].container_metrics().keys()) == \
+                [0, 1, 2, 3]
+            map_id = knot.map_ids[0]
+            map_ids.append(map_id)
+
+            manifest = ck.cloudknot._read_manifest(map_id)
+            assert manifest['status'] == 'COMPLETE'
+            assert 'serializer' not in manifest
+            assert manifest['shards'][0]['straggler_policy'] == {
+                'quantile': 0.5, 'multiplier': 2.0, 'max_duplicates': 2
+            }
+
+            # Evict one cached result, then drop the knot as if the
+            # client had crashed
+            job_id = manifest['shards'][0]['job_id']
+            os.remove(op.join(manifest['result_cache_dir'], job_id,
+                              '2.pickle'))
+            del knot, future
+
+            downloaded = []
+            get_object = emu.s3.get_object
+
+            def counting_get_object(Bucket, Key):
+                if Key.endswith('output.pickle'):
+                    downloaded.append(Key)
+                return get_object(Bucket=Bucket, Key=Key)
+
+            monkeypatch.setattr(emu.s3, 'get_object', counting_get_object)
+
+            knot = emulated_knot(name, jq, jd, map_ids)
+            future = knot.resume_map(map_id)
+            assert future.result() == [0, 1, 4, 9]
+            assert len(downloaded) == 1
+            assert knot.jobs[0]._straggler_policy.max_duplicates == 2
+
+            # A resubmitted shard is restored together with its substitute.
+            # Results are only cached on request.
+            future = knot.map([1, -1])
+            map_id = knot.map_ids[-1]
+            map_ids.append(map_id)
+            assert ck.cloudknot._read_manifest(map_id)['result_cache_dir'] \
+                is None
+            with pytest.raises(ck.aws.BatchJobFailedError):
+                future.result()
+
+            resubmitted = knot.jobs[-1].resubmit_failed()
+            shard = ck.cloudknot._read_manifest(map_id)['shards'][0]
+            assert shard['status'] == 'FAILED'
+            assert shard['substitutes']['jobs'] == [{
+                'index': 1, 'job_id': resubmitted.job_id, 'sub_index': 0,
+                'speculative': False,
+            }]
+
+            knot = emulated_knot(name, jq, jd, map_ids)
+            future = knot.resume_map(map_id)
+            with pytest.raises(ck.aws.BatchJobFailedError):
+                future.result()
+            job = knot.jobs[0]
+            assert job._substitutes[1][0].job_id == resubmitted.job_id
+            assert job.failed_indices() == [1]
+            assert not op.exists(op.join(ck.config.get_maps_dir(), map_id,
+                                         'results'))
+
+            # Only finished sessions are pruned, unless forced
+            with pytest.raises(ck.aws.CloudknotInputError):
+                knot.prune_map(map_id)
+            knot.prune_map(map_ids[0])
+            assert not op.exists(manifest['result_cache_dir'])
+            assert ck.cloudknot._read_manifest(map_ids[0])['status'] == \
+                'COMPLETE'
+    finally:
+        shutil.rmtree(script_dir)
+        for map_id in map_ids:
+            shutil.rmtree(op.join(ck.config.get_maps_dir(), map_id),
+                          ignore_errors=True)
+        with ck.config.rlock:
+            config = configparser.ConfigParser()
+            config.read(config_file)
+            config.remove_section('knot ' + name)
+            with open(config_file, 'w') as f:
+                config.write(f)
+
+
+def test_Knot_describe_jobs():
+    def runner(image, command, environment):
+        # Odd children fail
+        return int(environment['AWS_BATCH_JOB_ARRAY_INDEX']) % 2
+
+    with ck.emulator.AwsEmulator(concurrency=4, runner=runner) as emu:
+        response = emu.batch.register_job_definition(
+            jobDefinitionName='children-jd', type='container',
+            containerProperties={'image': 'children-image', 'vcpus': 1,
+                                 'memory': 100}
+        )
+        emu.batch.create_job_queue(jobQueueName='children-jq', priority=1)
+
+        job_ids = []
+        for size in [250, 4]:
+            job_ids.append(emu.batch.submit_job(
+                jobName='children-job', jobQueue='children-jq',
+                jobDefinition=response['jobDefinitionArn'],
+                arrayProperties={'size': size}
+            )['jobId'])
+
+        while any(j['status'] not in ['SUCCEEDED', 'FAILED']
+                  for j in ck.aws.describe_jobs(job_ids)):
+            time.sleep(0.05)
+
+        knot = ck.Knot.__new__(ck.Knot)
+        knot._job_queue = ck.aws.JobQueue(name='children-jq')
+
+        # Children are listed by status, two pages for each status of the
+        # large parent and one for each of the small, and are not described
+        emu.batch.reset_stats()
+        jobs = knot._describe_jobs(job_ids, include_children=True)
+        assert emu.batch.call_counts == {'describe_jobs': 1, 'list_jobs': 6}
+
+        assert [j['jobId'] for j in jobs] == job_ids + [
+            '{id:s}:{i:d}'.format(id=jid, i=i)
+            for jid, size in zip(job_ids, [250, 4]) for i in range(size)
+        ]
+        children = jobs[2:]
+        assert [j['status'] for j in children[:4]] == [
+            'SUCCEEDED', 'FAILED', 'SUCCEEDED', 'FAILED'
+        ]
+        assert all(j['attempts'][0]['startedAt'] == j['startedAt']
+                   for j in children)
+
+        table = ck.aws.job_status_table(jobs)
+        assert table['attempts'][2:] == [1] * 254
+
+
+def test_configure_logging(monkeypatch):
+    # Restore the session's log directory afterwards
+    monkeypatch.setattr(ck.log, '_log_dir', ck.log._log_dir)
+    log_dir = tempfile.mkdtemp()
+    logger = logging.getLogger('cloudknot-logging-test')
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+
+    # Stale per-process logs are pruned, other files are left alone
+    stale = op.join(log_dir, 'cloudknot-1.log.2')
+    recent = op.join(log_dir, 'cloudknot-2.log')
+    other = op.join(log_dir, 'other.log')
+    for path in [stale, recent, other]:
+        open(path, 'w').close()
+    old = time.time() - 8 * 86400
+    os.utime(stale, (old, old))
+    os.utime(other, (old, old))
+
+    handler = ck.log.configure_logging(logger, log_dir=log_dir,
+                                       max_bytes=2000, backup_count=2)
+    try:
+        assert not op.exists(stale)
+        assert op.exists(recent) and op.exists(other)
+
+        # Records are written as JSON lines, with extras and exceptions
+        logger.info('submitted %s', 'job-1', extra={'job_id': 'job-1'})
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            logger.exception('failed')
+
+        # Switch to a new log file and listener when the pid changes,
+        # as in a forked process
+        listener = handler._listener
+        log_path = ck.log.get_log_path()
+        monkeypatch.setattr(os, 'getpid', lambda: 424242)
+        logger.info('forked')
+        assert handler._listener is not listener
+        listener.stop()
+        handler.close()
+        monkeypatch.undo()
+
+        with open(log_path) as f:
+            entries = [json.loads(line) for line in f]
+        assert [e['message'] for e in entries] == ['submitted job-1',
+                                                   'failed']
+        assert entries[0]['level'] == 'INFO'
+        assert entries[0]['logger'] == 'cloudknot-logging-test'
+        assert entries[0]['extra'] == {'job_id': 'job-1'}
+        assert entries[0]['time'].endswith('+00:00')
+        assert 'ValueError: boom' in entries[1]['exception']
+
+        with open(op.join(log_dir, 'cloudknot-424242.log')) as f:
+            assert json.loads(f.read())['message'] == 'forked'
+    finally:
+        logger.removeHandler(handler)
+
+    # Files are rotated at max_bytes, keeping backup_count backups
+    handler = ck.log.configure_logging(logger, log_dir=log_dir,
+                                       max_bytes=2000, backup_count=2,
+                                       json_format=False)
+    try:
+        for i in range(100):
+            logger.info('record %d', i)
+        handler.close()
+
+        log_path = ck.log.get_log_path()
+        assert op.exists(log_path + '.1') and op.exists(log_path + '.2')
+        assert not op.exists(log_path + '.3')
+        with open(log_path) as f:
+            lines = f.read().splitlines()
+        assert lines[-1].endswith(' - cloudknot-logging-test - INFO - '
+                                  'record 99')
+        assert all(op.getsize(log_path + s) <= 2000
+                   for s in ['', '.1', '.2'])
+    finally:
+        logger.removeHandler(handler)
+        shutil.rmtree(log_dir)
+
+
+class _FakeImage(object):
+    """Stand-in for docker.models.images.Image"""
+    def __init__(self, images, image_id, tags):
+        self._images = images
+        self.id = image_id
+        self.tags = list(tags)
+        self.attrs = {'RepoDigests': []}
+
+    def tag(self, repository, tag):
+        self._images.calls.append(('tag', repository + ':' + tag))
+        self.tags.append(repository + ':' + tag)
+        return True
+
+
+class _FakeImages(object):
+    """Stand-in for docker.models.images.ImageCollection
+
+    `calls` records the build, pull, tag and push calls, and `remote`
+    holds the images that `pull` can fetch, by repository and tag
+    """
+    def __init__(self):
+        self.calls = []
+        self.local = {}
+        self.remote = {}
+
+    def _add(self, tag):
+        image_id = 'sha256:{n:064d}'.format(n=len(self.local))
+        self.local[image_id] = _FakeImage(self, image_id, [tag])
+        return self.local[image_id]
+
+    def build(self, path, dockerfile, tag):
+        self.calls.append(('build', tag))
+        return self._add(tag), iter([])
+
+    def get(self, name):
+        for image in self.local.values():
+            if name == image.id or name in image.tags:
+                return image
+        raise docker.errors.ImageNotFound(name)
+
+    def pull(self, repository, tag, auth_config=None):
+        self.calls.append(('pull', repository + ':' + tag))
+        if repository + ':' + tag not in self.remote:
+            raise docker.errors.NotFound(repository)
+        return self._add(repository + ':' + tag)
+
+    def push(self, repository, tag, stream, decode, auth_config=None):
+        self.calls.append(('push', repository + ':' + tag))
+        return iter([
+            {'status': 'Pushing', 'id': 'layer',
+             'progressDetail': {'current': 1024, 'total': 1024}},
+            {'status': 'Pushed', 'id': 'layer', 'progressDetail': {}},
+        ])
+
+    def list(self):
+        return list(self.local.values())
+
+    def remove(self, image, force=False, noprune=False):
+        self.calls.append(('remove', image))
+        self.local = {k: v for k, v in self.local.items()
+                      if image not in v.tags}
+
+
+class _FakeDockerClient(object):
+    """Stand-in for the docker client returned by _docker_client"""
+    def __init__(self):
+        self.images = _FakeImages()
+
+
+def _bare_docker_image(name, build_path, func=local_testing_func):
+    """Return a DockerImage with its build context, without pipreqs"""
+    di = ck.DockerImage.__new__(ck.DockerImage)
+    di._name = name
+    di._clobbered = False
+    di._func = func
+    di._username = 'cloudknot-user'
+    di._build_path = build_path
+    di._script_path = op.join(build_path, name + '.py')
+    di._docker_path = op.join(build_path, 'Dockerfile')
+    di._req_path = op.join(build_path, 'requirements.txt')
+    di._github_installs = []
+    di._shared_deps = False
+    di._buildkit = False
+    di._image_profile = 'full'
+    di._base_image = 'python:3'
+    di._images = []
+    di._repo_uri = None
+    di._image_id = None
+    di._context_hash = None
+
+    with open(di.script_path, 'w') as f:
+        f.write(di._render_script())
+    with open(di.req_path, 'w') as f:
+        f.write('numpy\n')
+    di._write_dockerfile()
+
+    ck.config.add_resource('docker-image ' + name, 'images', '')
+    return di
+
+
+def _remove_config_section(section):
+    config_file = ck.config.get_config_file()
+    with ck.config.rlock:
+        config = configparser.ConfigParser()
+        config.read(config_file)
+        config.remove_section(section)
+        with open(config_file, 'w') as f:
+            config.write(f)
+
+
+def test_DockerImage_build_reuse(monkeypatch):
+    client = _FakeDockerClient()
+    monkeypatch.setattr(ck.dockerimage, '_docker_client', lambda: client)
+    build_path = tempfile.mkdtemp()
+    name = 'reuse-test-' + uuid.uuid4().hex[:8]
+    di = _bare_docker_image(name, build_path)
+
+    try:
+        di.build('v1')
+        assert client.images.calls == [('build', 'cloudknot/' + name + ':v1')]
+        first_id = di.image_id
+
+        # An unchanged context is tagged, not rebuilt
+        del client.images.calls[:]
+        di.build(['v1', 'v2'])
+        assert client.images.calls == [('tag', 'cloudknot/' + name + ':v2')]
+        assert di.image_id == first_id
+
+        # force=True rebuilds regardless
+        del client.images.calls[:]
+        di.build('v3', force=True)
+        assert client.images.calls == [('build', 'cloudknot/' + name + ':v3')]
+        assert di.image_id != first_id
+
+        # A changed context is rebuilt
+        with open(di.req_path, 'a') as f:
+            f.write('pandas\n')
+        del client.images.calls[:]
+        di.build('v4')
+        assert client.images.calls == [('build', 'cloudknot/' + name + ':v4')]
+
+        config = configparser.ConfigParser()
+        config.read(ck.config.get_config_file())
+        section = 'docker-image ' + name
+        assert config.get(section, 'context-hash') == di.context_hash
+        assert config.get(section, 'image-id') == di.image_id
+        assert sorted(config.get(section, 'images').split()) == [
+            'cloudknot/' + name + ':v' + str(i) for i in range(1, 5)
+        ]
+
+        # Reuse is skipped if the image no longer exists locally
+        del client.images.local[di.image_id]
+        del client.images.calls[:]
+        di.build('v5')
+        assert client.images.calls == [('build', 'cloudknot/' + name + ':v5')]
+    finally:
+        shutil.rmtree(build_path)
+        _remove_config_section('docker-image ' + name)
+
+
+def test_DockerImage_push_image():
+    repo_uri = '123456789012.dkr.ecr.us-east-1.amazonaws.com/cloudknot'
+    media_type = 'application/vnd.docker.distribution.manifest.v2+json'
+    images = _FakeImages()
+    image = images._add('cloudknot/push-test:v1')
+    image_manifest = json.dumps({'config': {'digest': image.id}})
+
+    di = ck.DockerImage.__new__(ck.DockerImage)
+    # push sets repo_uri without a tag until every tag is pushed
+    di._repo_uri = repo_uri
+    di._push_stats = []
+
+    def get_params(image_ids):
+        return {'registryId': '123456789012', 'repositoryName': 'cloudknot',
+                'imageIds': image_ids, 'acceptedMediaTypes': [media_type]}
+
+    def put_params(tag):
+        return {'registryId': '123456789012', 'repositoryName': 'cloudknot',
+                'imageManifest': image_manifest, 'imageTag': tag,
+                'imageManifestMediaType': media_type}
+
+    ecr = ck.aws.clients['ecr']
+    with botocore.stub.Stubber(ecr) as stubber:
+        # Not in ECR: every tag is pushed
+        stubber.add_response(
+            'batch_get_image', {'images': [], 'failures': []},
+            get_params([{'imageTag': 'v1'}, {'imageTag': 'v2'}])
+        )
+        di._push_image(images, image, ['v1', 'v2'], auth_config=None)
+        assert images.calls == [('push', repo_uri + ':v1'),
+                                ('push', repo_uri + ':v2')]
+        assert [(st.tag, st.bytes, st.layers_pushed)
+                for st in di.push_stats] == [('v1', 1024, 1),
+                                             ('v2', 1024, 1)]
+
+        # In ECR under another tag, found by the digest it was pushed
+        # with: only the missing tag is put, nothing is uploaded
+        del images.calls[:]
+        image.attrs['RepoDigests'] = [repo_uri + '@sha256:abc']
+        stubber.add_response(
+            'batch_get_image',
+            {'images': [{
+                'registryId': '123456789012', 'repositoryName': 'cloudknot',
+                'imageId': {'imageDigest': 'sha256:abc', 'imageTag': 'v1'},
+                'imageManifest': image_manifest,
+                'imageManifestMediaType': media_type,
+            }], 'failures': []},
+            get_params([{'imageDigest': 'sha256:abc'},
+                        {'imageTag': 'v1'}, {'imageTag': 'v3'}])
+        )
+        stubber.add_response('put_image', {}, put_params('v3'))
+        di._push_image(images, image, ['v1', 'v3'], auth_config=None)
+        assert images.calls == []
+
+        # Found by its config digest. A tag that another client put first
+        # is not an error.
+        image.attrs['RepoDigests'] = []
+        stubber.add_response(
+            'batch_get_image',
+            {'images': [{
+                'registryId': '123456789012', 'repositoryName': 'cloudknot',
+                'imageId': {'imageDigest': 'sha256:abc', 'imageTag': 'v1'},
+                'imageManifest': image_manifest,
+                'imageManifestMediaType': media_type,
+            }], 'failures': []},
+            get_params([{'imageTag': 'v4'}])
+        )
+        stubber.add_client_error(
+            'put_image', service_error_code='ImageAlreadyExistsException',
+            http_status_code=400, expected_params=put_params('v4')
+        )
+        di._push_image(images, image, ['v4'], auth_config=None)
+        assert images.calls == []
+
+        # A failed lookup falls back on pushing
+        stubber.add_client_error(
+            'batch_get_image', service_error_code='AccessDeniedException',
+            http_status_code=400
+        )
+        di._push_image(images, image, ['v5'], auth_config=None)
+        assert images.calls == [('push', repo_uri + ':v5')]
+        stubber.assert_no_pending_responses()
+
+
+def runner_testing_func(x):
+    """Test function for the runner images of cloudknot.DockerImage"""
+    return x + 1
+
+
+def other_runner_testing_func(x):
+    """Test function with the same requirements as runner_testing_func"""
+    return x - 1
+
+
+def test_DockerImage_runner_sharing(monkeypatch):
+    client = _FakeDockerClient()
+    monkeypatch.setattr(ck.dockerimage, '_docker_client', lambda: client)
+
+    script_dir = tempfile.mkdtemp()
+    script_path = op.join(script_dir, 'script.py')
+    with open(script_path, 'w') as f:
+        f.write('print("hello")\n')
+
+    try:
+        with pytest.raises(ck.aws.CloudknotInputError):
+            ck.DockerImage(script_path=script_path, runner=True)
+        with pytest.raises(ck.aws.CloudknotInputError):
+            ck.DockerImage(func=runner_testing_func, script_path=script_path,
+                           runner=True)
+    finally:
+        shutil.rmtree(script_dir)
+
+    # Functions with the same requirements share one image and section
+    di = ck.DockerImage(func=runner_testing_func, runner=True)
+    di.build('v1')
+    other = ck.DockerImage(func=other_runner_testing_func, runner=True)
+    try:
+        assert other.name == di.name
+        assert other.build_path == di.build_path
+        assert other.images == di.images
+        assert other.image_id == di.image_id
+        assert other.func is other_runner_testing_func
+        assert di.references == 2
+
+        # Clobbering one user keeps the image for the other
+        di.clobber()
+        assert di.clobbered
+        assert op.isfile(other.docker_path)
+        assert other.references == 1
+        assert ('remove', 'cloudknot/' + di.name + ':v1') \
+            not in client.images.calls
+
+        other.clobber()
+        assert not op.exists(other.build_path)
+        assert ('remove', 'cloudknot/' + di.name + ':v1') \
+            in client.images.calls
+
+        config = configparser.ConfigParser()
+        config.read(ck.config.get_config_file())
+        assert 'docker-image ' + di.name not in config.sections()
+    finally:
+        shutil.rmtree(di.build_path, ignore_errors=True)
+        _remove_config_section('docker-image ' + di.name)
+
+
+def test_Knot_upload_function():
+    with ck.emulator.AwsEmulator(
+            runner=lambda image, command, environment: 0
+    ) as emu:
+        bucket = ck.get_s3_params().bucket
+        response = emu.batch.register_job_definition(
+            jobDefinitionName='upload-jd', type='container',
+            containerProperties={
+                'image': 'upload-image', 'vcpus': 1, 'memory': 100,
+                'user': 'cloudknot-user', 'jobRoleArn': 'upload-role',
+                'environment': [{'name': 'CLOUDKNOT_JOBS_S3_BUCKET',
+                                 'value': bucket}]
+            }
+        )
+
+        knot = ck.Knot.__new__(ck.Knot)
+        knot._name = 'upload-knot'
+        knot._job_definition = ck.aws.JobDefinition(
+            arn=response['jobDefinitionArn']
+        )
+
+        function_hash = knot._upload_function(runner_testing_func)
+        key = 'cloudknot.jobs/upload-jd/function.pickle'
+        body = emu.s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+        assert cloudpickle.loads(body)(1) == 2
+
+        # An unchanged function is not uploaded again
+        emu.s3.reset_stats()
+        assert knot._upload_function(
+            runner_testing_func, previous_hash=function_hash
+        ) == function_hash
+        assert 'put_object' not in emu.s3.call_counts
+
+        assert knot._upload_function(
+            other_runner_testing_func, previous_hash=function_hash
+        ) != function_hash
+        assert emu.s3.call_counts['put_object'] == 1
+        body = emu.s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+        assert cloudpickle.loads(body)(1) == 0
+
+
+def test_DockerImage_ensure_deps_image(monkeypatch, caplog):
+    client = _FakeDockerClient()
+    monkeypatch.setattr(ck.aws, 'get_ecr_auth_config',
+                        lambda registry_id: {'username': 'AWS'})
+    build_path = tempfile.mkdtemp()
+    di = _bare_docker_image('deps-test', build_path)
+    di._shared_deps = True
+    di._pip_imports = [{'name': 'numpy', 'version': '1.14.0'}]
+    repo_uri = '123456789012.dkr.ecr.us-east-1.amazonaws.com/cloudknot'
+
+    try:
+        # Pulled from the repository to which the image was pushed
+        di._repo_uri = repo_uri + ':v1'
+        client.images.remote[repo_uri + ':' + di.deps_tag] = True
+        di._ensure_deps_image(client)
+        assert client.images.calls == [
+            ('pull', repo_uri + ':' + di.deps_tag),
+            ('tag', di.deps_image),
+        ]
+
+        # Then found locally
+        del client.images.calls[:]
+        di._ensure_deps_image(client)
+        assert client.images.calls == []
+
+        # Built if it cannot be pulled, with a warning
+        client.images.local.clear()
+        client.images.remote.clear()
+        del client.images.calls[:]
+        with caplog.at_level(logging.WARNING, logger='cloudknot'):
+            di._ensure_deps_image(client)
+        assert client.images.calls == [
+            ('pull', repo_uri + ':' + di.deps_tag),
+            ('build', di.deps_image),
+        ]
+        assert 'Could not pull dependency image' in caplog.text
+
+        # Built without pulling if there is no repository to pull from
+        client.images.local.clear()
+        del client.images.calls[:]
+        di._repo_uri = None
+        monkeypatch.setattr(ck.aws, 'get_ecr_repo', lambda: 'cloudknot')
+        with botocore.stub.Stubber(ck.aws.clients['ecr']) as stubber:
+            stubber.add_client_error(
+                'describe_repositories',
+                service_error_code='RepositoryNotFoundException',
+                http_status_code=400
+            )
+            di._ensure_deps_image(client)
+        assert client.images.calls == [('build', di.deps_image)]
+    finally:
+        shutil.rmtree(build_path)
+        _remove_config_section('docker-image deps-test')
+
+
+def test_DockerImage_buildkit(monkeypatch, caplog):
+    client = _FakeDockerClient()
+    build_path = tempfile.mkdtemp()
+    di = _bare_docker_image('buildkit-test', build_path)
+    di._github_installs = ['https://github.com/user/repo.git']
+    di._pip_imports = [{'name': 'numpy', 'version': '1.14.0'}]
+
+    try:
+        with open(di.docker_path) as f:
+            dockerfile = f.read()
+        assert not dockerfile.startswith('# syntax')
+        assert 'pip install --no-cache-dir -r /tmp/requirements.txt' \
+            in dockerfile
+
+        # BuildKit keeps pip's cache in a cache mount, which needs the
+        # syntax header
+        di._buildkit = True
+        di._write_dockerfile()
+        with open(di.docker_path) as f:
+            dockerfile = f.read()
+        assert dockerfile.startswith('# syntax=docker/dockerfile:1\n')
+        assert ('RUN --mount=type=cache,target=/root/.cache/pip pip install '
+                '-r /tmp/requirements.txt \\\n'
+                '    && pip install git+https://github.com/user/repo.git'
+                ) in dockerfile
+        assert '--no-cache-dir' not in dockerfile
+
+        di._shared_deps = True
+        di._write_dockerfile()
+        with open(di.deps_docker_path) as f:
+            dockerfile = f.read()
+        assert dockerfile.startswith('# syntax=docker/dockerfile:1\n')
+        assert '--mount=type=cache,target=/root/.cache/pip' in dockerfile
+
+        # The build runs through the docker command line client
+        commands = []
+
+        def check_output(cmd, env, stderr):
+            commands.append((cmd, env['DOCKER_BUILDKIT']))
+            if cmd[cmd.index('--tag') + 1].endswith(':broken'):
+                raise subprocess.CalledProcessError(1, cmd, output=b'boom')
+            client.images._add(cmd[cmd.index('--tag') + 1])
+            return b'#1 DONE'
+
+        monkeypatch.setattr(ck.dockerimage.subprocess, 'check_output',
+                            check_output)
+
+        image = di._build_image(client, di.docker_path,
+                                'cloudknot/buildkit-test:v1')
+        assert image.tags == ['cloudknot/buildkit-test:v1']
+        assert commands == [(
+            ['docker', 'build', '--progress', 'plain', '--file',
+             di.docker_path, '--tag', 'cloudknot/buildkit-test:v1',
+             build_path],
+            '1'
+        )]
+        assert client.images.calls == []
+
+        with pytest.raises(subprocess.CalledProcessError):
+            di._build_image(client, di.docker_path,
+                            'cloudknot/buildkit-test:broken')
+        assert 'boom' in caplog.text
+    finally:
+        shutil.rmtree(build_path)
+        _remove_config_section('docker-image buildkit-test')
+
+
+def test_DockerImage_dockerignore():
+    build_path = tempfile.mkdtemp()
+    di = _bare_docker_image('dockerignore-test', build_path)
+
+    try:
+        di._shared_deps = True
+        di._write_dockerignore()
+        assert di._clobber_dockerignore
+        with open(di.dockerignore_path) as f:
+            lines = [line for line in f.read().splitlines()
+                     if not line.startswith('#')]
+        assert lines == ['*', '!Dockerfile', '!Dockerfile.deps',
+                         '!requirements.txt', '!dockerignore-test.py']
+
+        # A pre-existing .dockerignore is kept, and not clobbered later
+        with open(di.dockerignore_path, 'w') as f:
+            f.write('data/\n')
+        di._write_dockerignore()
+        assert not di._clobber_dockerignore
+        with open(di.dockerignore_path) as f:
+            assert f.read() == 'data/\n'
+    finally:
+        shutil.rmtree(build_path)
+        _remove_config_section('docker-image dockerignore-test')
+
+
+def test_DockerImage_report(monkeypatch):
+    client = _FakeDockerClient()
+    build_path = tempfile.mkdtemp()
+    di = _bare_docker_image('report-test', build_path)
+    image = client.images._add('cloudknot/report-test:v1')
+    image.attrs['Size'] = 150e6
+    di._image_id = image.id
+    monkeypatch.setattr(ck.dockerimage, '_docker_client', lambda: client)
+
+    class FakeContainers(object):
+        def __init__(self):
+            self.runs = []
+            self.error = None
+
+        def run(self, image, command, remove):
+            self.runs.append((image, command))
+            if self.error is not None:
+                raise self.error
+
+    client.containers = FakeContainers()
+
+    try:
+        with pytest.raises(ck.aws.CloudknotInputError):
+            di.report(n_runs=0)
+
+        report = di.report(n_runs=3)
+        assert report.image == image.id
+        assert report.image_profile == 'full'
+        assert report.size_mb == 150
+        assert report.startup_s >= 0
+        assert client.containers.runs == [(image.id, ['--help'])] * 3
+
+        # A failing container raises a cloudknot error with its output
+        client.containers.error = docker.errors.ContainerError(
+            container='container', exit_status=1, command=['--help'],
+            image=image.id, stderr=b'Traceback: boom'
+        )
+        with pytest.raises(ck.aws.PreflightError) as e:
+            di.report(n_runs=1)
+        assert e.value.exit_code == 1
+        assert 'Traceback: boom' in e.value.logs
+    finally:
+        shutil.rmtree(build_path)
+        _remove_config_section('docker-image report-test')